@@ -0,0 +1,73 @@
+"""
+Compare two benchmark.load result files, e.g. from two commits
+
+    python -m benchmark.compare before.json after.json --threshold 10
+
+Exits with status 1 if any p95 latency rose, or throughput fell, by more
+than the threshold percentage.
+"""
+
+import sys
+import json
+import argparse
+from typing import Any, Dict, Tuple
+
+
+def _by_level(report: Dict[str, Any]) -> Dict[Tuple, Dict[str, Any]]:
+    return {
+        (r["operation"], r["dataset_size"], r["concurrency"]): r
+        for r in report["results"]
+    }
+
+
+def _change(before: float, after: float) -> float:
+    return (after - before) / before * 100 if before else 0.0
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any], threshold: float) -> int:
+    """Print how each level changed and return the number of regressions"""
+    before_levels = _by_level(before)
+    after_levels = _by_level(after)
+    regressions = 0
+
+    print(
+        f"{before['meta'].get('commit') or 'before'} -> "
+        f"{after['meta'].get('commit') or 'after'}"
+    )
+    for key in sorted(before_levels.keys() & after_levels.keys()):
+        old, new = before_levels[key], after_levels[key]
+        p95 = _change(old["latency"]["p95"], new["latency"]["p95"])
+        throughput = _change(old["throughput"], new["throughput"])
+        regressed = p95 > threshold or throughput < -threshold
+        regressions += regressed
+        operation, size, concurrency = key
+        print(
+            f"{'REGRESSED' if regressed else 'ok':>9}  {operation:>7} "
+            f"size={size:<7} c={concurrency:<4} p95 {p95:+6.1f}%  "
+            f"throughput {throughput:+6.1f}%"
+        )
+
+    missing = before_levels.keys() ^ after_levels.keys()
+    if missing:
+        print(f"{len(missing)} levels were only measured in one of the runs.")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument(
+        "--threshold", type=float, default=10.0, help="Allowed change in percent"
+    )
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    sys.exit(1 if compare(before, after, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Stand-in for the Ollama API, for benchmarking without a real model
+
+Implements /api/tags, /api/pull, /api/ps and /api/generate (streaming and
+not, plus loading and unloading through keep_alive) with configurable
+latency, token rate, model load time and injected errors:
+
+    python -m benchmark.fake_ollama --port 11434 --first-token 0.2 --tokens-per-second 50
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = """agreement party parties shall terms conditions payment services
+confidential information termination notice obligations liability warranty
+indemnify governing law jurisdiction effective date clause section provided
+hereunder thereof provider client fees invoice breach remedy dispute""".split()
+
+
+class FakeOllama:
+    """Generates canned text at a fixed pace, failing some requests on purpose"""
+
+    def __init__(
+        self,
+        model: str = "mistral:7b",
+        first_token: float = 0.2,
+        tokens_per_second: float = 50.0,
+        tokens: int = 200,
+        pull_seconds: float = 1.0,
+        load_seconds: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        model_present: bool = True,
+        seed: Optional[int] = None,
+    ):
+        self.model = model
+        self.first_token = first_token
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.pull_seconds = pull_seconds
+        self.load_seconds = load_seconds
+        # When the model is unloaded again (perf_counter), if it's loaded
+        self.loaded_until: Optional[float] = None
+        self.loads = 0
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.model_present = model_present
+        self.random = random.Random(seed)
+        self.generations = 0
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _is_loaded(self) -> bool:
+        return self.loaded_until is not None and time.perf_counter() < self.loaded_until
+
+    async def _load(self, keep_alive: Any):
+        """Load the model if needed, then keep it for keep_alive like Ollama"""
+        if not self._is_loaded():
+            self.loads += 1
+            await asyncio.sleep(self.load_seconds)
+        seconds = _duration(keep_alive)
+        self.loaded_until = time.perf_counter() + seconds if seconds else None
+
+    def _should_fail(self) -> bool:
+        return self.random.random() < self.error_rate
+
+    def _text(self, prompt: str) -> List[str]:
+        # The prompt picks the words, so identical prompts get identical text
+        words = random.Random(prompt).choices(WORDS, k=self.tokens)
+        return [word + " " for word in words]
+
+    def _final(self, prompt: str, started: float) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "done": True,
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+            "prompt_eval_count": len(prompt.split()),
+            "eval_count": self.tokens,
+        }
+
+    def _error(self, message: str, status: int) -> JSONResponse:
+        return JSONResponse(status_code=status, content={"error": message})
+
+    def app(self) -> FastAPI:
+        app = FastAPI(title="Fake Ollama")
+
+        @app.get("/api/tags")
+        async def tags():
+            models = [{"name": self.model}] if self.model_present else []
+            return {"models": models}
+
+        @app.get("/api/ps")
+        async def ps():
+            if not self._is_loaded():
+                return {"models": []}
+            expires_in = timedelta(
+                seconds=min(self.loaded_until - time.perf_counter(), 10**9)
+            )
+            expires_at = datetime.now(timezone.utc) + expires_in
+            return {
+                "models": [{"name": self.model, "expires_at": expires_at.isoformat()}]
+            }
+
+        @app.post("/api/pull")
+        async def pull():
+            await asyncio.sleep(self.pull_seconds)
+            self.model_present = True
+            return {"status": "success"}
+
+        @app.post("/api/generate")
+        async def generate(request: Request):
+            body = await request.json()
+            if body.get("model") != self.model or not self.model_present:
+                return self._error(f"model '{body.get('model')}' not found", 404)
+            if self._should_fail():
+                return self._error("injected failure", self.error_status)
+
+            keep_alive = body.get("keep_alive", "5m")
+            if not body.get("prompt") and _duration(keep_alive) == 0:
+                self.loaded_until = None
+                return {"model": self.model, "done": True, "done_reason": "unload"}
+            started = time.perf_counter()
+            await self._load(keep_alive)
+            if not body.get("prompt"):
+                return {"model": self.model, "response": "", "done": True}
+
+            self.generations += 1
+            prompt = body.get("prompt", "")
+            tokens = self._text(prompt)
+            await asyncio.sleep(self.first_token)
+
+            if body.get("stream", True):
+                return StreamingResponse(
+                    self._stream(prompt, tokens, started),
+                    media_type="application/x-ndjson",
+                )
+
+            await asyncio.sleep(self._token_delay() * len(tokens))
+            # Stand-in token IDs: the context carried in, then this exchange
+            context = list(body.get("context") or [])
+            context += range(len(prompt.split()) + len(tokens))
+            return {
+                "response": "".join(tokens),
+                "context": context,
+                **self._final(prompt, started),
+            }
+
+        @app.get("/stats")
+        async def stats():
+            return {
+                "generations": self.generations,
+                "loads": self.loads,
+                "loaded": self._is_loaded(),
+            }
+
+        return app
+
+    async def _stream(
+        self, prompt: str, tokens: List[str], started: float
+    ) -> AsyncIterator[str]:
+        delay = self._token_delay()
+        for token in tokens:
+            chunk = {"model": self.model, "response": token, "done": False}
+            yield json.dumps(chunk) + "\n"
+            await asyncio.sleep(delay)
+        yield json.dumps({"response": "", **self._final(prompt, started)}) + "\n"
+
+
+def _duration(keep_alive: Any) -> float:
+    """Seconds for an Ollama keep_alive value: 300, "5m", "1h", or -1 for ever"""
+    if isinstance(keep_alive, str):
+        units = {"s": 1, "m": 60, "h": 3600}
+        if keep_alive[-1:] in units:
+            return float(keep_alive[:-1]) * units[keep_alive[-1]]
+        keep_alive = float(keep_alive)
+    return float("inf") if keep_alive < 0 else float(keep_alive)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--model", default="mistral:7b")
+    parser.add_argument(
+        "--first-token", type=float, default=0.2, help="Seconds before any output"
+    )
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--tokens", type=int, default=200, help="Tokens per reply")
+    parser.add_argument("--pull-seconds", type=float, default=1.0)
+    parser.add_argument(
+        "--load-seconds",
+        type=float,
+        default=0.0,
+        help="Seconds to load the model into memory when it isn't loaded",
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of generations to fail"
+    )
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument(
+        "--missing-model",
+        action="store_true",
+        help="Start without the model so the first generation pulls it",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    fake = FakeOllama(
+        model=args.model,
+        first_token=args.first_token,
+        tokens_per_second=args.tokens_per_second,
+        tokens=args.tokens,
+        pull_seconds=args.pull_seconds,
+        load_seconds=args.load_seconds,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        model_present=not args.missing_model,
+        seed=args.seed,
+    )
+    uvicorn.run(fake.app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+Drive load against the API and record throughput and latency percentiles
+
+Start the API against the fake Ollama (see benchmark.fake_ollama) with
+RATE_LIMIT_ENABLED=false (`make bench-api` does both), then:
+
+    python -m benchmark.load --operations create,get,list,refine \\
+        --concurrency 1,8,32 --requests 200 --dataset-sizes 1000,10000 \\
+        --output results.json
+
+With --dataset-sizes, contracts are seeded straight into Redis (using the
+same REDIS_HOST/REDIS_PORT settings as the API) until each size is reached,
+and every operation is measured at every size.
+
+A run stops if most requests at any level are rate limited, since it would
+otherwise measure how fast the API answers 429.
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from . import seed
+
+# Sends one request, given the stored contract IDs, and returns the response
+Operation = Callable[[httpx.AsyncClient, random.Random, List[int]], Awaitable[Any]]
+
+
+async def _create(client: httpx.AsyncClient, rng: random.Random, ids: List[int]):
+    # A fresh description per request, so every create reaches the model
+    description = f"Services agreement for project {rng.randint(1, 10**9)}"
+    return await client.post(
+        "/contracts/",
+        json={"title": "Benchmark", "description": description, "use_cache": False},
+    )
+
+
+async def _get(client: httpx.AsyncClient, rng: random.Random, ids: List[int]):
+    return await client.get(f"/contracts/{rng.choice(ids)}")
+
+
+async def _list(client: httpx.AsyncClient, rng: random.Random, ids: List[int]):
+    # One page from a random point in the ID range
+    return await client.get(
+        "/contracts/", params={"cursor": rng.choice(ids) - 1, "limit": 100}
+    )
+
+
+async def _refine(client: httpx.AsyncClient, rng: random.Random, ids: List[int]):
+    return await client.post(
+        "/contracts/refine/",
+        json={
+            "contract_id": rng.choice(ids),
+            "refinement_instructions": f"Change the notice period to {rng.randint(1, 90)} days",
+            "use_cache": False,
+        },
+    )
+
+
+OPERATIONS: Dict[str, Operation] = {
+    "create": _create,
+    "get": _get,
+    "list": _list,
+    "refine": _refine,
+}
+
+
+class RateLimitedRun(Exception):
+    """Raised when the API rate limits most of a level's requests"""
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    operation: str,
+    concurrency: int,
+    requests: int,
+    ids: List[int],
+    rng: random.Random,
+) -> Dict[str, Any]:
+    """Send `requests` requests with `concurrency` in flight at a time"""
+    send = OPERATIONS[operation]
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await send(client, rng, ids)
+                failed = None if response.status_code < 400 else response.status_code
+            except httpx.HTTPError as e:
+                failed = type(e).__name__
+            if failed is None:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors[str(failed)] = errors.get(str(failed), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "operation": operation,
+        "concurrency": concurrency,
+        "requests": requests,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "latency": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0.0,
+        },
+    }
+
+
+async def contract_ids(client: httpx.AsyncClient) -> List[int]:
+    """Every stored contract ID, following the listing cursor"""
+    ids: List[int] = []
+    cursor = 0
+    while True:
+        response = await client.get(
+            "/contracts/", params={"cursor": cursor, "limit": 1000, "fields": "id"}
+        )
+        response.raise_for_status()
+        ids.extend(contract["id"] for contract in response.json())
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if next_cursor is None:
+            return ids
+        cursor = int(next_cursor)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run(
+    api_url: str,
+    operations: List[str],
+    concurrency_levels: List[int],
+    requests: int,
+    dataset_sizes: List[Optional[int]],
+    warmup: int = 5,
+    random_seed: int = 0,
+) -> Dict[str, Any]:
+    """Measure every operation at every concurrency level and dataset size"""
+    rng = random.Random(random_seed)
+    limits = httpx.Limits(max_connections=max(concurrency_levels))
+    results = []
+    async with httpx.AsyncClient(
+        base_url=api_url, timeout=600.0, limits=limits
+    ) as client:
+        for size in dataset_sizes:
+            ids = await contract_ids(client)
+            if size is not None and len(ids) < size:
+                # Seeding writes to Redis directly rather than through the API
+                print(f"Seeding {size - len(ids)} contracts...")
+                await seed.seed(size - len(ids), random_seed=rng.randint(0, 10**9))
+                ids = await contract_ids(client)
+            if not ids:
+                response = await _create(client, rng, ids)
+                response.raise_for_status()
+                ids = [response.json()["id"]]
+
+            for operation in operations:
+                # Untimed requests first, so connection setup isn't measured
+                await run_level(client, operation, 1, warmup, ids, rng)
+                for concurrency in concurrency_levels:
+                    result = await run_level(
+                        client, operation, concurrency, requests, ids, rng
+                    )
+                    if result["errors"].get("429", 0) * 2 > requests:
+                        raise RateLimitedRun(
+                            f"{operation} at concurrency {concurrency} was mostly "
+                            "rate limited; run the API with RATE_LIMIT_ENABLED=false"
+                        )
+                    # Keyed on the requested size so runs line up for
+                    # comparison even though creates add contracts
+                    result["dataset_size"] = size if size is not None else len(ids)
+                    results.append(result)
+                    _print_result(result)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "api_url": api_url,
+            "requests": requests,
+        },
+        "results": results,
+    }
+
+
+def _print_result(result: Dict[str, Any]):
+    latency = result["latency"]
+    errors = sum(result["errors"].values())
+    print(
+        f"{result['operation']:>7} size={result['dataset_size']:<7} "
+        f"c={result['concurrency']:<4} {result['throughput']:8.1f} req/s  "
+        f"p50={latency['p50'] * 1000:8.1f}ms p95={latency['p95'] * 1000:8.1f}ms "
+        f"p99={latency['p99'] * 1000:8.1f}ms errors={errors}"
+    )
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="API load benchmark")
+    parser.add_argument("--api-url", default="http://localhost:8000")
+    parser.add_argument(
+        "--operations",
+        default="create,get,list,refine",
+        help=f"Comma-separated, from {', '.join(OPERATIONS)}",
+    )
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32])
+    parser.add_argument(
+        "--requests", type=int, default=100, help="Requests per operation and level"
+    )
+    parser.add_argument(
+        "--dataset-sizes",
+        type=_int_list,
+        default=None,
+        help="Seed up to each of these contract counts and measure at each",
+    )
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    operations = [op.strip() for op in args.operations.split(",") if op.strip()]
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"unknown operations: {', '.join(sorted(unknown))}")
+
+    try:
+        report = await run(
+            args.api_url,
+            operations,
+            args.concurrency,
+            args.requests,
+            sorted(args.dataset_sizes) if args.dataset_sizes else [None],
+            args.warmup,
+            args.seed,
+        )
+    except RateLimitedRun as e:
+        raise SystemExit(f"Error: {e}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
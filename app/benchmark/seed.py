@@ -0,0 +1,131 @@
+"""
+Fill Redis with synthetic contracts for benchmarking
+
+    python -m benchmark.seed --count 10000 --revisions 0.3
+"""
+
+import time
+import random
+import asyncio
+import argparse
+from typing import List, Tuple
+
+from contractgen_api import db
+from contractgen_api import service
+
+CLAUSE_TOPICS = [
+    ("Definitions", "capitalised terms have the meanings given in this section"),
+    ("Term", "this agreement starts on the effective date and runs for {n} months"),
+    ("Services", "the provider shall perform the services described in schedule {n}"),
+    ("Fees", "the client shall pay the fees within {n} days of each invoice"),
+    (
+        "Confidentiality",
+        "each party keeps the other's information secret for {n} years",
+    ),
+    ("Termination", "either party may terminate on {n} days written notice"),
+    ("Liability", "liability is capped at {n} times the fees paid in the prior year"),
+    ("Warranties", "the provider warrants the services for {n} days after delivery"),
+    ("Governing Law", "this agreement is governed by the laws of state {n}"),
+    ("Notices", "notices are given in writing to the addresses in schedule {n}"),
+]
+
+
+def synthetic_contract(rng: random.Random, clauses: int = 8) -> Tuple[str, str]:
+    """Make a contract-like (title, content) pair with numbered clauses"""
+    kind = rng.choice(["Services", "Consulting", "Licence", "Supply", "Lease"])
+    title = f"{kind} Agreement {rng.randint(1, 10**6)}"
+    lines = [f"**{title.upper()}**", ""]
+    for number, (heading, body) in enumerate(
+        rng.sample(CLAUSE_TOPICS, min(clauses, len(CLAUSE_TOPICS))), start=1
+    ):
+        text = body.format(n=rng.randint(1, 90))
+        lines.append(f"{number}. **{heading}**. {text.capitalize()}.")
+        lines.append("")
+    return title, "\n".join(lines)
+
+
+def revise(rng: random.Random, content: str) -> str:
+    """Change one clause of a contract, the way a refinement would"""
+    lines = content.split("\n")
+    clause_lines = [i for i, line in enumerate(lines) if line[:1].isdigit()]
+    i = rng.choice(clause_lines)
+    lines[i] = f"{lines[i]} Amended on revision {rng.randint(1, 10**6)}."
+    return "\n".join(lines)
+
+
+async def seed(
+    count: int,
+    revisions: float = 0.0,
+    batch_size: int = 500,
+    index: bool = False,
+    random_seed: int = 0,
+) -> List[int]:
+    """
+    Save `count` synthetic contracts and return their IDs
+
+    Args:
+        revisions: Share of the contracts saved as a revision of an earlier one
+        batch_size: Contracts written per pipeline
+        index: Also add the contracts to the search and vector indexes
+    """
+    rng = random.Random(random_seed)
+    await db.init_db()
+
+    ids: List[int] = []
+    contents = {}
+    while len(ids) < count:
+        size = min(batch_size, count - len(ids))
+        revision_count = int(size * revisions) if ids else 0
+
+        batch = [synthetic_contract(rng) for _ in range(size - revision_count)]
+        saved = await db.save_contracts(batch)
+        for contract_id, (title, content) in zip(saved, batch):
+            contents[contract_id] = (title, content)
+            if index:
+                await service.index_contract(contract_id, title, content)
+        ids.extend(saved)
+
+        for parent_id in rng.choices(ids, k=revision_count):
+            title, content = contents[parent_id]
+            content = revise(rng, content)
+            if index:
+                contract_id = await service.save_contract(
+                    title, content, parent_id=parent_id
+                )
+            else:
+                contract_id = await db.save_contract(
+                    title, content, parent_id=parent_id
+                )
+            contents[contract_id] = (title, content)
+            ids.append(contract_id)
+    return ids
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Seed Redis with contracts")
+    parser.add_argument("--count", type=int, required=True)
+    parser.add_argument(
+        "--revisions",
+        type=float,
+        default=0.0,
+        help="Share of contracts saved as revisions of earlier ones",
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--index", action="store_true", help="Also index for search (slower)"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    ids = await seed(args.count, args.revisions, args.batch_size, args.index, args.seed)
+    elapsed = time.perf_counter() - start
+    if ids:
+        print(
+            f"Seeded {len(ids)} contracts (IDs {ids[0]}-{ids[-1]}) "
+            f"in {elapsed:.1f}s ({len(ids) / elapsed:.0f}/s)."
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import hashlib
+from typing import Any, Dict, Optional
+
+from .db import get_redis
+from . import metrics
+
+# Cache configuration from environment variables
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() == "true"
+# How long a cached completion lives (seconds)
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 60 * 60))
+# Maximum number of cached completions before the least recently used go
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 10000))
+
+# Redis keys
+CACHE_KEY_PREFIX = "llmcache:entry:"
+# Sorted set of cache keys scored by last access time, for LRU eviction
+CACHE_LRU_KEY = "llmcache:lru"
+CACHE_STATS_KEY = "llmcache:stats"
+# The model the cached entries were generated with
+CACHE_MODEL_KEY = "llmcache:model"
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so formatting differences don't miss the cache"""
+    return " ".join(prompt.split())
+
+
+def prompt_hash(
+    model: str, prompt: str, options: Optional[Dict[str, Any]] = None
+) -> str:
+    """Hash a model, prompt and generation options into a stable identifier"""
+    payload = json.dumps(
+        {"model": model, "prompt": normalize_prompt(prompt), "options": options or {}},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def make_key(model: str, prompt: str, options: Optional[Dict[str, Any]] = None) -> str:
+    """Build the cache key for a model, prompt and generation options"""
+    return CACHE_KEY_PREFIX + prompt_hash(model, prompt, options)
+
+
+async def get(key: str) -> Optional[str]:
+    """Return the cached completion for a key, or None on a miss"""
+    try:
+        redis = await get_redis()
+        value = await redis.get(key)
+
+        metrics.CACHE_REQUESTS.labels(result="miss" if value is None else "hit").inc()
+        pipe = redis.pipeline(transaction=False)
+        if value is None:
+            pipe.hincrby(CACHE_STATS_KEY, "misses", 1)
+        else:
+            pipe.hincrby(CACHE_STATS_KEY, "hits", 1)
+            pipe.zadd(CACHE_LRU_KEY, {key: time.time()})
+        await pipe.execute()
+
+        return value.decode() if value is not None else None
+    except Exception as e:
+        # The cache is an optimisation; never fail a generation because of it
+        print(f"Error reading LLM cache: {e}")
+        return None
+
+
+async def set(key: str, value: str):
+    """Cache a completion, evicting the least recently used entries if full"""
+    try:
+        redis = await get_redis()
+
+        pipe = redis.pipeline(transaction=False)
+        pipe.set(key, value, ex=LLM_CACHE_TTL)
+        pipe.zadd(CACHE_LRU_KEY, {key: time.time()})
+        # Entries that expired through their TTL still sit in the LRU set
+        pipe.zremrangebyscore(CACHE_LRU_KEY, "-inf", time.time() - LLM_CACHE_TTL)
+        pipe.zcard(CACHE_LRU_KEY)
+        size = (await pipe.execute())[-1]
+
+        if size > LLM_CACHE_MAX_ENTRIES:
+            evicted = await redis.zpopmin(CACHE_LRU_KEY, size - LLM_CACHE_MAX_ENTRIES)
+            if evicted:
+                pipe = redis.pipeline(transaction=False)
+                pipe.delete(*[member for member, _ in evicted])
+                pipe.hincrby(CACHE_STATS_KEY, "evictions", len(evicted))
+                await pipe.execute()
+                metrics.CACHE_EVICTIONS.inc(len(evicted))
+    except Exception as e:
+        print(f"Error writing LLM cache: {e}")
+
+
+async def clear() -> int:
+    """Remove every cached completion and return how many were removed"""
+    redis = await get_redis()
+    removed = 0
+    async for key in redis.scan_iter(match=f"{CACHE_KEY_PREFIX}*", count=1000):
+        removed += await redis.delete(key)
+    await redis.delete(CACHE_LRU_KEY)
+    return removed
+
+
+async def invalidate_if_model_changed(model: str):
+    """Drop the cache if it was filled by a different model"""
+    redis = await get_redis()
+    previous = await redis.getset(CACHE_MODEL_KEY, model)
+    if previous is not None and previous.decode() != model:
+        print(f"Model changed from {previous.decode()} to {model}; clearing LLM cache")
+        removed = await clear()
+        print(f"Removed {removed} cached completions.")
+
+
+async def stats() -> Dict[str, Any]:
+    """Get cache hit/miss counters and current size"""
+    redis = await get_redis()
+    pipe = redis.pipeline(transaction=False)
+    pipe.hgetall(CACHE_STATS_KEY)
+    pipe.zcard(CACHE_LRU_KEY)
+    counters, entries = await pipe.execute()
+
+    counters = {k.decode(): int(v) for k, v in counters.items()}
+    hits = counters.get("hits", 0)
+    misses = counters.get("misses", 0)
+    return {
+        "enabled": LLM_CACHE_ENABLED,
+        "entries": entries,
+        "hits": hits,
+        "misses": misses,
+        "evictions": counters.get("evictions", 0),
+        "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+    }
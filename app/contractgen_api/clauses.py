@@ -0,0 +1,30 @@
+import re
+from typing import List
+
+# A line that starts a new clause: "1.", "2.3", "(a)", "Section 4",
+# "ARTICLE V", a markdown heading or a bold heading like "**Term**"
+CLAUSE_HEADING = re.compile(
+    r"""^[ \t]*(?:
+        \d+(?:\.\d+)*[.)]?[ \t]+\S
+      | \([a-z0-9]{1,3}\)[ \t]+\S
+      | (?:section|article|clause)[ \t]+[0-9ivxlc]+\b
+      | \#{1,6}[ \t]+\S
+      | \*\*[^*\n]+\*\*
+    )""",
+    re.IGNORECASE | re.MULTILINE | re.VERBOSE,
+)
+
+
+def split_clauses(content: str) -> List[str]:
+    """
+    Split contract text into clauses at their headings
+
+    The split is lossless: joining the returned pieces gives back the
+    original text exactly. Any text before the first heading is its own
+    clause.
+    """
+    starts = [match.start() for match in CLAUSE_HEADING.finditer(content)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    ends = starts[1:] + [len(content)]
+    return [content[start:end] for start, end in zip(starts, ends) if end > start]
@@ -0,0 +1,111 @@
+import os
+import zlib
+from typing import Any, Dict, Optional
+
+import orjson
+import zstandard
+
+# Codec for newly written contract records: "zstd", "zlib" or "none"
+CONTRACT_CODEC = os.environ.get("CONTRACT_CODEC", "zstd").lower()
+CONTRACT_COMPRESSION_LEVEL = int(os.environ.get("CONTRACT_COMPRESSION_LEVEL", 6))
+
+# Every encoded record starts with a header byte naming its codec. Records
+# written before compression was added are bare JSON objects, which always
+# start with "{", so they still decode as-is.
+HEADER_ZLIB = 0x01
+HEADER_ZSTD = 0x02
+# Followed by the 4-byte ID of the trained dictionary it was compressed with
+HEADER_ZSTD_DICT = 0x03
+
+# Trained zstd dictionaries by ID, and the one new records are written with
+_dictionaries: Dict[int, zstandard.ZstdCompressionDict] = {}
+_current_dictionary: Optional[int] = None
+
+_compressors: Dict[Optional[int], zstandard.ZstdCompressor] = {}
+_decompressors: Dict[Optional[int], zstandard.ZstdDecompressor] = {}
+
+
+class UnknownDictionary(Exception):
+    """Raised when a record was compressed with a dictionary not loaded here"""
+
+    def __init__(self, dict_id: int):
+        super().__init__(f"Unknown compression dictionary {dict_id}")
+        self.dict_id = dict_id
+
+
+def add_dictionary(dict_id: int, data: bytes, current: bool = False):
+    """Register a trained dictionary, optionally using it for new records"""
+    global _current_dictionary
+    _dictionaries[dict_id] = zstandard.ZstdCompressionDict(data)
+    if current:
+        _current_dictionary = dict_id
+
+
+def has_dictionary() -> bool:
+    """Whether new records are compressed with a trained dictionary"""
+    return _current_dictionary is not None
+
+
+def _compressor(dict_id: Optional[int]) -> zstandard.ZstdCompressor:
+    if dict_id not in _compressors:
+        _compressors[dict_id] = zstandard.ZstdCompressor(
+            level=CONTRACT_COMPRESSION_LEVEL,
+            dict_data=_dictionaries[dict_id] if dict_id is not None else None,
+        )
+    return _compressors[dict_id]
+
+
+def _decompressor(dict_id: Optional[int]) -> zstandard.ZstdDecompressor:
+    if dict_id not in _decompressors:
+        if dict_id is not None and dict_id not in _dictionaries:
+            raise UnknownDictionary(dict_id)
+        _decompressors[dict_id] = zstandard.ZstdDecompressor(
+            dict_data=_dictionaries[dict_id] if dict_id is not None else None,
+        )
+    return _decompressors[dict_id]
+
+
+def current_header() -> bytes:
+    """Prefix shared by every record encoded with the current settings"""
+    if CONTRACT_CODEC == "zstd":
+        if _current_dictionary is not None:
+            return bytes([HEADER_ZSTD_DICT]) + _current_dictionary.to_bytes(4, "big")
+        return bytes([HEADER_ZSTD])
+    if CONTRACT_CODEC == "zlib":
+        return bytes([HEADER_ZLIB])
+    return b"{"
+
+
+def dumps(value: Any) -> bytes:
+    """Serialize to compact JSON, as records are stored and contracts served"""
+    return orjson.dumps(value)
+
+
+def encode(record: Any) -> bytes:
+    """Serialize and compress a contract record or clause for storage"""
+    data = dumps(record)
+    if CONTRACT_CODEC == "zstd":
+        return current_header() + _compressor(_current_dictionary).compress(data)
+    if CONTRACT_CODEC == "zlib":
+        return current_header() + zlib.compress(data, CONTRACT_COMPRESSION_LEVEL)
+    return data
+
+
+def decode(value: bytes) -> Any:
+    """Decode a stored contract record or clause written with any codec"""
+    header = value[0]
+    if header == HEADER_ZSTD:
+        data = _decompressor(None).decompress(value[1:])
+    elif header == HEADER_ZSTD_DICT:
+        dict_id = int.from_bytes(value[1:5], "big")
+        data = _decompressor(dict_id).decompress(value[5:])
+    elif header == HEADER_ZLIB:
+        data = zlib.decompress(value[1:])
+    else:
+        data = value
+    return orjson.loads(data)
+
+
+def is_current(value: bytes) -> bool:
+    """Whether a stored record is already encoded with the current settings"""
+    return value.startswith(current_header())
@@ -0,0 +1,180 @@
+import os
+import zlib
+from typing import Callable, Dict, Optional
+
+import brotli
+import zstandard
+from starlette.datastructures import Headers, MutableHeaders
+
+# Response compression configuration from environment variables
+COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "true").lower() == "true"
+# Smallest response worth compressing (bytes); streamed responses are always
+# compressed, since their size isn't known up front
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+
+# Media types that compress well; everything this API serves, in practice
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson")
+
+# A compressor takes the next chunk of a body and whether it's the last one.
+# Chunks before the last are flushed, so streamed lines reach the client
+# as soon as they're generated.
+Compressor = Callable[[bytes, bool], bytes]
+
+
+def _gzip() -> Compressor:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(data: bytes, last: bool) -> bytes:
+        return compressor.compress(data) + compressor.flush(
+            zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+        )
+
+    return compress
+
+
+def _zstd() -> Compressor:
+    compressor = zstandard.ZstdCompressor(level=3).compressobj()
+
+    def compress(data: bytes, last: bool) -> bytes:
+        return compressor.compress(data) + compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_FINISH
+            if last
+            else zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    return compress
+
+
+def _brotli() -> Compressor:
+    compressor = brotli.Compressor(quality=5)
+
+    def compress(data: bytes, last: bool) -> bytes:
+        output = compressor.process(data)
+        return output + (compressor.finish() if last else compressor.flush())
+
+    return compress
+
+
+# Content codings the API can send, most preferred first
+ENCODINGS: Dict[str, Callable[[], Compressor]] = {
+    "br": _brotli,
+    "zstd": _zstd,
+    "gzip": _gzip,
+}
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """
+    Pick the content coding to send for an Accept-Encoding header
+
+    The client's highest q-value wins, then our own preference. Returns
+    None to send the body as is.
+    """
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        coding, *params = [piece.strip() for piece in part.split(";")]
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding:
+            weights[coding] = weight
+
+    best, best_weight = None, 0.0
+    for coding in ENCODINGS:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def etag_for(etag: str, coding: str) -> str:
+    """
+    The ETag of a compressed representation: "abc" sent as gzip is "abc-gzip"
+
+    Strong ETags must differ between encodings of the same resource.
+    """
+    if not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{coding}"'
+
+
+def strip_coding(etag: str) -> str:
+    """Undo etag_for, so a client's validator matches the resource's ETag"""
+    for coding in ENCODINGS:
+        suffix = f'-{coding}"'
+        if etag.endswith(suffix):
+            return etag[: -len(suffix)] + '"'
+    return etag
+
+
+def _compressible(start: dict, headers: MutableHeaders) -> bool:
+    return (
+        start["status"] not in (204, 304)
+        and "content-encoding" not in headers
+        and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+    )
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with the best coding the client accepts
+
+    Unlike Starlette's GZipMiddleware, this also speaks Brotli and zstd,
+    and gives compressed responses their own ETag.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        coding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        start: Optional[dict] = None
+        compress: Optional[Compressor] = None
+
+        async def send_compressed(message):
+            nonlocal start, compress
+            if message["type"] == "http.response.start":
+                # Hold the headers until the first chunk shows the body's size
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            last = not message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(scope=start)
+                if _compressible(start, headers) and (
+                    not last or len(body) >= self.minimum_size
+                ):
+                    headers.add_vary_header("Accept-Encoding")
+                    if coding is not None:
+                        compress = ENCODINGS[coding]()
+                        headers["Content-Encoding"] = coding
+                        if "etag" in headers:
+                            headers["ETag"] = etag_for(headers["etag"], coding)
+                        if last:
+                            body = compress(body, True)
+                            headers["Content-Length"] = str(len(body))
+                            compress = None
+                        else:
+                            del headers["Content-Length"]
+                await send(start)
+                start = None
+
+            if compress is not None:
+                body = compress(body, last)
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
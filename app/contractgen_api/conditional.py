@@ -0,0 +1,89 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+
+from .compression import strip_coding
+
+# Make caches revalidate every time: a contract never changes, but it can
+# be deleted, and listings change with every contract saved
+CACHE_CONTROL = "no-cache"
+
+
+def _digest(value: str) -> str:
+    return hashlib.blake2b(value.encode(), digest_size=8).hexdigest()
+
+
+def contract_etag(contract: Dict[str, Any]) -> str:
+    """
+    Strong ETag of a stored contract
+
+    Contracts are never modified once saved, so their ID and creation time
+    identify their content; a contract re-imported under the same ID with
+    another creation time gets another ETag.
+    """
+    return f'"{contract["id"]}-{_digest(str(contract.get("created_at")))}"'
+
+
+def listing_etag(count: int, latest_id: int, **params: Any) -> str:
+    """
+    Strong ETag of a page of the contract listing
+
+    Saving or importing a contract changes how many are listed or the
+    highest listed ID; `params` are the query that selected the page.
+    """
+    query = ",".join(f"{name}={value}" for name, value in sorted(params.items()))
+    return f'"l{count}.{latest_id}-{_digest(query)}"'
+
+
+def last_modified(created_at: Optional[str]) -> Optional[datetime]:
+    """When a contract was saved, from its created_at (API local time)"""
+    if not created_at:
+        return None
+    try:
+        return datetime.fromisoformat(created_at).astimezone(timezone.utc)
+    except ValueError:
+        return None
+
+
+def validators(etag: str, modified: Optional[datetime] = None) -> Dict[str, str]:
+    """Headers that let clients revalidate a response instead of refetching it"""
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if modified is not None:
+        headers["Last-Modified"] = format_datetime(modified, usegmt=True)
+    return headers
+
+
+def not_modified(
+    request: Request, etag: str, modified: Optional[datetime] = None
+) -> Optional[Response]:
+    """
+    A 304 response if the client's copy is current, else None
+
+    If-None-Match is checked first and, when sent, If-Modified-Since is
+    ignored. Tags match whatever encoding the client's copy was sent in.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return Response(status_code=304, headers=validators(etag, modified))
+            if strip_coding(tag.removeprefix("W/")) == etag:
+                # Echo the client's tag, which names the encoding it holds
+                return Response(status_code=304, headers=validators(tag, modified))
+        return None
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or modified is None:
+        return None
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return None
+    # HTTP dates have whole seconds
+    if since.tzinfo is not None and modified.replace(microsecond=0) <= since:
+        return Response(status_code=304, headers=validators(etag, modified))
+    return None
@@ -0,0 +1,320 @@
+import os
+import re
+import sys
+import asyncio
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from redis import asyncio as aioredis
+from redis.exceptions import ResponseError
+from redis.utils import str_if_bytes
+
+from . import codec
+from . import db
+from . import metrics
+
+# Contract cache configuration from environment variables
+CONTRACT_CACHE_ENABLED = (
+    os.environ.get("CONTRACT_CACHE_ENABLED", "true").lower() == "true"
+)
+# Most memory the cached contracts of one API process may take (bytes)
+CONTRACT_CACHE_MAX_BYTES = int(
+    os.environ.get("CONTRACT_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+)
+# Have Redis tell every replica when a cached contract's keys change, so
+# deletes and admin edits aren't served from memory; needs Redis 6 or later
+CONTRACT_CACHE_TRACKING = (
+    os.environ.get("CONTRACT_CACHE_TRACKING", "true").lower() == "true"
+)
+# How often the invalidation connections are checked (seconds). Changes made
+# while they were broken are missed, so the cache is emptied on reconnecting.
+CONTRACT_CACHE_TRACKING_CHECK = float(
+    os.environ.get("CONTRACT_CACHE_TRACKING_CHECK", 5)
+)
+# Memory taken by a cached contract besides its title and content (bytes)
+ENTRY_OVERHEAD = 600
+
+# Channel Redis publishes tracked key changes on
+INVALIDATE_CHANNEL = "__redis__:invalidate"
+# The contract a key belongs to: "contract:12", "contract:12:meta", ...
+CONTRACT_KEY = re.compile(rf"^{re.escape(db.CONTRACT_KEY_PREFIX)}(\d+)(?::|$)")
+
+# A cached lookup: the contract ID and version it was made with
+Key = Tuple[int, Optional[int]]
+
+
+def _tracking_flags(info) -> Set[str]:
+    """Flags of a CLIENT TRACKINGINFO reply, which redis-py versions parse
+    into either a dict or a flat list"""
+    if not isinstance(info, dict):
+        info = dict(zip(info[::2], info[1::2]))
+    for label, value in info.items():
+        if str_if_bytes(label) == "flags":
+            return {str_if_bytes(flag) for flag in value}
+    return set()
+
+
+def _size(contract: Dict[str, Any], body: bytes) -> int:
+    return (
+        sys.getsizeof(contract["content"])
+        + sys.getsizeof(contract["title"])
+        + sys.getsizeof(body)
+        + ENTRY_OVERHEAD
+    )
+
+
+class ContractCache:
+    """
+    Least recently used contracts, kept in memory in front of db.get_contract
+
+    Contracts are never modified once saved (refinements are new contracts),
+    so a cached one stays correct until it's deleted or edited by hand.
+    Those changes reach every replica through Redis client tracking: Redis
+    publishes the keys written under the contract prefix, and the contracts
+    they belong to are evicted.
+
+    Each contract is kept with its JSON encoding, so the API can send it
+    without serializing it again. Cached contracts are shared between
+    callers and must not be modified.
+    """
+
+    def __init__(self, max_bytes: int = CONTRACT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: "OrderedDict[Key, Tuple[Dict[str, Any], bytes, int]]" = (
+            OrderedDict()
+        )
+        # Cached lookups by every contract ID they depend on
+        self._keys: Dict[int, Set[Key]] = {}
+        # Contracts being read from Redis, and a count of invalidations that
+        # hit one mid-read; those reads aren't cached
+        self._loading: Counter = Counter()
+        self._invalidations = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def get(
+        self, contract_id: int, version: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Get a contract like db.get_contract, from memory when possible"""
+        found = await self.get_json(contract_id, version)
+        return found[0] if found is not None else None
+
+    async def get_json(
+        self, contract_id: int, version: Optional[int] = None
+    ) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        """Get a contract and its JSON encoding, from memory when possible"""
+        key = (contract_id, version)
+        found = self._lookup(key)
+        if found is not None:
+            return found
+
+        invalidations = self._invalidations
+        self._loading[contract_id] += 1
+        try:
+            contract = await db.get_contract(contract_id, version)
+        finally:
+            self._loading[contract_id] -= 1
+            if not self._loading[contract_id]:
+                del self._loading[contract_id]
+        if contract is None:
+            return None
+        body = codec.dumps(contract)
+        if invalidations == self._invalidations:
+            self._put(key, contract, body)
+        return contract, body
+
+    async def get_many_json(
+        self, contract_ids: List[int]
+    ) -> List[Optional[Tuple[Dict[str, Any], bytes]]]:
+        """
+        Get the latest of several contracts and their JSON encodings
+
+        Cached contracts come from memory and the rest are read from Redis
+        together. Those aren't cached: paging through the whole listing
+        would otherwise push out every contract that's read on its own.
+        """
+        found = {i: self._lookup((i, None)) for i in contract_ids}
+        missing = [i for i, hit in found.items() if hit is None]
+        if missing:
+            for contract_id, contract in zip(missing, await db.get_contracts(missing)):
+                if contract is not None:
+                    found[contract_id] = (contract, codec.dumps(contract))
+        return [found[i] for i in contract_ids]
+
+    def _lookup(self, key: Key) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            metrics.CONTRACT_CACHE_REQUESTS.labels("miss").inc()
+            return None
+        self._entries.move_to_end(key)
+        metrics.CONTRACT_CACHE_REQUESTS.labels("hit").inc()
+        return entry[0], entry[1]
+
+    def _put(self, key: Key, contract: Dict[str, Any], body: bytes):
+        size = _size(contract, body)
+        if size > self.max_bytes:
+            return
+        self._discard(key)
+        self._entries[key] = (contract, body, size)
+        self.bytes += size
+        for contract_id in {key[0], contract["id"]}:
+            self._keys.setdefault(contract_id, set()).add(key)
+        while self.bytes > self.max_bytes:
+            self._discard(next(iter(self._entries)))
+            metrics.CONTRACT_CACHE_EVICTIONS.labels("size").inc()
+        metrics.CONTRACT_CACHE_BYTES.set(self.bytes)
+
+    def _discard(self, key: Key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        contract, _, size = entry
+        self.bytes -= size
+        for contract_id in {key[0], contract["id"]}:
+            keys = self._keys.get(contract_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys[contract_id]
+
+    def invalidate(self, contract_id: int):
+        """Forget a contract, and every lookup that returned it"""
+        if contract_id in self._loading:
+            self._invalidations += 1
+        for key in list(self._keys.get(contract_id, ())):
+            self._discard(key)
+            metrics.CONTRACT_CACHE_EVICTIONS.labels("invalidated").inc()
+        metrics.CONTRACT_CACHE_BYTES.set(self.bytes)
+
+    def clear(self):
+        """Forget every contract"""
+        self._invalidations += 1
+        self._entries.clear()
+        self._keys.clear()
+        self.bytes = 0
+        metrics.CONTRACT_CACHE_BYTES.set(0)
+
+    def _invalidate_keys(self, keys):
+        # Redis sends no keys when the whole database was flushed
+        if keys is None:
+            self.clear()
+            return
+        for key in keys:
+            match = CONTRACT_KEY.match(str_if_bytes(key))
+            # Clause keys are named after their text, so they never change
+            # under a cached contract and aren't matched here
+            if match:
+                self.invalidate(int(match.group(1)))
+
+    def start_tracking(self):
+        """Evict contracts other replicas or admins change, in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._track())
+
+    async def stop_tracking(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _track(self):
+        while True:
+            try:
+                await self._follow_invalidations()
+            except asyncio.CancelledError:
+                raise
+            except ResponseError as e:
+                # Redis before 6 has no client tracking; don't keep asking
+                print(f"Contract cache invalidation unavailable: {e}")
+                return
+            except Exception as e:
+                print(f"Error following contract cache invalidations: {e}")
+            await asyncio.sleep(CONTRACT_CACHE_TRACKING_CHECK)
+
+    async def _follow_invalidations(self):
+        """
+        Follow invalidations until either connection breaks
+
+        One connection subscribes to the invalidation channel; the other has
+        Redis track every key under the contract prefix and redirect its
+        invalidations there. Tracking is tied to both connections, so they're
+        their own client rather than part of the shared pool.
+        """
+        client = aioredis.from_url(
+            f"redis://{db.REDIS_HOST}:{db.REDIS_PORT}", single_connection_client=True
+        )
+        pubsub = client.pubsub()
+        try:
+            await pubsub.connect()
+            await pubsub.connection.send_command("CLIENT", "ID")
+            subscriber_id = await pubsub.connection.read_response()
+            await pubsub.subscribe(INVALIDATE_CHANNEL)
+            await client.client_tracking_on(
+                clientid=subscriber_id, prefix=[db.CONTRACT_KEY_PREFIX], bcast=True
+            )
+            # Anything changed before tracking started may be cached already
+            self.clear()
+
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=CONTRACT_CACHE_TRACKING_CHECK,
+                )
+                if message is not None:
+                    self._invalidate_keys(message["data"])
+                    continue
+                # Either connection may have been silently replaced
+                flags = _tracking_flags(await client.client_trackinginfo())
+                if flags & {"off", "broken_redirect"}:
+                    raise ConnectionError("Contract cache tracking was lost")
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+# Cache instance
+_cache = None
+
+
+def get_cache() -> ContractCache:
+    """Get or create this process's contract cache"""
+    global _cache
+    if _cache is None:
+        _cache = ContractCache()
+    return _cache
+
+
+async def get_contract(
+    contract_id: int, version: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Get a contract by ID, from this process's memory when it's cached
+
+    Same as db.get_contract, which it falls back to when the cache is
+    disabled. The returned contract must not be modified.
+    """
+    if not CONTRACT_CACHE_ENABLED:
+        return await db.get_contract(contract_id, version)
+    return await get_cache().get(contract_id, version)
+
+
+async def get_contract_json(
+    contract_id: int, version: Optional[int] = None
+) -> Optional[Tuple[Dict[str, Any], bytes]]:
+    """Get a contract like get_contract, with its JSON encoding"""
+    if not CONTRACT_CACHE_ENABLED:
+        contract = await db.get_contract(contract_id, version)
+        return (contract, codec.dumps(contract)) if contract is not None else None
+    return await get_cache().get_json(contract_id, version)
+
+
+async def get_contracts_json(
+    contract_ids: List[int],
+) -> List[Optional[Tuple[Dict[str, Any], bytes]]]:
+    """Get the latest of several contracts with their JSON encodings"""
+    if not CONTRACT_CACHE_ENABLED:
+        contracts = await db.get_contracts(contract_ids)
+        return [
+            (contract, codec.dumps(contract)) if contract is not None else None
+            for contract in contracts
+        ]
+    return await get_cache().get_many_json(contract_ids)
@@ -1,7 +1,14 @@
 import os
-import json
-from typing import List, Dict, Optional, Any
+import asyncio
+import difflib
+import hashlib
+from typing import List, Dict, Optional, Any, AsyncIterator, Tuple
 from redis import asyncio as aioredis
+import zstandard
+
+from . import codec
+from .clauses import split_clauses
+from .metrics import db_timed
 
 # Get Redis connection details from environment variables
 REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
@@ -10,10 +17,135 @@ REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
 # Redis key prefixes
 CONTRACT_KEY_PREFIX = "contract:"
 CONTRACT_ID_COUNTER = "contract:id:counter"
+# Sorted set of every saved contract ID (score == ID), used for listing
+CONTRACT_INDEX_KEY = "contract:index"
+# Trained compression dictionaries by ID, and the ID new records use
+CODEC_DICTS_KEY = "contract:codec:dicts"
+CODEC_DICT_COUNTER = "contract:codec:dict:counter"
+CODEC_CURRENT_DICT_KEY = "contract:codec:dict:current"
+# Codec header the stored records were last migrated to
+CODEC_MIGRATED_KEY = "contract:codec:migrated"
+# Set once every contract has a metadata hash
+METADATA_MIGRATED_KEY = "contract:meta:migrated"
+# Contract text is stored once per unique clause under the clause's hash;
+# records list the hashes of their clauses in order
+CLAUSE_KEY_PREFIX = "contract:clause:"
+# Reference counts per clause, written by earlier versions; nothing deletes
+# contracts, so clauses are never collected and the counts aren't kept
+LEGACY_CLAUSE_REFS_KEY = "contract:clause-refs"
+# Set once every full copy is stored as clauses
+CLAUSES_MIGRATED_KEY = "contract:clauses:migrated"
+
+# Fields kept in each contract's metadata hash, so listings can skip bodies
+METADATA_FIELDS = ["id", "title", "created_at", "version", "parent_id"]
+# Fields a listing can select
+CONTRACT_FIELDS = METADATA_FIELDS + ["content"]
+
+# Refinements are stored as line deltas against the contract they refine. A
+# full copy is stored instead once a delta chain reaches this many links, so
+# rebuilding any version never needs more than this many records.
+REVISION_SNAPSHOT_INTERVAL = int(os.environ.get("REVISION_SNAPSHOT_INTERVAL", 10))
+
+# Train a zstd dictionary on stored contracts before migrating, once there
+# are enough of them; contract boilerplate makes dictionaries very effective
+CODEC_TRAIN_DICTIONARY = (
+    os.environ.get("CONTRACT_CODEC_DICTIONARY", "true").lower() == "true"
+)
+CODEC_DICT_SIZE = int(os.environ.get("CONTRACT_CODEC_DICT_SIZE", 64 * 1024))
+CODEC_DICT_SAMPLES = 2000
+CODEC_DICT_MIN_SAMPLES = 100
+
+# Listing page sizes
+DEFAULT_PAGE_SIZE = int(os.environ.get("CONTRACT_PAGE_SIZE", 100))
+MAX_PAGE_SIZE = 1000
+# Contracts read or written per round trip when exporting or importing
+EXPORT_BATCH_SIZE = 500
+
+# Saves new contract records atomically in one round trip: allocates their
+# IDs, then writes each record, its metadata hash, listing index entry,
+# clauses and revision list entry. ARGV[1] and ARGV[2] are the contract and
+# clause key prefixes and ARGV[3] the number of records; each record then
+# takes eight arguments (encoded record, title, created_at, version,
+# parent_id, root_id, the revision count its version assumes, clause count)
+# followed by a hash and encoded clause per clause. If a revision's chain
+# no longer has the assumed number of revisions, nothing is written and
+# {0, actual count} is returned; otherwise {1, last ID}.
+#
+# Contract keys are named after IDs the script allocates, and clause keys
+# after their hashes, so they can't all be declared in KEYS and wouldn't
+# share a hash slot if they were: the script needs a standalone Redis (or
+# one with replicas), not Redis Cluster.
+_SAVE_SCRIPT = """
+local prefix = ARGV[1]
+local clause_prefix = ARGV[2]
+local count = tonumber(ARGV[3])
+local records = {}
+local pos = 4
+for i = 1, count do
+    local clauses = tonumber(ARGV[pos + 7])
+    local record = {
+        value = ARGV[pos],
+        title = ARGV[pos + 1],
+        created_at = ARGV[pos + 2],
+        version = ARGV[pos + 3],
+        parent_id = ARGV[pos + 4],
+        root_id = ARGV[pos + 5],
+        clauses = clauses,
+        first_clause = pos + 8,
+    }
+    if record.root_id ~= '' then
+        local revisions = redis.call('LLEN', prefix .. record.root_id .. ':revisions')
+        if revisions ~= tonumber(ARGV[pos + 6]) then
+            return {0, revisions}
+        end
+    end
+    records[i] = record
+    pos = pos + 8 + 2 * clauses
+end
+
+local last_id = redis.call('INCRBY', KEYS[1], count)
+for i, record in ipairs(records) do
+    local id = last_id - count + i
+    local key = prefix .. id
+    redis.call('SET', key, record.value)
+    redis.call('HSET', key .. ':meta', 'id', id, 'title', record.title,
+        'created_at', record.created_at, 'version', record.version,
+        'parent_id', record.parent_id)
+    redis.call('ZADD', KEYS[2], id, id)
+    for c = record.first_clause, record.first_clause + 2 * record.clauses - 1, 2 do
+        redis.call('SET', clause_prefix .. ARGV[c], ARGV[c + 1], 'NX')
+    end
+    if record.root_id ~= '' then
+        redis.call('RPUSH', prefix .. record.root_id .. ':revisions', id)
+    end
+end
+return {1, last_id}
+"""
+
+# Raises the ID counter to at least ARGV[1], so IDs handed out after an
+# import never collide with imported contracts
+_RAISE_COUNTER_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if current < tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], ARGV[1])
+    return tonumber(ARGV[1])
+end
+return current
+"""
 
 
 # Redis client instance
 _redis_client = None
+# _SAVE_SCRIPT registered with the client, run by its SHA
+_save_script = None
+
+
+class RevisionConflict(Exception):
+    """Raised when another revision joined a chain while saving to it"""
+
+    def __init__(self, revisions: int):
+        super().__init__(f"Revision chain now has {revisions} revisions")
+        self.revisions = revisions
 
 
 async def get_redis():
@@ -24,35 +156,460 @@ async def get_redis():
     return _redis_client
 
 
+@db_timed
 async def init_db():
     """Initialize the Redis database"""
     # Redis doesn't need schema initialization like SQLite
     # Just ensure we can connect
     redis = await get_redis()
-    # Check if the ID counter exists, if not initialize it
-    if not await redis.exists(CONTRACT_ID_COUNTER):
-        await redis.set(CONTRACT_ID_COUNTER, 0)
 
+    # Contracts saved before the listing index existed need to be backfilled
+    max_id = int(await redis.get(CONTRACT_ID_COUNTER) or 0)
+    if max_id and not await redis.exists(CONTRACT_INDEX_KEY):
+        print("Building contract listing index...")
+        await rebuild_index()
 
-async def save_contract(title: str, content: str) -> int:
-    """Save a contract to Redis and return its ID"""
+    await _load_dictionaries(redis)
+
+
+async def _load_dictionaries(redis):
+    """Register every trained compression dictionary with the codec"""
+    pipe = redis.pipeline(transaction=False)
+    pipe.hgetall(CODEC_DICTS_KEY)
+    pipe.get(CODEC_CURRENT_DICT_KEY)
+    dictionaries, current = await pipe.execute()
+    for dict_id, data in dictionaries.items():
+        codec.add_dictionary(int(dict_id), data, current=dict_id == current)
+
+
+@db_timed
+async def train_dictionary() -> Optional[int]:
+    """
+    Train a zstd dictionary on the most recent contracts
+
+    New records are compressed with it from then on. Returns the
+    dictionary's ID, or None if there aren't enough contracts to train on.
+    """
     redis = await get_redis()
+    ids = await redis.zrevrange(CONTRACT_INDEX_KEY, 0, CODEC_DICT_SAMPLES - 1)
+    records = [r for r in await _load_records(redis, [int(i) for i in ids]) if r]
+    # Contract text is compressed a clause at a time, so train on clauses
+    clauses = {
+        clause
+        for content in await _resolve_contents(redis, records)
+        for clause in split_clauses(content)
+    }
+    samples = [codec.dumps(clause) for clause in clauses]
+    if len(samples) < CODEC_DICT_MIN_SAMPLES:
+        return None
+
+    try:
+        # Training is CPU bound; keep it off the event loop
+        dictionary = await asyncio.to_thread(
+            zstandard.train_dictionary, CODEC_DICT_SIZE, samples
+        )
+    except zstandard.ZstdError as e:
+        print(f"Error training compression dictionary: {e}")
+        return None
+
+    dict_id = await redis.incr(CODEC_DICT_COUNTER)
+    pipe = redis.pipeline()
+    pipe.hset(CODEC_DICTS_KEY, dict_id, dictionary.as_bytes())
+    pipe.set(CODEC_CURRENT_DICT_KEY, dict_id)
+    await pipe.execute()
+
+    codec.add_dictionary(dict_id, dictionary.as_bytes(), current=True)
+    return dict_id
+
+
+@db_timed
+async def migrate_codec(batch_size: int = 500) -> int:
+    """
+    Re-encode stored contracts that were written with an older codec
+
+    Safe to run while the API is serving: records never change once written,
+    so rewriting one with a different encoding can't lose an update.
+    Returns the number of records rewritten.
+    """
+    redis = await get_redis()
+    if (
+        codec.CONTRACT_CODEC == "zstd"
+        and CODEC_TRAIN_DICTIONARY
+        and not codec.has_dictionary()
+    ):
+        await train_dictionary()
+
+    header = codec.current_header()
+    if await redis.get(CODEC_MIGRATED_KEY) == header:
+        return 0
+
+    print("Re-encoding stored contracts...")
+    rewritten = await _migrate_clause_codec(redis)
+    cursor = 0
+    while True:
+        ids = await redis.zrangebyscore(
+            CONTRACT_INDEX_KEY, f"({cursor}", "+inf", start=0, num=batch_size
+        )
+        if not ids:
+            break
+        keys = [f"{CONTRACT_KEY_PREFIX}{int(i)}" for i in ids]
+        cursor = int(ids[-1])
+
+        pipe = redis.pipeline(transaction=False)
+        for key, value in zip(keys, await redis.mget(keys)):
+            if value and not codec.is_current(value):
+                pipe.set(key, codec.encode(await _decode_record(redis, value)))
+        if len(pipe):
+            rewritten += len(pipe)
+            await pipe.execute()
+
+    await redis.set(CODEC_MIGRATED_KEY, header)
+    print(f"Re-encoded {rewritten} contracts and clauses.")
+    return rewritten
+
+
+async def _migrate_clause_codec(redis, batch_size: int = 500) -> int:
+    """Re-encode stored clauses written with an older codec"""
+    rewritten = 0
+    keys = []
+    async for key in redis.scan_iter(match=f"{CLAUSE_KEY_PREFIX}*", count=1000):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            rewritten += await _reencode(redis, keys)
+            keys = []
+    if keys:
+        rewritten += await _reencode(redis, keys)
+    return rewritten
+
+
+async def _reencode(redis, keys: List) -> int:
+    """Rewrite the given values that aren't encoded with the current codec"""
+    pipe = redis.pipeline(transaction=False)
+    for key, value in zip(keys, await redis.mget(keys)):
+        if value and not codec.is_current(value):
+            pipe.set(key, codec.encode(await _decode_record(redis, value)))
+    rewritten = len(pipe)
+    if rewritten:
+        await pipe.execute()
+    return rewritten
+
+
+@db_timed
+async def migrate_clauses(batch_size: int = 500) -> int:
+    """
+    Move the text of contracts stored as full copies into the clause store
+
+    Safe to run while the API is serving, like migrate_codec. Returns the
+    number of records rewritten.
+    """
+    redis = await get_redis()
+    # Counts that only ever grew, from before they were dropped
+    await redis.delete(LEGACY_CLAUSE_REFS_KEY)
+    if await redis.exists(CLAUSES_MIGRATED_KEY):
+        return 0
+
+    rewritten = 0
+    cursor = 0
+    while True:
+        ids = await redis.zrangebyscore(
+            CONTRACT_INDEX_KEY, f"({cursor}", "+inf", start=0, num=batch_size
+        )
+        if not ids:
+            break
+        ids = [int(i) for i in ids]
+        cursor = ids[-1]
+
+        # Each record is rewritten with its clauses in one transaction;
+        # clauses are written with SET NX, so two replicas migrating at once
+        # store the same values
+        pipe = redis.pipeline()
+        for record in await _load_records(redis, ids):
+            if record and "content" in record:
+                _queue_write(pipe, record)
+                rewritten += 1
+        if len(pipe):
+            await pipe.execute()
+
+    await redis.set(CLAUSES_MIGRATED_KEY, 1)
+    if rewritten:
+        print(f"Moved {rewritten} contracts into the clause store.")
+    return rewritten
+
+
+@db_timed
+async def rebuild_index() -> int:
+    """Rebuild the listing index from the stored contract keys"""
+    redis = await get_redis()
+    count = 0
+    pipe = redis.pipeline(transaction=False)
+    async for key in redis.scan_iter(match=f"{CONTRACT_KEY_PREFIX}*", count=1000):
+        contract_id = _contract_id_from_key(key)
+        if contract_id is None:
+            continue
+        pipe.zadd(CONTRACT_INDEX_KEY, {contract_id: contract_id})
+        count += 1
+        if len(pipe) >= 1000:
+            await pipe.execute()
+    if len(pipe):
+        await pipe.execute()
+    return count
+
+
+def _contract_id_from_key(key) -> Optional[int]:
+    """Return the contract ID for a contract:{id} key, or None for other keys"""
+    if isinstance(key, bytes):
+        key = key.decode()
+    suffix = key[len(CONTRACT_KEY_PREFIX) :]
+    return int(suffix) if suffix.isdigit() else None
 
-    # Increment the ID counter to get a new ID
-    contract_id = await redis.incr(CONTRACT_ID_COUNTER)
+
+@db_timed
+async def save_contract(
+    title: str, content: str, parent_id: Optional[int] = None
+) -> int:
+    """
+    Save a contract to Redis and return its ID
+
+    A new contract is saved in a single round trip. A refinement first
+    reads its parent to work out the delta.
+
+    Args:
+        title: Contract title
+        content: Full contract text
+        parent_id: The contract this one refines, if any. The new contract
+            becomes the next version in the parent's revision chain and is
+            stored as a delta against it where that is smaller.
+    """
+    redis = await get_redis()
 
     # Create contract data with timestamp
     contract_data = {
-        "id": contract_id,
         "title": title,
-        "content": content,
         "created_at": import_time().isoformat(),
+        "version": 1,
     }
+    if parent_id is None:
+        contract_data["content"] = content
+        return await _save_records(redis, [contract_data])
+
+    fields, revisions = await _revision_fields(redis, content, parent_id)
+    contract_data.update(fields)
+    while True:
+        contract_data["version"] = revisions + 2
+        try:
+            return await _save_records(redis, [contract_data], [revisions])
+        except RevisionConflict as e:
+            # Another refinement of the chain was saved first; go after it
+            revisions = e.revisions
+
+
+async def _save_records(
+    redis,
+    records: List[Dict[str, Any]],
+    revisions: Optional[List[Optional[int]]] = None,
+) -> int:
+    """
+    Save new contract records with _SAVE_SCRIPT and return the first's ID
+
+    Records are stored without their ID, which is only known once the
+    script runs; _load_records adds it back from the key. The script writes
+    keys it isn't passed, so this needs a standalone Redis, not a Cluster.
+
+    Args:
+        revisions: For each record that is a revision, how many revisions
+            its chain has before it; its version assumes that many
+
+    Raises:
+        RevisionConflict: If a chain no longer has that many revisions
+    """
+    global _save_script
+    if _save_script is None:
+        _save_script = redis.register_script(_SAVE_SCRIPT)
+
+    args = [CONTRACT_KEY_PREFIX, CLAUSE_KEY_PREFIX, len(records)]
+    for record, revision_count in zip(records, revisions or [None] * len(records)):
+        stored = dict(record)
+        clauses = []
+        if "content" in stored:
+            clauses = _clause_values(stored.pop("content"))
+            stored["clauses"] = [clause_hash for clause_hash, _ in clauses]
+        args += [
+            codec.encode(stored),
+            record["title"],
+            record.get("created_at") or "",
+            record.get("version", 1),
+            record.get("parent_id") or "",
+            record.get("root_id") or "",
+            revision_count if revision_count is not None else "",
+            len(clauses),
+        ]
+        for clause in clauses:
+            args.extend(clause)
+
+    saved, value = await _save_script(
+        keys=[CONTRACT_ID_COUNTER, CONTRACT_INDEX_KEY], args=args
+    )
+    if not saved:
+        raise RevisionConflict(value)
+    return value - len(records) + 1
+
+
+def _queue_write(pipe, contract_data: Dict[str, Any]):
+    """Queue the writes that store a contract record on a pipeline"""
+    contract_id = contract_data["id"]
+    record = dict(contract_data)
+    if "content" in record:
+        record["clauses"] = _queue_clauses(pipe, record.pop("content"))
+    pipe.set(f"{CONTRACT_KEY_PREFIX}{contract_id}", codec.encode(record))
+    pipe.hset(_metadata_key(contract_id), mapping=_metadata(contract_data))
+    pipe.zadd(CONTRACT_INDEX_KEY, {contract_id: contract_id})
+
+
+def _queue_clauses(pipe, content: str) -> List[str]:
+    """
+    Queue the writes that store a contract's clauses, returning their hashes
+
+    Clauses already stored by another contract aren't written again.
+    """
+    hashes = []
+    for clause_hash, value in _clause_values(content):
+        pipe.set(f"{CLAUSE_KEY_PREFIX}{clause_hash}", value, nx=True)
+        hashes.append(clause_hash)
+    return hashes
+
+
+def _clause_values(content: str) -> List[Tuple[str, bytes]]:
+    """The hash and encoded value of each clause of a contract, in order"""
+    return [
+        (_clause_hash(clause), codec.encode(clause))
+        for clause in split_clauses(content)
+    ]
+
+
+def _clause_hash(clause: str) -> str:
+    """Content address of a clause"""
+    return hashlib.blake2b(clause.encode(), digest_size=16).hexdigest()
+
 
-    # Save to Redis
-    await redis.set(f"{CONTRACT_KEY_PREFIX}{contract_id}", json.dumps(contract_data))
+def _metadata_key(contract_id: int) -> str:
+    """Key of the hash holding a contract's metadata without its body"""
+    return f"{CONTRACT_KEY_PREFIX}{contract_id}:meta"
+
+
+def _metadata(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Metadata hash fields for a contract record"""
+    return {
+        "id": record["id"],
+        "title": record["title"],
+        "created_at": record.get("created_at", ""),
+        "version": record.get("version", 1),
+        # Hashes can't hold None; the original version has no parent
+        "parent_id": record.get("parent_id") or "",
+    }
+
+
+def _parse_metadata(values: List[Optional[bytes]]) -> Optional[Dict[str, Any]]:
+    """Turn HMGET results for METADATA_FIELDS back into a metadata dict"""
+    if values[0] is None:
+        return None
+    meta = dict(zip(METADATA_FIELDS, (v.decode() for v in values)))
+    meta["id"] = int(meta["id"])
+    meta["version"] = int(meta["version"])
+    meta["parent_id"] = int(meta["parent_id"]) if meta["parent_id"] else None
+    meta["created_at"] = meta["created_at"] or None
+    return meta
+
+
+async def _revision_fields(
+    redis, content: str, parent_id: int
+) -> Tuple[Dict[str, Any], int]:
+    """
+    Work out how to store a refinement of parent_id
+
+    Returns the record fields and how many revisions the chain has so far.
+    """
+    parent = (await _load_records(redis, [parent_id]))[0]
+    if parent is None:
+        raise ValueError(f"Parent contract {parent_id} not found")
+
+    # Every version of a contract is listed under its original (version 1)
+    root_id = parent.get("root_id", parent["id"])
+    parent_contents, revisions = await asyncio.gather(
+        _resolve_contents(redis, [parent]), redis.llen(_revisions_key(root_id))
+    )
+    parent_content = parent_contents[0]
+
+    fields = {"root_id": root_id, "parent_id": parent_id}
+
+    # Records needed to rebuild the parent, starting from a full copy
+    chain = parent["chain"] + [parent_id] if "delta" in parent else [parent_id]
+    delta = _diff(parent_content, content)
+    if len(chain) < REVISION_SNAPSHOT_INTERVAL and len(codec.dumps(delta)) < len(
+        content.encode()
+    ):
+        fields["chain"] = chain
+        fields["delta"] = delta
+    else:
+        fields["content"] = content
+    return fields, revisions
+
+
+def _revisions_key(root_id: int) -> str:
+    """Key of the list of revision IDs (versions 2 and up) of a contract"""
+    return f"{CONTRACT_KEY_PREFIX}{root_id}:revisions"
+
+
+def _diff(old: str, new: str) -> List[List[Any]]:
+    """Line delta turning old into new: [start, end, replacement lines] ops"""
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    return [
+        [i1, i2, new_lines[j1:j2]]
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def _apply_delta(old: str, delta: List[List[Any]]) -> str:
+    """Apply a delta produced by _diff"""
+    old_lines = old.splitlines(keepends=True)
+    lines = []
+    position = 0
+    for start, end, replacement in delta:
+        lines.extend(old_lines[position:start])
+        lines.extend(replacement)
+        position = end
+    lines.extend(old_lines[position:])
+    return "".join(lines)
+
+
+@db_timed
+async def save_contracts(contracts: List[Tuple[str, str]]) -> List[int]:
+    """
+    Save several contracts in one round trip and return their IDs
+
+    Args:
+        contracts: (title, content) pairs, saved in the order given
+    """
+    if not contracts:
+        return []
+    redis = await get_redis()
 
-    return contract_id
+    created_at = import_time().isoformat()
+    first_id = await _save_records(
+        redis,
+        [
+            {
+                "title": title,
+                "content": content,
+                "created_at": created_at,
+                "version": 1,
+            }
+            for title, content in contracts
+        ],
+    )
+    return list(range(first_id, first_id + len(contracts)))
 
 
 def import_time():
@@ -62,47 +619,437 @@ def import_time():
     return datetime.now()
 
 
-async def get_contract(contract_id: int) -> Optional[Dict[str, Any]]:
-    """Get a contract by ID from Redis"""
+async def _load_records(redis, contract_ids: List[int]) -> List[Optional[Dict]]:
+    """Fetch stored contract records in one round trip"""
+    if not contract_ids:
+        return []
+    values = await redis.mget([f"{CONTRACT_KEY_PREFIX}{i}" for i in contract_ids])
+    records = []
+    for contract_id, value in zip(contract_ids, values):
+        record = await _decode_record(redis, value) if value else None
+        if record is not None:
+            # Records saved by _SAVE_SCRIPT don't hold their own ID
+            record["id"] = contract_id
+        records.append(record)
+    return records
+
+
+async def _decode_record(redis, value: bytes) -> Any:
+    """Decode a stored value, loading dictionaries trained by other replicas"""
+    try:
+        return codec.decode(value)
+    except codec.UnknownDictionary:
+        await _load_dictionaries(redis)
+        return codec.decode(value)
+
+
+async def _resolve_contents(redis, records: List[Dict[str, Any]]) -> List[str]:
+    """
+    Rebuild the full content of stored records
+
+    Records stored as deltas are rebuilt from their chain; every chain record
+    not already in `records` is fetched in a single round trip, and then
+    every clause of the full copies involved in one more.
+    """
+    by_id = {record["id"]: record for record in records}
+    missing = {
+        chain_id
+        for record in records
+        if "delta" in record
+        for chain_id in record["chain"]
+        if chain_id not in by_id
+    }
+    missing = sorted(missing)
+    for chain_id, record in zip(missing, await _load_records(redis, missing)):
+        if record is None:
+            raise ValueError(f"Revision chain record {chain_id} is missing")
+        by_id[chain_id] = record
+
+    clauses = await _load_clauses(
+        redis,
+        {
+            clause_hash
+            for record in by_id.values()
+            for clause_hash in record.get("clauses", ())
+        },
+    )
+
+    contents: Dict[int, str] = {}
+
+    def full_copy(record: Dict[str, Any]) -> str:
+        if "clauses" in record:
+            return "".join(clauses[clause_hash] for clause_hash in record["clauses"])
+        # Records saved before the clause store hold their text inline
+        return record["content"]
+
+    def content_of(record: Dict[str, Any]) -> str:
+        if record["id"] not in contents:
+            if "delta" in record:
+                # chain[0] is a full copy; each later link is a delta on the last
+                content = full_copy(by_id[record["chain"][0]])
+                for chain_id in record["chain"][1:]:
+                    content = _apply_delta(content, by_id[chain_id]["delta"])
+                contents[record["id"]] = _apply_delta(content, record["delta"])
+            else:
+                contents[record["id"]] = full_copy(record)
+        return contents[record["id"]]
+
+    return [content_of(record) for record in records]
+
+
+async def _load_clauses(redis, clause_hashes) -> Dict[str, str]:
+    """Fetch clause texts by hash in one round trip"""
+    clause_hashes = list(clause_hashes)
+    if not clause_hashes:
+        return {}
+    values = await redis.mget([f"{CLAUSE_KEY_PREFIX}{h}" for h in clause_hashes])
+    clauses = {}
+    for clause_hash, value in zip(clause_hashes, values):
+        if value is None:
+            raise ValueError(f"Clause {clause_hash} is missing")
+        clauses[clause_hash] = await _decode_record(redis, value)
+    return clauses
+
+
+def _contract_view(record: Dict[str, Any], content: str) -> Dict[str, Any]:
+    """Public fields of a stored contract"""
+    return {
+        "id": record["id"],
+        "title": record["title"],
+        "content": content,
+        "created_at": record.get("created_at"),
+        # Contracts saved before revision tracking are all first versions
+        "version": record.get("version", 1),
+        "parent_id": record.get("parent_id"),
+    }
+
+
+async def _load_metadata(redis, contract_ids: List[int]) -> List[Optional[Dict]]:
+    """
+    Fetch contract metadata in one round trip, without reading any bodies
+
+    Contracts whose metadata hash hasn't been backfilled yet fall back to
+    their full record.
+    """
+    pipe = redis.pipeline(transaction=False)
+    for contract_id in contract_ids:
+        pipe.hmget(_metadata_key(contract_id), METADATA_FIELDS)
+    metadata = [_parse_metadata(values) for values in await pipe.execute()]
+
+    missing = [i for i, meta in zip(contract_ids, metadata) if meta is None]
+    if missing:
+        records = dict(zip(missing, await _load_records(redis, missing)))
+        metadata = [
+            meta or (_metadata_view(records[i]) if records[i] is not None else None)
+            for i, meta in zip(contract_ids, metadata)
+        ]
+    return metadata
+
+
+@db_timed
+async def get_contracts_metadata(
+    contract_ids: List[int],
+) -> List[Optional[Dict[str, Any]]]:
+    """Get metadata (everything but the content) for several contracts"""
+    redis = await get_redis()
+    return await _load_metadata(redis, contract_ids)
+
+
+def _metadata_view(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Metadata fields of a full contract record"""
+    view = _contract_view(record, "")
+    del view["content"]
+    return view
+
+
+@db_timed
+async def backfill_metadata(batch_size: int = 500) -> int:
+    """Create metadata hashes for contracts saved before they existed"""
+    redis = await get_redis()
+    if await redis.exists(METADATA_MIGRATED_KEY):
+        return 0
+
+    created = 0
+    cursor = 0
+    while True:
+        ids = await redis.zrangebyscore(
+            CONTRACT_INDEX_KEY, f"({cursor}", "+inf", start=0, num=batch_size
+        )
+        if not ids:
+            break
+        ids = [int(i) for i in ids]
+        cursor = ids[-1]
+
+        pipe = redis.pipeline(transaction=False)
+        for contract_id in ids:
+            pipe.exists(_metadata_key(contract_id))
+        exists = await pipe.execute()
+        missing = [i for i, found in zip(ids, exists) if not found]
+
+        pipe = redis.pipeline(transaction=False)
+        for record in await _load_records(redis, missing):
+            if record:
+                pipe.hset(_metadata_key(record["id"]), mapping=_metadata(record))
+        if len(pipe):
+            created += len(pipe)
+            await pipe.execute()
+
+    await redis.set(METADATA_MIGRATED_KEY, 1)
+    if created:
+        print(f"Created metadata for {created} contracts.")
+    return created
+
+
+@db_timed
+async def get_contract(
+    contract_id: int, version: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Get a contract by ID from Redis
+
+    Args:
+        contract_id: Any contract in a revision chain
+        version: Return this version of the contract instead of contract_id
+            itself; version 1 is the original contract
+    """
     redis = await get_redis()
 
     # Get contract data from Redis
-    contract_data = await redis.get(f"{CONTRACT_KEY_PREFIX}{contract_id}")
+    record = (await _load_records(redis, [contract_id]))[0]
+    if record is None:
+        return None
+
+    if version is not None and version != record.get("version", 1):
+        version_id = await _version_id(redis, record, version)
+        if version_id is None:
+            return None
+        record = (await _load_records(redis, [version_id]))[0]
+        if record is None:
+            return None
+
+    content = (await _resolve_contents(redis, [record]))[0]
+    return _contract_view(record, content)
+
+
+async def _version_id(redis, record: Dict[str, Any], version: int) -> Optional[int]:
+    """ID of the given version in a contract's revision chain"""
+    root_id = record.get("root_id", record["id"])
+    if version == 1:
+        return root_id
+    if version < 1:
+        return None
+    version_id = await redis.lindex(_revisions_key(root_id), version - 2)
+    return int(version_id) if version_id is not None else None
 
-    if contract_data:
-        contract = json.loads(contract_data)
-        return {
-            "id": contract["id"],
-            "title": contract["title"],
-            "content": contract["content"],
-        }
 
-    return None
+@db_timed
+async def get_versions(contract_id: int) -> Optional[List[Dict[str, Any]]]:
+    """List every version of a contract, without their content"""
+    redis = await get_redis()
+
+    record = (await _load_records(redis, [contract_id]))[0]
+    if record is None:
+        return None
+
+    root_id = record.get("root_id", record["id"])
+    revision_ids = await redis.lrange(_revisions_key(root_id), 0, -1)
+    ids = [root_id] + [int(i) for i in revision_ids]
+
+    return [meta for meta in await _load_metadata(redis, ids) if meta]
+
+
+@db_timed
+async def get_contracts_page(
+    cursor: int = 0,
+    limit: int = DEFAULT_PAGE_SIZE,
+    fields: Optional[List[str]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    Get one page of contracts ordered by ID
+
+    Args:
+        cursor: Only contracts with an ID greater than this are returned
+        limit: Maximum number of contracts to return
+        fields: Only return these fields (see CONTRACT_FIELDS). Unless
+            "content" is among them, contract bodies are never read.
+
+    Returns:
+        The contracts on the page and the cursor for the next page, or None
+        if this is the last page
+    """
+    redis = await get_redis()
+    ids, next_cursor = await _page_ids(redis, cursor, limit)
+    if not ids:
+        return [], None
+
+    if fields is not None and "content" not in fields:
+        metadata = [meta for meta in await _load_metadata(redis, ids) if meta]
+        return [_select(meta, fields) for meta in metadata], next_cursor
+
+    contracts = [contract for contract in await _load_contracts(redis, ids) if contract]
+    if fields is not None:
+        contracts = [_select(contract, fields) for contract in contracts]
+    return contracts, next_cursor
+
+
+async def _page_ids(redis, cursor: int, limit: int) -> Tuple[List[int], Optional[int]]:
+    """IDs on one page of the listing, and the cursor for the next page"""
+    # Ask for one extra ID so we know whether another page follows
+    ids = await redis.zrangebyscore(
+        CONTRACT_INDEX_KEY, f"({cursor}", "+inf", start=0, num=limit + 1
+    )
+    ids = [int(contract_id) for contract_id in ids]
+    if len(ids) > limit:
+        return ids[:limit], ids[limit - 1]
+    return ids, None
+
+
+async def _load_contracts(redis, contract_ids: List[int]) -> List[Optional[Dict]]:
+    """Public fields of several contracts, including their content"""
+    # Fetch every record in a single round trip
+    records = await _load_records(redis, contract_ids)
+    found = [record for record in records if record]
+
+    # Refinements stored as deltas need one more round trip for their chains
+    contents = iter(await _resolve_contents(redis, found))
+    return [_contract_view(r, next(contents)) if r else None for r in records]
+
+
+@db_timed
+async def get_page_ids(
+    cursor: int = 0, limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[int], Optional[int]]:
+    """IDs of one page of contracts, as get_contracts_page would return it"""
+    redis = await get_redis()
+    return await _page_ids(redis, cursor, limit)
+
+
+@db_timed
+async def get_contracts(contract_ids: List[int]) -> List[Optional[Dict[str, Any]]]:
+    """Get several contracts by ID, None for those that don't exist"""
+    redis = await get_redis()
+    return await _load_contracts(redis, contract_ids)
+
 
+@db_timed
+async def get_listing_version() -> Tuple[int, int]:
+    """
+    How many contracts are listed and the highest listed ID
 
+    Together they change whenever a contract is saved, imported or removed
+    from the listing, so clients can tell whether a page they hold is stale.
+    """
+    redis = await get_redis()
+    pipe = redis.pipeline(transaction=False)
+    pipe.zcard(CONTRACT_INDEX_KEY)
+    pipe.zrange(CONTRACT_INDEX_KEY, -1, -1)
+    count, latest = await pipe.execute()
+    return count, int(latest[0]) if latest else 0
+
+
+def _select(contract: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """Keep only the requested fields of a contract"""
+    return {field: contract[field] for field in fields}
+
+
+@db_timed
 async def get_all_contracts() -> List[Dict[str, Any]]:
     """Get all contracts from Redis"""
+    contracts = []
+    cursor = 0
+    while True:
+        page, cursor = await get_contracts_page(cursor, MAX_PAGE_SIZE)
+        contracts.extend(page)
+        if cursor is None:
+            return contracts
+
+
+async def export_contracts(
+    after: int = 0, batch_size: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield every contract with an ID greater than `after`, in ID order
+
+    Contracts are read a batch at a time, so memory use doesn't grow with
+    the store. Each has the fields of get_contract plus "root_id", the
+    original version of its revision chain, which import_contracts needs
+    to rebuild the chain.
+    """
+    cursor = after
+    while True:
+        contracts, cursor = await _export_batch(cursor, batch_size)
+        for contract in contracts:
+            yield contract
+        if cursor is None:
+            return
+
+
+@db_timed
+async def _export_batch(
+    cursor: int, batch_size: int
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """One batch of export_contracts, and the cursor for the next or None"""
     redis = await get_redis()
+    ids = await redis.zrangebyscore(
+        CONTRACT_INDEX_KEY, f"({cursor}", "+inf", start=0, num=batch_size
+    )
+    if not ids:
+        return [], None
+    ids = [int(i) for i in ids]
 
-    # Get the current max ID
-    max_id = await redis.get(CONTRACT_ID_COUNTER)
-    if not max_id:
+    records = [record for record in await _load_records(redis, ids) if record]
+    contracts = []
+    for record, content in zip(records, await _resolve_contents(redis, records)):
+        contract = _contract_view(record, content)
+        contract["root_id"] = record.get("root_id", record["id"])
+        contracts.append(contract)
+    return contracts, ids[-1] if len(ids) == batch_size else None
+
+
+@db_timed
+async def import_contracts(contracts: List[Dict[str, Any]]) -> List[int]:
+    """
+    Store exported contracts under their original IDs
+
+    Contracts are written in one pipeline, as full copies; the clause store
+    keeps revisions that share most of their text small. Contracts whose
+    ID is already taken are skipped, so an interrupted import can simply be
+    sent again. Revisions must come after the versions before them, as
+    export_contracts yields them.
+
+    Returns:
+        The IDs of the contracts imported
+    """
+    if not contracts:
         return []
+    redis = await get_redis()
 
-    max_id = int(max_id)
-    contracts = []
+    pipe = redis.pipeline(transaction=False)
+    for contract in contracts:
+        pipe.exists(f"{CONTRACT_KEY_PREFIX}{contract['id']}")
+    exists = await pipe.execute()
+    new = [contract for contract, found in zip(contracts, exists) if not found]
 
-    # Get all contracts by their IDs
-    for contract_id in range(1, max_id + 1):
-        contract_data = await redis.get(f"{CONTRACT_KEY_PREFIX}{contract_id}")
-        if contract_data:
-            contract = json.loads(contract_data)
-            contracts.append(
-                {
-                    "id": contract["id"],
-                    "title": contract["title"],
-                    "content": contract["content"],
-                }
-            )
-
-    return contracts
+    pipe = redis.pipeline()
+    for contract in new:
+        record = {
+            "id": contract["id"],
+            "title": contract["title"],
+            "content": contract["content"],
+            "created_at": contract.get("created_at"),
+            "version": contract.get("version") or 1,
+        }
+        if contract.get("parent_id") is not None:
+            record["parent_id"] = contract["parent_id"]
+            record["root_id"] = contract.get("root_id") or contract["parent_id"]
+            pipe.rpush(_revisions_key(record["root_id"]), record["id"])
+        _queue_write(pipe, record)
+    if new:
+        await pipe.execute()
+        await redis.eval(
+            _RAISE_COUNTER_SCRIPT,
+            1,
+            CONTRACT_ID_COUNTER,
+            max(contract["id"] for contract in new),
+        )
+    return [contract["id"] for contract in new]
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from redis.exceptions import ResponseError
+
+from .db import get_redis
+from . import metrics
+from . import service
+
+# Job queue configuration from environment variables
+# Number of worker coroutines per API process; this bounds concurrent
+# generations sent to Ollama from the job queue
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# How long finished job records are kept (seconds)
+JOB_TTL = int(os.environ.get("JOB_TTL", 24 * 60 * 60))
+# Jobs a worker has held for longer than this are assumed lost and retried
+JOB_CLAIM_IDLE = int(os.environ.get("JOB_CLAIM_IDLE", 15 * 60))
+
+# Redis keys
+JOB_STREAM = "jobs:stream"
+JOB_GROUP = "workers"
+JOB_KEY_PREFIX = "job:"
+# Sorted set of queued job IDs scored by enqueue time, for queue positions
+JOB_QUEUE_KEY = "jobs:queued"
+# Sorted set of job IDs being run, scored by when they're assumed lost; with
+# the queue, this is what admission control counts as pending jobs
+JOB_RUNNING_KEY = "jobs:running"
+
+# Job handlers by kind; each receives the job's payload as keyword arguments
+HANDLERS: Dict[str, Callable[..., Awaitable[Dict[str, Any]]]] = {
+    "create": service.create_contract,
+    "refine": service.refine_contract,
+}
+
+# Worker tasks running in this process
+_workers: List[asyncio.Task] = []
+
+
+async def enqueue(kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Queue a generation job and return its status"""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    redis = await get_redis()
+    job_id = uuid.uuid4().hex
+    now = time.time()
+
+    pipe = redis.pipeline()
+    pipe.hset(
+        f"{JOB_KEY_PREFIX}{job_id}",
+        mapping={
+            "id": job_id,
+            "kind": kind,
+            "payload": json.dumps(payload),
+            "status": "queued",
+            "queued_at": now,
+        },
+    )
+    pipe.zadd(JOB_QUEUE_KEY, {job_id: now})
+    pipe.xadd(JOB_STREAM, {"job_id": job_id})
+    await pipe.execute()
+
+    return await get_job(job_id)
+
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Get a job's status, queue position and timing"""
+    redis = await get_redis()
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.hgetall(f"{JOB_KEY_PREFIX}{job_id}")
+    pipe.zrank(JOB_QUEUE_KEY, job_id)
+    pipe.zcard(JOB_QUEUE_KEY)
+    data, rank, queue_length = await pipe.execute()
+    if not data:
+        return None
+
+    data = {k.decode(): v.decode() for k, v in data.items()}
+    queued_at = float(data["queued_at"])
+    started_at = float(data["started_at"]) if "started_at" in data else None
+    finished_at = float(data["finished_at"]) if "finished_at" in data else None
+
+    job = {
+        "id": job_id,
+        "kind": data["kind"],
+        "status": data["status"],
+        # 1 means next in line; None once a worker has picked the job up
+        "position": rank + 1 if rank is not None else None,
+        "queue_length": queue_length,
+        "queued_at": queued_at,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "wait_seconds": (started_at or time.time()) - queued_at,
+        "run_seconds": (finished_at or time.time()) - started_at
+        if started_at
+        else None,
+        "contract_id": int(data["contract_id"]) if "contract_id" in data else None,
+        "error": data.get("error"),
+    }
+    return job
+
+
+async def _ensure_group():
+    """Create the consumer group (and stream) if they don't exist yet"""
+    redis = await get_redis()
+    try:
+        await redis.xgroup_create(JOB_STREAM, JOB_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def _run_job(job_id: str):
+    """Run one job and record its outcome"""
+    redis = await get_redis()
+    key = f"{JOB_KEY_PREFIX}{job_id}"
+
+    started_at = time.time()
+    pipe = redis.pipeline()
+    pipe.zrem(JOB_QUEUE_KEY, job_id)
+    pipe.zadd(JOB_RUNNING_KEY, {job_id: started_at + JOB_CLAIM_IDLE})
+    pipe.hset(key, mapping={"status": "running", "started_at": started_at})
+    pipe.hmget(key, "kind", "payload", "queued_at")
+    kind, payload, queued_at = (await pipe.execute())[-1]
+    if kind is None:
+        # The job record expired or was removed; nothing to do
+        await redis.zrem(JOB_RUNNING_KEY, job_id)
+        return
+    metrics.JOB_QUEUE_WAIT.labels(kind.decode()).observe(started_at - float(queued_at))
+
+    try:
+        result = await HANDLERS[kind.decode()](**json.loads(payload))
+        outcome = {"status": "done", "contract_id": result["id"]}
+    except service.ContractNotFound:
+        outcome = {"status": "failed", "error": "Contract not found"}
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}")
+        outcome = {"status": "failed", "error": str(e)}
+
+    pipe = redis.pipeline()
+    pipe.hset(key, mapping={**outcome, "finished_at": time.time()})
+    pipe.expire(key, JOB_TTL)
+    pipe.zrem(JOB_RUNNING_KEY, job_id)
+    await pipe.execute()
+
+
+async def _worker(consumer: str):
+    """Consume jobs from the stream one at a time"""
+    redis = await get_redis()
+    while True:
+        try:
+            # Pick up jobs abandoned by a worker that died mid-generation
+            _, claimed, *_ = await redis.xautoclaim(
+                JOB_STREAM,
+                JOB_GROUP,
+                consumer,
+                min_idle_time=JOB_CLAIM_IDLE * 1000,
+                count=1,
+            )
+            if not claimed:
+                response = await redis.xreadgroup(
+                    JOB_GROUP, consumer, {JOB_STREAM: ">"}, count=1, block=5000
+                )
+                claimed = response[0][1] if response else []
+
+            for message_id, fields in claimed:
+                await _run_job(fields[b"job_id"].decode())
+                await redis.xack(JOB_STREAM, JOB_GROUP, message_id)
+                await redis.xdel(JOB_STREAM, message_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Job worker {consumer} error: {e}")
+            await asyncio.sleep(1)
+
+
+async def start_workers(count: int = JOB_WORKERS):
+    """Start the job worker coroutines for this process"""
+    await _ensure_group()
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    for n in range(count):
+        _workers.append(asyncio.create_task(_worker(f"{prefix}-{n}")))
+    print(f"Started {count} job workers.")
+
+
+async def stop_workers():
+    """Cancel this process's job workers"""
+    for task in _workers:
+        task.cancel()
+    _workers.clear()
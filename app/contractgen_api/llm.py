@@ -1,26 +1,582 @@
 import os
+import json
+import time
+import asyncio
+import contextlib
+from typing import Any, AsyncIterator, Collection, Dict, List, Optional, Tuple
+
 import httpx
 
+from . import cache
+from . import metrics
+from . import singleflight
+
 # Get configuration from environment variables
 PROVIDER = os.environ.get("PROVIDER", "ollama")
 MODEL = os.environ.get("MODEL", "mistral:7b")
+# One Ollama base URL, or several separated by commas to spread generations
 OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+# How often the background task re-checks Ollama and the model (seconds)
+OLLAMA_REFRESH_INTERVAL = float(os.environ.get("OLLAMA_REFRESH_INTERVAL", 30))
+# Size of the shared connection pool to each Ollama backend
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get("OLLAMA_MAX_CONNECTIONS", 100))
+# Most generations sent to one backend at a time; 0 for no limit. Once every
+# backend is full, further generations wait for a free slot.
+OLLAMA_BACKEND_CONCURRENCY = int(os.environ.get("OLLAMA_BACKEND_CONCURRENCY", 0))
+# How long Ollama keeps the model in memory after each request, in Ollama's
+# keep_alive format ("30m", "1h", seconds, or -1 for ever). The residency
+# manager unloads it sooner once it has been idle for a while.
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+# Weight of the newest response time in a backend's latency moving average
+OLLAMA_LATENCY_SMOOTHING = 0.2
+# Longest Ollama context (in tokens) a session carries into a follow-up
+# generation; longer sessions start over, since the model would only see
+# the end of them anyway. Match it to the model's num_ctx.
+OLLAMA_SESSION_MAX_TOKENS = int(os.environ.get("OLLAMA_SESSION_MAX_TOKENS", 4096))
+
+
+class OllamaError(Exception):
+    """Raised when Ollama returns an error response"""
+
+
+class OllamaBackend:
+    """
+    Long-lived client for one Ollama server
+
+    Holds one connection pool for every request and caches whether Ollama is
+    reachable and whether the model is available, so generations don't have
+    to probe the server first. The cached state is set by refresh(), which
+    the provider runs at startup and then periodically in the background.
+    """
+
+    def __init__(self, host: str, model: str):
+        self.host = host.rstrip("/")
+        self.model = model
+        self.reachable = False
+        self.model_ready = False
+        # Ollama's /api/ps entry for the model while it's loaded in memory,
+        # as last seen by check_loaded()
+        self.loaded: Optional[Dict[str, Any]] = None
+        # Generations currently sent to this backend, for routing
+        self.outstanding = 0
+        # Moving average of seconds per generation, for breaking routing ties
+        self.latency = 0.0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._pull_lock = asyncio.Lock()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared HTTP client, created on first use"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.host,
+                # Generations are slow; only connecting should fail fast
+                timeout=httpx.Timeout(300.0, connect=5.0, pool=None),
+                limits=httpx.Limits(
+                    max_connections=OLLAMA_MAX_CONNECTIONS,
+                    max_keepalive_connections=OLLAMA_MAX_CONNECTIONS,
+                ),
+            )
+        return self._client
+
+    @metrics.timed(metrics.OLLAMA_LATENCY, metrics.OLLAMA_ERRORS, operation="probe")
+    async def refresh(self) -> bool:
+        """
+        Re-check that Ollama is reachable and whether the model is present
+
+        Returns:
+            bool: True if Ollama is reachable
+
+        Raises:
+            Exception: If Ollama can't be reached
+        """
+        try:
+            response = await self.client.get("/api/tags", timeout=5.0)
+            response.raise_for_status()
+        except Exception:
+            self.reachable = False
+            raise
+
+        self.reachable = True
+        names = {m.get("name") for m in response.json().get("models", [])}
+        self.model_ready = self.model in names or f"{self.model}:latest" in names
+        return True
+
+    async def ensure_model(self):
+        """Pull the model if the cached state says Ollama doesn't have it"""
+        if self.model_ready:
+            return
+        async with self._pull_lock:
+            # Another caller may have pulled it while we waited for the lock
+            if self.model_ready:
+                return
+            await self.refresh()
+            if self.model_ready:
+                return
+
+            print(f"Model {self.model} not found. Attempting to pull...")
+            await self._pull()
+            self.model_ready = True
+
+    @metrics.timed(metrics.OLLAMA_LATENCY, metrics.OLLAMA_ERRORS, operation="pull")
+    async def _pull(self):
+        """Have Ollama download the model"""
+        response = await self.client.post(
+            "/api/pull",
+            json={"name": self.model, "stream": False},
+            timeout=600.0,  # 10 minutes timeout for pulling
+        )
+        print(f"Pull response: {response.status_code}")
+        if response.status_code != 200:
+            raise OllamaError(f"Failed to pull model: {response.text}")
+
+    async def check_loaded(self) -> bool:
+        """Ask Ollama whether the model is loaded in memory right now"""
+        response = await self.client.get("/api/ps", timeout=5.0)
+        response.raise_for_status()
+        names = {self.model, f"{self.model}:latest"}
+        self.loaded = next(
+            (m for m in response.json().get("models", []) if m.get("name") in names),
+            None,
+        )
+        metrics.OLLAMA_MODEL_LOADED.labels(self.host).set(self.loaded is not None)
+        return self.loaded is not None
+
+    @metrics.timed(metrics.OLLAMA_LATENCY, metrics.OLLAMA_ERRORS, operation="load")
+    async def load(self):
+        """Load the model into memory, or keep it there, without generating"""
+        await self.ensure_model()
+        # A request without a prompt only loads the model
+        await self._keep_alive(OLLAMA_KEEP_ALIVE)
+
+    @metrics.timed(metrics.OLLAMA_LATENCY, metrics.OLLAMA_ERRORS, operation="unload")
+    async def unload(self):
+        """Have Ollama free the memory the model takes"""
+        await self._keep_alive(0)
+        self.loaded = None
+        metrics.OLLAMA_MODEL_LOADED.labels(self.host).set(0)
+
+    async def _keep_alive(self, keep_alive):
+        response = await self.client.post(
+            "/api/generate", json={"model": self.model, "keep_alive": keep_alive}
+        )
+        if response.status_code != 200:
+            self._check_model_missing(response.text)
+            raise OllamaError(f"Ollama API error: {response.text}")
+
+    @metrics.in_flight(metrics.GENERATIONS_IN_FLIGHT, operation="generate")
+    @metrics.timed(metrics.OLLAMA_LATENCY, metrics.OLLAMA_ERRORS, operation="generate")
+    async def generate(
+        self, prompt: str, context: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
+        """
+        Generate text for a prompt with a single upstream request
+
+        Args:
+            context: The context Ollama returned with an earlier generation,
+                to continue from it; only the new prompt is then evaluated
+
+        Returns:
+            Ollama's response, with the generated text under "response"
+        """
+        await self.ensure_model()
+
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": False,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+        }
+        if context:
+            payload["context"] = context
+        response = await self.client.post("/api/generate", json=payload)
+        if response.status_code != 200:
+            self._check_model_missing(response.text)
+            raise OllamaError(f"Ollama API error: {response.text}")
+
+        result = response.json()
+        _count_tokens(result)
+        # Handle different response formats
+        if "message" in result:
+            result["response"] = result.get("message", {}).get("content", "")
+        result.setdefault("response", "")
+        return result
+
+    @metrics.in_flight(metrics.GENERATIONS_IN_FLIGHT, operation="stream")
+    @metrics.timed(metrics.OLLAMA_LATENCY, metrics.OLLAMA_ERRORS, operation="stream")
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Generate text for a prompt, yielding chunks as Ollama sends them"""
+        await self.ensure_model()
+
+        async with self.client.stream(
+            "POST",
+            "/api/generate",
+            json={
+                "model": self.model,
+                "prompt": prompt,
+                "stream": True,
+                "keep_alive": OLLAMA_KEEP_ALIVE,
+            },
+        ) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode()
+                self._check_model_missing(body)
+                raise OllamaError(f"Ollama API error: {body}")
+
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise OllamaError(f"Ollama API error: {chunk['error']}")
+                text = chunk.get("response") or chunk.get("message", {}).get(
+                    "content", ""
+                )
+                if text:
+                    yield text
+                if chunk.get("done"):
+                    _count_tokens(chunk)
+                    break
+
+    def _check_model_missing(self, error_text: str):
+        """Forget the model's ready state if Ollama says it isn't there"""
+        if "not found" in error_text.lower():
+            self.model_ready = False
+
+    def record_latency(self, seconds: float):
+        """Fold a finished generation's duration into the moving average"""
+        if self.latency == 0.0:
+            self.latency = seconds
+        else:
+            self.latency += OLLAMA_LATENCY_SMOOTHING * (seconds - self.latency)
+
+    async def close(self):
+        """Close the connection pool"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Errors that mean a backend couldn't be reached at all, so the generation
+# can safely be retried on another one
+UNREACHABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+
+class OllamaProvider:
+    """
+    Spreads generations across one or more Ollama backends
+
+    Each generation goes to the reachable backend with the fewest
+    generations outstanding, breaking ties by recent latency. A backend that
+    can't be reached is ejected, and the generation retried on another; the
+    background refresh adds it back once it answers again.
+    """
+
+    def __init__(
+        self,
+        hosts: List[str],
+        model: str,
+        max_concurrency: int = OLLAMA_BACKEND_CONCURRENCY,
+    ):
+        self.model = model
+        self.backends = [OllamaBackend(host, model) for host in hosts]
+        self.max_concurrency = max_concurrency
+        # Notified whenever a backend finishes a generation or comes back
+        self._slot_freed = asyncio.Condition()
+        # Backends reported as unreachable, so each outage is logged once
+        self._ejected = set()
+        # Generations started by this process, and when the last one was
+        # (epoch seconds), for the residency manager
+        self.generations = 0
+        self.last_used = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def reachable(self) -> bool:
+        return any(backend.reachable for backend in self.backends)
+
+    async def refresh(self) -> bool:
+        """
+        Re-check every backend, ejecting or re-adding them as needed
+
+        Returns:
+            bool: True if at least one backend is reachable
+
+        Raises:
+            Exception: If no backend can be reached
+        """
+        results = await asyncio.gather(
+            *(backend.refresh() for backend in self.backends), return_exceptions=True
+        )
+        for backend, result in zip(self.backends, results):
+            if isinstance(result, Exception):
+                self._eject(backend, result)
+            elif backend in self._ejected:
+                self._ejected.discard(backend)
+                print(f"Ollama backend {backend.host} is reachable again")
+            metrics.OLLAMA_BACKEND_UP.labels(backend.host).set(backend.reachable)
+
+        async with self._slot_freed:
+            self._slot_freed.notify_all()
+
+        if not self.reachable:
+            raise next(r for r in results if isinstance(r, Exception))
+        return True
+
+    def _eject(self, backend: OllamaBackend, error: Exception):
+        """Stop routing to a backend until a refresh finds it reachable"""
+        backend.reachable = False
+        metrics.OLLAMA_BACKEND_UP.labels(backend.host).set(0)
+        if backend not in self._ejected:
+            self._ejected.add(backend)
+            print(f"Ollama backend {backend.host} is unreachable: {error}")
+
+    def _pick(
+        self, exclude: Collection[OllamaBackend], prefer: Optional[str] = None
+    ) -> Optional[OllamaBackend]:
+        """Choose a backend with a free slot, or None if they're all full"""
+        candidates = [b for b in self.backends if b not in exclude]
+        # With none known to be reachable, try them anyway rather than fail
+        candidates = [b for b in candidates if b.reachable] or candidates
+        if self.max_concurrency:
+            candidates = [b for b in candidates if b.outstanding < self.max_concurrency]
+        if not candidates:
+            return None
+        for backend in candidates:
+            if backend.host == prefer:
+                return backend
+        return min(candidates, key=lambda b: (b.outstanding, b.latency))
+
+    @contextlib.asynccontextmanager
+    async def _backend(
+        self, exclude: Collection[OllamaBackend], prefer: Optional[str] = None
+    ):
+        """Hold a slot on the best backend (or `prefer`) for one generation"""
+        async with self._slot_freed:
+            while (backend := self._pick(exclude, prefer)) is None:
+                await self._slot_freed.wait()
+            backend.outstanding += 1
+        self.generations += 1
+        self.last_used = time.time()
+        metrics.OLLAMA_BACKEND_OUTSTANDING.labels(backend.host).inc()
+        try:
+            yield backend
+        finally:
+            backend.outstanding -= 1
+            metrics.OLLAMA_BACKEND_OUTSTANDING.labels(backend.host).dec()
+            async with self._slot_freed:
+                self._slot_freed.notify()
+
+    async def generate(
+        self,
+        prompt: str,
+        context: Optional[List[int]] = None,
+        host: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Generate text for a prompt on the least busy backend
+
+        Args:
+            context: Ollama context to continue from, as for
+                OllamaBackend.generate
+            host: Backend to use if it's reachable and has a free slot. A
+                context should go back to the backend that returned it,
+                which may still hold the evaluated prompt in memory.
+
+        Returns:
+            Ollama's response, plus the "host" of the backend that sent it
+        """
+        tried = set()
+        while True:
+            async with self._backend(tried, host) as backend:
+                start = time.perf_counter()
+                try:
+                    result = await backend.generate(prompt, context)
+                except UNREACHABLE_ERRORS as e:
+                    self._eject(backend, e)
+                    tried.add(backend)
+                    if len(tried) == len(self.backends):
+                        raise
+                    continue
+                backend.record_latency(time.perf_counter() - start)
+                result["host"] = backend.host
+                return result
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Stream text for a prompt from the least busy backend"""
+        tried = set()
+        while True:
+            sent = False
+            async with self._backend(tried) as backend:
+                start = time.perf_counter()
+                try:
+                    async for text in backend.stream(prompt):
+                        sent = True
+                        yield text
+                except UNREACHABLE_ERRORS as e:
+                    self._eject(backend, e)
+                    tried.add(backend)
+                    # Text already sent can't be taken back by retrying
+                    if sent or len(tried) == len(self.backends):
+                        raise
+                    continue
+                backend.record_latency(time.perf_counter() - start)
+                return
+
+    def start_background_refresh(self, interval: float = OLLAMA_REFRESH_INTERVAL):
+        """Start periodically refreshing the cached backend state"""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop(interval))
+
+    async def _refresh_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Error refreshing Ollama state: {e}")
+
+    async def close(self):
+        """Stop the background refresh and close every connection pool"""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        for backend in self.backends:
+            await backend.close()
+
+
+def _count_tokens(result: Dict[str, Any]):
+    """Record the token counts Ollama reports with a finished generation"""
+    metrics.OLLAMA_TOKENS.labels(kind="prompt").inc(result.get("prompt_eval_count", 0))
+    metrics.OLLAMA_TOKENS.labels(kind="completion").inc(result.get("eval_count", 0))
+
+
+# Provider instance
+_provider = None
+
+
+def get_provider() -> OllamaProvider:
+    """Get or create the Ollama provider"""
+    global _provider
+    if _provider is None:
+        hosts = [host.strip() for host in OLLAMA_HOST.split(",") if host.strip()]
+        _provider = OllamaProvider(hosts, MODEL)
+    return _provider
+
+
+async def generate_contract(
+    description: str, use_cache: bool = True, context: Optional[str] = None
+) -> str:
+    """
+    Generate a contract based on the provided description
+
+    Args:
+        description: What the contract should cover
+        use_cache: Set to False to skip cached completions and regenerate
+        context: Clauses from existing contracts to draw on, if any
+    """
+    if PROVIDER.lower() == "ollama":
+        return await _generate_with_ollama(description, use_cache, context)
+    else:
+        raise ValueError(f"Unsupported provider: {PROVIDER}")
 
 
-async def generate_contract(description: str) -> str:
-    """Generate a contract based on the provided description"""
+async def complete(prompt: str, use_cache: bool = True) -> str:
+    """
+    Send a prompt to the model as-is and return its completion
+
+    Unlike generate_contract, errors are raised rather than replaced with a
+    fallback contract, so callers can splice the result into other text.
+    """
     if PROVIDER.lower() == "ollama":
-        return await _generate_with_ollama(description)
+        return await _complete_with_ollama(prompt, use_cache)
     else:
         raise ValueError(f"Unsupported provider: {PROVIDER}")
 
 
-async def _generate_with_ollama(description: str) -> str:
-    """Generate text using Ollama API"""
-    # For testing/development, return a mock response if the description is too long
-    if len(description) > 500:
-        return f"Mock contract for: {description[:100]}..."
+async def generate_contract_in_session(
+    description: str,
+    session: Optional[Dict[str, Any]] = None,
+    follow_up: Optional[str] = None,
+    use_cache: bool = True,
+    context: Optional[str] = None,
+) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Generate a contract, keeping the model's state so it can be continued
+
+    Args:
+        description: Self-contained description, as for generate_contract.
+            It is what gets sent without a session, and keys the cache
+            either way.
+        session: What an earlier call returned. With a session, only
+            follow_up is sent and the model carries on from the earlier
+            prompt and reply instead of evaluating them again.
+        follow_up: Prompt to continue the session with
+        context: Clauses from existing contracts to draw on, if any
+
+    Returns:
+        The contract and the session to continue from it. The session is
+        None when the contract came from the cache or Ollama returned too
+        much context to carry on.
+
+    Raises:
+        Exception: If generation fails; unlike generate_contract there is
+            no fallback contract
+    """
+    if PROVIDER.lower() != "ollama":
+        raise ValueError(f"Unsupported provider: {PROVIDER}")
+
+    prompt = build_prompt(description, context)
+    cached = await _cached_completion(prompt, use_cache)
+    if cached is not None:
+        return cached, None
+
+    # Contexts are token IDs, which mean nothing to a different model
+    if session is not None and follow_up is not None and session["model"] == MODEL:
+        result = await get_provider().generate(
+            follow_up + _context_prompt(context), session["context"], session["host"]
+        )
+    else:
+        result = await get_provider().generate(prompt)
+    await _cache_completion(prompt, result["response"])
+
+    returned_context = result.get("context")
+    if not returned_context or len(returned_context) > OLLAMA_SESSION_MAX_TOKENS:
+        return result["response"], None
+    return result["response"], {
+        "model": MODEL,
+        "host": result["host"],
+        "context": returned_context,
+    }
+
+
+async def stream_contract(
+    description: str, use_cache: bool = True, context: Optional[str] = None
+) -> AsyncIterator[str]:
+    """Generate a contract, yielding text chunks as the model produces them"""
+    if PROVIDER.lower() == "ollama":
+        async for chunk in _stream_with_ollama(description, use_cache, context):
+            yield chunk
+    else:
+        raise ValueError(f"Unsupported provider: {PROVIDER}")
+
+
+async def stream_completion(prompt: str, use_cache: bool = True) -> AsyncIterator[str]:
+    """
+    Send a prompt to the model as-is, yielding its completion as it's produced
+
+    Like complete, errors are raised rather than replaced with a fallback
+    contract, so nothing but real model output is ever yielded.
+    """
+    if PROVIDER.lower() == "ollama":
+        async for chunk in _stream_completion_with_ollama(prompt, use_cache):
+            yield chunk
+    else:
+        raise ValueError(f"Unsupported provider: {PROVIDER}")
 
+
+def build_prompt(description: str, context: Optional[str] = None) -> str:
+    """Wrap a contract description in the contract generation prompt"""
     prompt = f"""
     You are a legal expert specializing in contract generation. Create a comprehensive and legally sound contract based on the following description:
 
@@ -29,80 +585,129 @@ async def _generate_with_ollama(description: str) -> str:
     The contract should include all necessary legal clauses, terms, and conditions appropriate for this type of agreement.
     Format the contract professionally with proper sections, numbering, and legal terminology.
     """
+    return prompt + _context_prompt(context)
 
-    # Use a much longer timeout for the entire client session
-    async with httpx.AsyncClient(timeout=300.0) as client:
-        try:
-            # Try to generate text with a simpler prompt first for testing
-            response = await client.post(
-                f"{OLLAMA_HOST}/api/generate",
-                json={
-                    "model": MODEL,
-                    "prompt": "Generate a simple test contract",
-                    "stream": False,
-                },
-                timeout=300.0,  # 5 minutes timeout
-            )
 
-            if response.status_code != 200:
-                # If the model doesn't exist, try to pull it
-                if "model not found" in response.text.lower():
-                    print(f"Model {MODEL} not found. Attempting to pull...")
-                    try:
-                        pull_response = await client.post(
-                            f"{OLLAMA_HOST}/api/pull",
-                            json={"name": MODEL},
-                            timeout=600.0,  # 10 minutes timeout for pulling
-                        )
-                        print(f"Pull response: {pull_response.status_code}")
-                    except Exception as e:
-                        print(f"Error pulling model: {e}")
-                        # Return a fallback response for development
-                        return f"Failed to pull model. Using mock contract for: {description[:100]}..."
-                else:
-                    print(f"Ollama API error: {response.text}")
-                    # Return a fallback response for development
-                    return f"Ollama API error. Using mock contract for: {description[:100]}..."
-
-            # Now try with the actual prompt
-            response = await client.post(
-                f"{OLLAMA_HOST}/api/generate",
-                json={"model": MODEL, "prompt": prompt, "stream": False},
-                timeout=300.0,  # 5 minutes timeout
-            )
+def _context_prompt(context: Optional[str]) -> str:
+    """Prompt text offering retrieved clauses to the model, if there are any"""
+    if not context:
+        return ""
+    return f"""
+    Where they fit, adapt the following clauses from existing contracts:
 
-            if response.status_code != 200:
-                raise Exception(f"Ollama API error: {response.text}")
+    {context}
+    """
+
+
+async def _cached_completion(prompt: str, use_cache: bool) -> Optional[str]:
+    """Look a prompt up in the LLM cache, honouring the per-request bypass"""
+    if not (cache.LLM_CACHE_ENABLED and use_cache):
+        return None
+    return await cache.get(cache.make_key(MODEL, prompt))
+
+
+async def _cache_completion(prompt: str, content: str):
+    """Store a successful completion in the LLM cache"""
+    if cache.LLM_CACHE_ENABLED:
+        await cache.set(cache.make_key(MODEL, prompt), content)
+
+
+async def _generate_with_ollama(
+    description: str, use_cache: bool = True, context: Optional[str] = None
+) -> str:
+    """Generate text using Ollama API"""
+    # For testing/development, return a mock response if the description is too long
+    if len(description) > 500:
+        return f"Mock contract for: {description[:100]}..."
+
+    prompt = build_prompt(description, context)
 
-            result = response.json()
-            # Handle different response formats
-            if "message" in result:
-                return result.get("message", {}).get("content", "")
-            return result.get("response", "")
+    try:
+        return await _complete_with_ollama(prompt, use_cache)
+    except httpx.TimeoutException:
+        print("Request to Ollama timed out")
+        # Return a fallback response for development
+        return f"Request timed out. Using mock contract for: {description[:100]}..."
+    except Exception as e:
+        print(f"Error generating contract: {e}")
+        # Return a fallback response for development
+        return f"Error: {str(e)}. Using mock contract for: {description[:100]}..."
 
-        except httpx.TimeoutException:
-            print("Request to Ollama timed out")
-            # Return a fallback response for development
-            return f"Request timed out. Using mock contract for: {description[:100]}..."
-        except Exception as e:
-            print(f"Error generating contract: {e}")
-            # Return a fallback response for development
-            return f"Error: {str(e)}. Using mock contract for: {description[:100]}..."
+
+async def _complete_with_ollama(prompt: str, use_cache: bool = True) -> str:
+    """Complete a prompt using Ollama API, through the cache"""
+    cached = await _cached_completion(prompt, use_cache)
+    if cached is not None:
+        return cached
+
+    async def generate_and_cache() -> str:
+        content = (await get_provider().generate(prompt))["response"]
+        # Fallback contracts are never cached, only real completions
+        await _cache_completion(prompt, content)
+        return content
+
+    # Identical prompts already being generated are waited on, not resent
+    return await singleflight.do(cache.prompt_hash(MODEL, prompt), generate_and_cache)
+
+
+async def _stream_with_ollama(
+    description: str, use_cache: bool = True, context: Optional[str] = None
+) -> AsyncIterator[str]:
+    """Stream text from the Ollama API as newline-delimited JSON chunks"""
+    # For testing/development, return a mock response if the description is too long
+    if len(description) > 500:
+        yield f"Mock contract for: {description[:100]}..."
+        return
+
+    prompt = build_prompt(description, context)
+
+    chunks = []
+    try:
+        async for text in _stream_completion_with_ollama(prompt, use_cache):
+            chunks.append(text)
+            yield text
+    except httpx.TimeoutException:
+        print("Streaming request to Ollama timed out")
+        # Once text has been sent we can't swap in a fallback contract
+        if chunks:
+            raise
+        yield f"Request timed out. Using mock contract for: {description[:100]}..."
+    except Exception as e:
+        print(f"Error streaming contract: {e}")
+        if chunks:
+            raise
+        yield f"Error: {str(e)}. Using mock contract for: {description[:100]}..."
+
+
+async def _stream_completion_with_ollama(
+    prompt: str, use_cache: bool = True
+) -> AsyncIterator[str]:
+    """Stream a completion from the Ollama API, through the cache"""
+    # A cached completion is sent as a single chunk
+    cached = await _cached_completion(prompt, use_cache)
+    if cached is not None:
+        yield cached
+        return
+
+    chunks = []
+    async for text in get_provider().stream(prompt):
+        chunks.append(text)
+        yield text
+    await _cache_completion(prompt, "".join(chunks))
 
 
 async def check_ollama_connection() -> bool:
     """
     Check if the Ollama service is reachable without generating text
 
+    This also records whether the model is available, so the first
+    generation knows if it has to pull it.
+
     Returns:
         bool: True if Ollama is reachable, False otherwise
     """
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        try:
-            # Just check if the Ollama API is reachable
-            response = await client.get(f"{OLLAMA_HOST}/api/tags")
-            response.raise_for_status()
-            return True
-        except Exception as e:
-            print(f"Error checking Ollama connection: {e}")
-            raise
+    try:
+        return await get_provider().refresh()
+    except Exception as e:
+        print(f"Error checking Ollama connection: {e}")
+        raise
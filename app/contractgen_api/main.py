@@ -1,13 +1,64 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import Body, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel, Field
 import asyncio
-from typing import List, Optional
+import json
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 # Import local modules
 from . import db
 from . import llm
+from . import cache
+from . import codec
+from . import compression
+from . import conditional
+from . import contract_cache
+from . import jobs
+from . import metrics
+from . import ratelimit
+from . import residency
+from . import search
+from . import service
+from . import vectors
 
 app = FastAPI(title="Contract Generation API")
+app.add_middleware(compression.CompressionMiddleware)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count every request and time it until its response headers are sent"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template so /contracts/1 and /contracts/2 share one
+        # series; paths that match no route are grouped together
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.HTTP_LATENCY.labels(request.method, path).observe(
+            time.perf_counter() - start
+        )
+        metrics.HTTP_REQUESTS.labels(request.method, path, status).inc()
+
+
+@app.exception_handler(ratelimit.RateLimited)
+async def rate_limited(request: Request, exc: ratelimit.RateLimited):
+    """Turn a rejected generation request into a 413, 429 or 503 response"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers=(
+            {"Retry-After": str(exc.retry_after)}
+            if exc.retry_after is not None
+            else None
+        ),
+    )
 
 
 @app.on_event("startup")
@@ -17,6 +68,12 @@ async def startup_event():
     await db.init_db()
     print("Database initialized successfully.")
 
+    # Compress contracts stored by older versions without blocking startup
+    asyncio.create_task(migrate_storage())
+
+    # Cached completions from a previous model must not be served
+    await cache.invalidate_if_model_changed(llm.MODEL)
+
     # Just check if Ollama is reachable without generating text
     print("Checking if Ollama service is reachable...")
     try:
@@ -29,35 +86,138 @@ async def startup_event():
             "API will continue to run, but contract generation may not work properly."
         )
 
-    # Start a background task to warm up the model
-    asyncio.create_task(warm_up_model())
+    # Keep the cached Ollama/model state fresh for the generation path
+    llm.get_provider().start_background_refresh()
 
+    # Start the workers that drain the generation job queue
+    await jobs.start_workers()
 
-async def warm_up_model():
-    """Warm up the LLM model in the background"""
-    print("Warming up LLM model in the background...")
+    # Hear about contracts other replicas delete or edit while they're cached
+    if contract_cache.CONTRACT_CACHE_ENABLED and contract_cache.CONTRACT_CACHE_TRACKING:
+        contract_cache.get_cache().start_tracking()
+
+    # Load the model now and keep it loaded while it's likely to be needed
+    if residency.MODEL_RESIDENCY_ENABLED:
+        residency.get_manager().start()
+    else:
+        asyncio.create_task(warm_up_model())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the job workers and close the shared Ollama connection pool"""
+    await jobs.stop_workers()
+    await residency.get_manager().stop()
+    await contract_cache.get_cache().stop_tracking()
+    await llm.get_provider().close()
+
+
+async def migrate_storage():
+    """Re-encode stored contracts with the current codec in the background"""
     try:
-        # Use a very simple prompt to warm up the model
-        await llm.generate_contract("Test")
-        print("Model warm-up complete.")
+        await db.backfill_metadata()
+        await db.migrate_clauses()
+        await db.migrate_codec()
     except Exception as e:
-        print(f"Model warm-up failed: {e}")
+        print(f"Contract storage migration failed: {e}")
+
+
+async def warm_up_model():
+    """Load the LLM model once in the background"""
+    print("Warming up LLM model in the background...")
+    await residency.get_manager().apply("startup")
+    print("Model warm-up complete.")
+
+
+class EncodedJSONResponse(Response):
+    """JSON that was encoded ahead of time, sent as is"""
+
+    media_type = "application/json"
 
 
 class Contract(BaseModel):
     id: Optional[int] = None
     title: str
     content: str
+    created_at: Optional[str] = None
+    # Position in the contract's revision chain; refinements add versions
+    version: Optional[int] = None
+    # The contract this version was refined from
+    parent_id: Optional[int] = None
+
+
+class ExportedContract(BaseModel):
+    """One line of a contract export"""
+
+    id: int = Field(..., ge=1)
+    title: str
+    content: str
+    created_at: Optional[str] = None
+    version: int = Field(1, ge=1)
+    parent_id: Optional[int] = None
+    # The original version of the contract's revision chain
+    root_id: Optional[int] = None
+
+
+class ContractVersion(BaseModel):
+    id: int
+    title: str
+    version: int
+    parent_id: Optional[int] = None
+    created_at: Optional[str] = None
 
 
 class ContractRequest(BaseModel):
     title: str
     description: str
+    # Set to False to skip cached LLM output and regenerate
+    use_cache: bool = True
+    # How many relevant clauses from stored contracts to add to the prompt
+    context_clauses: int = Field(0, ge=0, le=20)
 
 
 class RefinementRequest(BaseModel):
     contract_id: int
     refinement_instructions: str
+    use_cache: bool = True
+    context_clauses: int = Field(0, ge=0, le=20)
+
+
+async def _stream_and_save(
+    title: str,
+    stream: AsyncIterator[str],
+    parent_id: Optional[int] = None,
+    ticket: Optional[Tuple[str, int]] = None,
+) -> AsyncIterator[str]:
+    """
+    Stream a generated contract as NDJSON and save it once generation ends
+
+    Each chunk of model output is sent as {"token": ...}. The final line is
+    either {"done": true, "id": ..., "title": ...} once the contract has been
+    saved, or {"error": ...} if generation failed part way through, in which
+    case nothing is saved. The rate limit ticket, if any, is released once
+    the stream ends.
+    """
+    chunks = []
+    try:
+        async for chunk in stream:
+            chunks.append(chunk)
+            yield json.dumps({"token": chunk}) + "\n"
+
+        contract_id = await service.save_contract(
+            title, "".join(chunks), parent_id=parent_id
+        )
+        yield json.dumps({"done": True, "id": contract_id, "title": title}) + "\n"
+    except Exception as e:
+        yield json.dumps({"error": str(e)}) + "\n"
+    finally:
+        await ratelimit.release(ticket)
+
+
+async def _prepend(first: str, rest: AsyncIterator[str]) -> AsyncIterator[str]:
+    yield first
+    async for chunk in rest:
+        yield chunk
 
 
 @app.get("/")
@@ -65,39 +225,293 @@ async def root():
     return {"message": "Contract Generation API is running"}
 
 
+async def _enqueue_job(kind: str, payload: Dict[str, Any]) -> JSONResponse:
+    """Queue a generation job and answer 202 with where to poll for it"""
+    job = await jobs.enqueue(kind, payload)
+    return JSONResponse(
+        status_code=202, content=job, headers={"Location": f"/jobs/{job['id']}"}
+    )
+
+
 @app.post("/contracts/", response_model=Contract)
-async def create_contract(request: ContractRequest):
-    """Generate a contract based on the provided description"""
+async def create_contract(
+    request: ContractRequest, http_request: Request, job: bool = False
+):
+    """
+    Generate a contract based on the provided description
+
+    With ?job=true the contract is generated by the job queue instead; the
+    response is 202 with a job whose status can be polled at /jobs/{job_id}.
+    Requests over the caller's rate limit get 429, and requests arriving
+    while generation capacity is full get 503.
+    """
+    tenant = ratelimit.tenant_for(http_request)
+    if job:
+        await ratelimit.admit(tenant, track=False)
+        try:
+            return await _enqueue_job("create", request.model_dump())
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async with ratelimit.admission(tenant):
+        try:
+            return await service.create_contract(
+                request.title,
+                request.description,
+                request.use_cache,
+                request.context_clauses,
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/contracts/batch")
+async def create_contracts_batch(
+    http_request: Request,
+    requests: List[ContractRequest] = Body(
+        ..., min_length=1, max_length=service.BATCH_MAX_ITEMS
+    ),
+):
+    """
+    Generate several contracts, streaming each result back as NDJSON
+
+    Generations run concurrently up to BATCH_CONCURRENCY. Each line is one
+    finished contract (with its "index" in the request) or an error for it.
+    Each contract counts against the caller's rate limit and the pending
+    generation cap, so a batch may hold no more than either allows.
+    """
+    ticket = await ratelimit.admit(
+        ratelimit.tenant_for(http_request), cost=len(requests)
+    )
+
+    async def results() -> AsyncIterator[str]:
+        items = [
+            (r.title, r.description, r.use_cache, r.context_clauses) for r in requests
+        ]
+        try:
+            async for result in service.create_contracts(items):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+        finally:
+            await ratelimit.release(ticket)
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.get("/contracts/", response_model=List[Contract])
+async def list_contracts(
+    http_request: Request,
+    cursor: Optional[int] = Query(None, ge=0),
+    limit: int = Query(db.DEFAULT_PAGE_SIZE, ge=1, le=db.MAX_PAGE_SIZE),
+    fields: Optional[str] = Query(
+        None, description="Comma-separated fields to return, e.g. id,title"
+    ),
+):
+    """
+    List contracts one page at a time
+
+    Pass the X-Next-Cursor response header back as `cursor` to get the next
+    page; the header is absent on the last page. Selecting `fields` without
+    `content` lists contracts without reading or sending their bodies.
+    Pages carry an ETag; send it back in If-None-Match to get a 304 when
+    no contract was saved since.
+    """
+    selected = None
+    if fields is not None:
+        selected = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = set(selected) - set(db.CONTRACT_FIELDS)
+        if unknown or not selected:
+            raise HTTPException(
+                status_code=400,
+                detail=f"fields must be chosen from {', '.join(db.CONTRACT_FIELDS)}",
+            )
+
     try:
-        # Use LLM to generate contract content
-        content = await llm.generate_contract(request.description)
+        etag = conditional.listing_etag(
+            *await db.get_listing_version(),
+            cursor=cursor or 0,
+            limit=limit,
+            fields=",".join(selected or []),
+        )
+        cached = conditional.not_modified(http_request, etag)
+        if cached is not None:
+            return cached
+        if selected is None:
+            ids, next_cursor = await db.get_page_ids(cursor or 0, limit)
+            found = await contract_cache.get_contracts_json(ids)
+        else:
+            contracts, next_cursor = await db.get_contracts_page(
+                cursor or 0, limit, selected
+            )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Save to database
-        contract_id = await db.save_contract(request.title, content)
+    headers = conditional.validators(etag)
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+    if selected is not None:
+        # Partial contracts don't fit the Contract model
+        return EncodedJSONResponse(codec.dumps(contracts), headers=headers)
+    # Splice together the contracts' JSON as the cache already holds it
+    body = b"[" + b",".join(encoded for _, encoded in filter(None, found)) + b"]"
+    return EncodedJSONResponse(body, headers=headers)
+
+
+@app.get("/contracts/export")
+async def export_contracts(after: int = Query(0, ge=0)):
+    """
+    Stream every contract as NDJSON, one contract per line in ID order
+
+    Contracts are read from Redis a batch at a time while the response is
+    sent, so the store is never held in memory at once. To resume an
+    interrupted export, pass the last ID received as `after`. The output
+    can be loaded into another store with POST /contracts/import.
+    """
+
+    async def lines() -> AsyncIterator[bytes]:
+        async for contract in db.export_contracts(after):
+            yield codec.dumps(contract) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+async def _ndjson_lines(request: Request) -> AsyncIterator[Tuple[int, bytes]]:
+    """Yield each non-empty line of an NDJSON request body with its number"""
+    buffer = b""
+    number = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            number += 1
+            if line.strip():
+                yield number, line
+    if buffer.strip():
+        yield number + 1, buffer
+
+
+@app.post("/contracts/import")
+async def import_contracts(request: Request, index: bool = True):
+    """
+    Load contracts from an NDJSON export, keeping their IDs
+
+    The body is read as it arrives and written in pipelined batches.
+    Contracts whose ID already exists are skipped, so an interrupted import
+    can be sent again. The ID counter is raised past the imported IDs. With
+    ?index=false, imported contracts aren't added to the search indexes;
+    run `make reindex` afterwards instead.
+    """
+    imported = skipped = 0
+    last_id = None
+    batch: List[Dict[str, Any]] = []
+
+    async def flush():
+        nonlocal imported, skipped
+        ids = await service.import_contracts(batch, index)
+        imported += len(ids)
+        skipped += len(batch) - len(ids)
+        batch.clear()
 
-        return Contract(id=contract_id, title=request.title, content=content)
+    try:
+        async for number, line in _ndjson_lines(request):
+            try:
+                contract = ExportedContract.model_validate_json(line)
+            except ValueError as e:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Line {number} is not a valid contract: {e}. "
+                    f"{imported} contracts were imported before it.",
+                )
+            batch.append(contract.model_dump())
+            last_id = contract.id
+            if len(batch) >= db.EXPORT_BATCH_SIZE:
+                await flush()
+        await flush()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    return {"imported": imported, "skipped": skipped, "last_id": last_id}
 
-@app.get("/contracts/", response_model=List[Contract])
-async def list_contracts():
-    """List all contracts"""
+
+class SearchResult(BaseModel):
+    id: int
+    title: str
+    score: float
+
+
+@app.get("/contracts/search", response_model=List[SearchResult])
+async def search_contracts(
+    q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=100)
+):
+    """Full-text search over contract titles and content, best match first"""
     try:
-        contracts = await db.get_all_contracts()
-        return contracts
+        return await search.search(q, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class ClauseResult(BaseModel):
+    contract_id: int
+    title: str
+    clause: str
+    score: float
+
+
+@app.get("/contracts/search/semantic", response_model=List[ClauseResult])
+async def search_clauses(
+    q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=100)
+):
+    """Find the stored clauses most similar to a query, best match first"""
+    try:
+        return await vectors.search(q, limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/contracts/{contract_id}", response_model=Contract)
-async def get_contract(contract_id: int):
-    """Get a specific contract by ID"""
+async def get_contract(
+    contract_id: int,
+    http_request: Request,
+    version: Optional[int] = Query(None, ge=1),
+):
+    """
+    Get a specific contract by ID
+
+    With ?version=N, returns version N of the revision chain the contract
+    belongs to instead (version 1 is the original contract). Responses
+    carry an ETag and Last-Modified; send either back (If-None-Match or
+    If-Modified-Since) to get a 304 instead of the contract again.
+    """
+    try:
+        found = await contract_cache.get_contract_json(contract_id, version)
+        if not found:
+            raise HTTPException(status_code=404, detail="Contract not found")
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+    contract, body = found
+    etag = conditional.contract_etag(contract)
+    modified = conditional.last_modified(contract.get("created_at"))
+    cached = conditional.not_modified(http_request, etag, modified)
+    if cached is not None:
+        return cached
+    # Already Contract-shaped JSON; skip validating and encoding it again
+    return EncodedJSONResponse(body, headers=conditional.validators(etag, modified))
+
+
+@app.get("/contracts/{contract_id}/versions", response_model=List[ContractVersion])
+async def list_versions(contract_id: int):
+    """List every version in a contract's revision chain"""
     try:
-        contract = await db.get_contract(contract_id)
-        if not contract:
+        versions = await db.get_versions(contract_id)
+        if versions is None:
             raise HTTPException(status_code=404, detail="Contract not found")
-        return contract
+        return versions
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
@@ -106,38 +520,142 @@ async def get_contract(contract_id: int):
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy"}
+    """Health check endpoint, with whether the model is loaded on each backend"""
+    return {"status": "healthy", "model": residency.get_manager().status()}
 
 
-@app.post("/contracts/refine/", response_model=Contract)
-async def refine_contract(request: RefinementRequest):
-    """Refine an existing contract based on the provided instructions"""
-    try:
-        # Get the existing contract
-        existing_contract = await db.get_contract(request.contract_id)
-        if not existing_contract:
-            raise HTTPException(status_code=404, detail="Contract not found")
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics for this process"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
-        # Create refinement prompt
-        refinement_prompt = f"""Original Contract:
-{existing_contract["content"]}
 
-Refinement Instructions:
-{request.refinement_instructions}
+@app.get("/cache/stats")
+async def cache_stats():
+    """LLM response cache hit/miss counters"""
+    try:
+        return await cache.stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-Please provide a complete, refined version of this contract that incorporates the refinement instructions.
-"""
 
-        # Generate refined content
-        refined_content = await llm.generate_contract(refinement_prompt)
+@app.post("/contracts/refine/", response_model=Contract)
+async def refine_contract(
+    request: RefinementRequest, http_request: Request, job: bool = False
+):
+    """
+    Refine an existing contract based on the provided instructions
+
+    Accepts ?job=true and is rate limited like create_contract.
+    """
+    tenant = ratelimit.tenant_for(http_request)
+    if job:
+        await ratelimit.admit(tenant, track=False)
+        try:
+            return await _enqueue_job("refine", request.model_dump())
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async with ratelimit.admission(tenant):
+        try:
+            return await service.refine_contract(
+                request.contract_id,
+                request.refinement_instructions,
+                request.use_cache,
+                request.context_clauses,
+            )
+        except service.ContractNotFound:
+            raise HTTPException(status_code=404, detail="Contract not found")
+        except service.GenerationFailed as e:
+            raise HTTPException(status_code=502, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
-        # Save refined contract
-        refined_title = f"{existing_contract['title']} (Refined)"
-        contract_id = await db.save_contract(refined_title, refined_content)
 
-        return Contract(id=contract_id, title=refined_title, content=refined_content)
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get a generation job's status, queue position and timing"""
+    try:
+        job = await jobs.get_job(job_id)
     except Exception as e:
-        if isinstance(e, HTTPException):
-            raise e
         raise HTTPException(status_code=500, detail=str(e))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/result", response_model=Contract)
+async def get_job_result(job_id: str, http_request: Request):
+    """
+    Get the contract a job produced
+
+    Answers 202 with the job status while it is still queued or running.
+    """
+    job = await get_job(job_id)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] != "done":
+        return JSONResponse(status_code=202, content=job)
+    return await get_contract(job["contract_id"], http_request, None)
+
+
+@app.post("/contracts/stream")
+async def create_contract_stream(request: ContractRequest, http_request: Request):
+    """Generate a contract, streaming tokens back as NDJSON while it is written"""
+    ticket = await ratelimit.admit(ratelimit.tenant_for(http_request))
+    context = await service.retrieve_context(
+        request.description, request.context_clauses
+    )
+    return StreamingResponse(
+        _stream_and_save(
+            request.title,
+            llm.stream_contract(request.description, request.use_cache, context),
+            ticket=ticket,
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.post("/contracts/refine/stream")
+async def refine_contract_stream(request: RefinementRequest, http_request: Request):
+    """Refine an existing contract, streaming tokens back as NDJSON"""
+    try:
+        existing_contract = await contract_cache.get_contract(request.contract_id)
+        if existing_contract:
+            context = await service.refinement_context(
+                existing_contract,
+                request.refinement_instructions,
+                request.context_clauses,
+            )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not existing_contract:
+        raise HTTPException(status_code=404, detail="Contract not found")
+
+    refinement_prompt = service.refinement_prompt(
+        existing_contract, request.refinement_instructions
+    )
+    refined_title = f"{existing_contract['title']} (Refined)"
+    ticket = await ratelimit.admit(ratelimit.tenant_for(http_request))
+    # Sent as-is, so a failed or empty refinement is an error rather than a
+    # fallback contract saved as the next revision
+    stream = llm.stream_completion(
+        llm.build_prompt(refinement_prompt, context), request.use_cache
+    )
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        await ratelimit.release(ticket)
+        raise HTTPException(status_code=502, detail="The model returned nothing")
+    except Exception as e:
+        await ratelimit.release(ticket)
+        raise HTTPException(status_code=502, detail=f"Refinement failed: {e}")
+    return StreamingResponse(
+        _stream_and_save(
+            refined_title,
+            _prepend(first, stream),
+            parent_id=existing_contract["id"],
+            ticket=ticket,
+        ),
+        media_type="application/x-ndjson",
+    )
@@ -0,0 +1,180 @@
+import time
+import inspect
+import functools
+from typing import Callable, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Latency buckets (seconds) for Redis calls, which should take milliseconds
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+# Latency buckets (seconds) for model calls, which can take minutes
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+HTTP_REQUESTS = Counter(
+    "contractgen_http_requests_total",
+    "HTTP requests by route and status",
+    ["method", "route", "status"],
+)
+HTTP_LATENCY = Histogram(
+    "contractgen_http_request_duration_seconds",
+    "Time to send HTTP response headers, by route",
+    ["method", "route"],
+    buckets=SLOW_BUCKETS,
+)
+DB_LATENCY = Histogram(
+    "contractgen_db_duration_seconds",
+    "Contract store call latency, by function",
+    ["function"],
+    buckets=FAST_BUCKETS,
+)
+OLLAMA_LATENCY = Histogram(
+    "contractgen_ollama_duration_seconds",
+    "Ollama call latency, by operation",
+    ["operation"],
+    buckets=SLOW_BUCKETS,
+)
+OLLAMA_ERRORS = Counter(
+    "contractgen_ollama_errors_total",
+    "Ollama calls that raised, by operation",
+    ["operation"],
+)
+OLLAMA_TOKENS = Counter(
+    "contractgen_ollama_tokens_total",
+    "Tokens Ollama reported evaluating, by kind (prompt or completion)",
+    ["kind"],
+)
+OLLAMA_BACKEND_UP = Gauge(
+    "contractgen_ollama_backend_up",
+    "Whether each Ollama backend is receiving generations (1) or ejected (0)",
+    ["backend"],
+)
+OLLAMA_BACKEND_OUTSTANDING = Gauge(
+    "contractgen_ollama_backend_outstanding",
+    "Generations currently routed to each Ollama backend",
+    ["backend"],
+)
+OLLAMA_MODEL_LOADED = Gauge(
+    "contractgen_ollama_model_loaded",
+    "Whether each Ollama backend has the model loaded in memory",
+    ["backend"],
+)
+GENERATIONS_IN_FLIGHT = Gauge(
+    "contractgen_generations_in_flight",
+    "Generations currently waiting on Ollama, by operation",
+    ["operation"],
+)
+JOB_QUEUE_WAIT = Histogram(
+    "contractgen_job_queue_wait_seconds",
+    "Time jobs spent queued before a worker started them, by kind",
+    ["kind"],
+    buckets=SLOW_BUCKETS,
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "contractgen_rate_limit_rejections_total",
+    "Generation requests turned away, by reason (rate, capacity or size)",
+    ["reason"],
+)
+CACHE_REQUESTS = Counter(
+    "contractgen_llm_cache_requests_total",
+    "LLM cache lookups by result (hit or miss)",
+    ["result"],
+)
+CACHE_EVICTIONS = Counter(
+    "contractgen_llm_cache_evictions_total",
+    "LLM cache entries evicted to stay under LLM_CACHE_MAX_ENTRIES",
+)
+CONTRACT_CACHE_REQUESTS = Counter(
+    "contractgen_contract_cache_requests_total",
+    "In-process contract cache lookups by result (hit or miss)",
+    ["result"],
+)
+CONTRACT_CACHE_EVICTIONS = Counter(
+    "contractgen_contract_cache_evictions_total",
+    "Contracts dropped from the in-process cache, by reason (size or invalidated)",
+    ["reason"],
+)
+CONTRACT_CACHE_BYTES = Gauge(
+    "contractgen_contract_cache_bytes",
+    "Memory taken by contracts in the in-process cache",
+)
+
+
+def timed(histogram: Histogram, errors: Optional[Counter] = None, **labels) -> Callable:
+    """
+    Decorate an async function or async generator to record its latency
+
+    An async generator is timed from its first step until it finishes.
+    Errors are counted in `errors` too, if given.
+    """
+
+    def decorator(fn):
+        observe = histogram.labels(**labels).observe
+        count_error = errors.labels(**labels).inc if errors else lambda: None
+
+        if inspect.isasyncgenfunction(fn):
+
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                except Exception:
+                    count_error()
+                    raise
+                finally:
+                    observe(time.perf_counter() - start)
+
+            return wrapper
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                count_error()
+                raise
+            finally:
+                observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def in_flight(gauge: Gauge, **labels) -> Callable:
+    """Decorate an async function or async generator to count running calls"""
+
+    def decorator(fn):
+        tracked = gauge.labels(**labels)
+
+        if inspect.isasyncgenfunction(fn):
+
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                tracked.inc()
+                try:
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                finally:
+                    tracked.dec()
+
+            return wrapper
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            tracked.inc()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                tracked.dec()
+
+        return wrapper
+
+    return decorator
+
+
+def db_timed(fn):
+    """Record a contract store function's latency under its own name"""
+    return timed(DB_LATENCY, function=fn.__name__)(fn)
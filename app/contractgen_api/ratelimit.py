@@ -0,0 +1,178 @@
+import os
+import math
+import uuid
+import hashlib
+import contextlib
+from typing import Optional, Tuple
+
+from fastapi import Request
+
+from .db import get_redis
+from . import jobs
+from . import metrics
+
+# Admission control configuration from environment variables
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Generations each tenant may start per second, sustained
+RATE_LIMIT_RATE = float(os.environ.get("RATE_LIMIT_RATE", 0.5))
+# Generations a tenant may start at once after being idle
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 10))
+# Most generations pending across every replica, running or queued as jobs;
+# 0 for no limit
+MAX_PENDING_GENERATIONS = int(os.environ.get("MAX_PENDING_GENERATIONS", 64))
+# Longest a pending generation is counted if its replica never releases it
+# (seconds); this should exceed the Ollama generation timeout
+PENDING_TTL = int(os.environ.get("PENDING_TTL", 330))
+# Retry-After sent when every generation slot is taken (seconds)
+QUEUE_FULL_RETRY_AFTER = int(os.environ.get("QUEUE_FULL_RETRY_AFTER", 5))
+
+# Redis keys
+BUCKET_KEY_PREFIX = "ratelimit:bucket:"
+# Sorted set of pending generations scored by when they stop counting
+PENDING_KEY = "ratelimit:pending"
+
+# Checks the global pending limit, then takes `cost` tokens from the tenant's
+# bucket and records the generations as pending. Pending generations are the
+# tracked requests plus jobs queued or running. Returns {0} when admitted,
+# {1, seconds until enough tokens} when rate limited, or {2} when full.
+_ADMIT_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local max_pending = tonumber(ARGV[4])
+local ttl = tonumber(ARGV[5])
+local ticket = ARGV[6]
+
+if max_pending > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+    redis.call('ZREMRANGEBYSCORE', KEYS[4], '-inf', now)
+    local depth = redis.call('ZCARD', KEYS[2]) + redis.call('ZCARD', KEYS[3])
+        + redis.call('ZCARD', KEYS[4])
+    if depth + cost > max_pending then
+        return {2}
+    end
+end
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+if tokens < cost then
+    return {1, tostring((cost - tokens) / rate)}
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - cost), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+if ticket ~= '' then
+    for i = 1, cost do
+        redis.call('ZADD', KEYS[2], now + ttl, ticket .. ':' .. i)
+    end
+end
+return {0}
+"""
+
+
+class RateLimited(Exception):
+    """Raised when a generation request is turned away"""
+
+    def __init__(
+        self, status_code: int, detail: str, retry_after: Optional[float] = None
+    ):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        # Whole seconds, as the Retry-After header needs; None when retrying
+        # the same request can't succeed
+        self.retry_after = (
+            max(1, math.ceil(retry_after)) if retry_after is not None else None
+        )
+
+
+def tenant_for(request: Request) -> str:
+    """Identify who a request counts against: its API key, else its address"""
+    api_key = request.headers.get("X-API-Key")
+    if api_key:
+        # Keys are secrets; only a digest of one ends up in Redis
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+async def admit(
+    tenant: str, cost: int = 1, track: bool = True
+) -> Optional[Tuple[str, int]]:
+    """
+    Admit `cost` generations for a tenant, or raise RateLimited
+
+    More than RATE_LIMIT_BURST or MAX_PENDING_GENERATIONS generations could
+    never be admitted at once, so those requests are turned away with a 413
+    instead.
+
+    Args:
+        track: Count the generations as pending until release() is called.
+            Jobs don't need this; the job queue already counts them.
+
+    Returns:
+        A ticket to pass to release(), or None if nothing needs releasing
+    """
+    if not RATE_LIMIT_ENABLED:
+        return None
+    cost = max(1, cost)
+    most = min(RATE_LIMIT_BURST, MAX_PENDING_GENERATIONS or RATE_LIMIT_BURST)
+    if cost > most:
+        metrics.RATE_LIMIT_REJECTIONS.labels("size").inc()
+        raise RateLimited(413, f"At most {most} generations can be requested at once")
+    ticket = uuid.uuid4().hex if track and MAX_PENDING_GENERATIONS else ""
+
+    try:
+        redis = await get_redis()
+        result = await redis.eval(
+            _ADMIT_SCRIPT,
+            4,
+            f"{BUCKET_KEY_PREFIX}{tenant}",
+            PENDING_KEY,
+            jobs.JOB_QUEUE_KEY,
+            jobs.JOB_RUNNING_KEY,
+            RATE_LIMIT_RATE,
+            RATE_LIMIT_BURST,
+            cost,
+            MAX_PENDING_GENERATIONS,
+            PENDING_TTL,
+            ticket,
+        )
+    except Exception as e:
+        # Admission control protects Ollama; it must not take the API down
+        print(f"Error checking rate limit: {e}")
+        return None
+
+    if result[0] == 1:
+        metrics.RATE_LIMIT_REJECTIONS.labels("rate").inc()
+        raise RateLimited(429, "Rate limit exceeded", float(result[1]))
+    if result[0] == 2:
+        metrics.RATE_LIMIT_REJECTIONS.labels("capacity").inc()
+        raise RateLimited(503, "Generation capacity full", QUEUE_FULL_RETRY_AFTER)
+    return (ticket, cost) if ticket else None
+
+
+async def release(ticket: Optional[Tuple[str, int]]):
+    """Stop counting admitted generations as pending"""
+    if ticket is None:
+        return
+    ticket_id, cost = ticket
+    try:
+        redis = await get_redis()
+        await redis.zrem(PENDING_KEY, *[f"{ticket_id}:{i}" for i in range(1, cost + 1)])
+    except Exception as e:
+        # The entries expire after PENDING_TTL anyway
+        print(f"Error releasing rate limit ticket: {e}")
+
+
+@contextlib.asynccontextmanager
+async def admission(tenant: str, cost: int = 1):
+    """Hold admission for generations running in the enclosed block"""
+    ticket = await admit(tenant, cost)
+    try:
+        yield
+    finally:
+        await release(ticket)
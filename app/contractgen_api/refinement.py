@@ -0,0 +1,229 @@
+import os
+import re
+import math
+import asyncio
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from . import llm
+from .clauses import split_clauses
+from .search import BM25_B, BM25_K1, tokenize
+
+# Refinement configuration from environment variables
+# Set to false to always regenerate whole contracts when refining
+REFINE_BY_SECTION = os.environ.get("REFINE_BY_SECTION", "true").lower() == "true"
+# Most sections regenerated for one refinement; instructions touching more
+# than this regenerate the whole contract instead
+REFINE_MAX_SECTIONS = int(os.environ.get("REFINE_MAX_SECTIONS", 3))
+# Sections scoring below this share of the best match are left alone
+REFINE_RELATIVE_SCORE = 0.5
+
+# "section 4", "clause 2.1" and the like in refinement instructions
+SECTION_REFERENCE = re.compile(
+    r"\b(?:section|clause|article|paragraph)s?\s+(\d+(?:\.\d+)*)", re.IGNORECASE
+)
+# The number a section starts with: "4.", "2.1", "**3.", "Section 5"
+SECTION_NUMBER = re.compile(
+    r"^\s*(?:#+\s*)?(?:\*\*)?\s*(?:(?:section|article|clause)\s+)?(\d+(?:\.\d+)*)",
+    re.IGNORECASE,
+)
+# Instructions asking for something the contract doesn't have yet
+ADD_INTENT = re.compile(r"^\s*(?:please\s+)?(?:add|insert|include|append)\b", re.I)
+# Words that say what to do rather than which section to do it to
+INSTRUCTION_WORDS = frozenset(
+    """add amend append change clause contract agreement delete include insert
+    make modify new please remove replace revise section set update""".split()
+)
+
+
+def section_number(section: str) -> Optional[str]:
+    """The number a section's heading starts with, if any"""
+    match = SECTION_NUMBER.match(section)
+    return match.group(1) if match else None
+
+
+def _score_sections(sections: List[str], instructions: str) -> List[float]:
+    """BM25 score of each section against the instructions"""
+    query = [term for term in tokenize(instructions) if term not in INSTRUCTION_WORDS]
+    counts = [Counter(tokenize(section)) for section in sections]
+    lengths = [sum(c.values()) for c in counts]
+    average = sum(lengths) / len(lengths) or 1
+    scores = []
+    for terms, length in zip(counts, lengths):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average)
+        score = 0.0
+        for term in set(query):
+            if terms[term]:
+                df = sum(1 for c in counts if c[term])
+                idf = math.log(1 + (len(sections) - df + 0.5) / (df + 0.5))
+                score += idf * terms[term] * (BM25_K1 + 1) / (terms[term] + norm)
+        scores.append(score)
+    return scores
+
+
+def select_sections(sections: List[str], instructions: str) -> List[int]:
+    """
+    Pick the positions of the sections a refinement should rewrite
+
+    Sections the instructions name by number win; otherwise the sections
+    that best match the instructions' terms are chosen.
+    """
+    references = SECTION_REFERENCE.findall(instructions)
+    if references:
+        numbers = [section_number(section) for section in sections]
+        return [
+            i
+            for i, number in enumerate(numbers)
+            if number
+            and any(number == ref or number.startswith(ref + ".") for ref in references)
+        ]
+
+    scores = _score_sections(sections, instructions)
+    best = max(scores, default=0.0)
+    if best <= 0:
+        return []
+    return [
+        i for i, score in enumerate(scores) if score >= best * REFINE_RELATIVE_SCORE
+    ]
+
+
+def _outline(sections: List[str]) -> str:
+    """The first line of every section, to show the model the whole contract"""
+    lines = []
+    for section in sections:
+        first = section.strip().split("\n", 1)[0]
+        if first:
+            lines.append(first if len(first) <= 100 else first[:97] + "...")
+    return "\n".join(lines)
+
+
+def _section_prompt(
+    outline: str, section: str, instructions: str, context: Optional[str]
+) -> str:
+    prompt = f"""You are a legal expert revising one section of a contract.
+
+Outline of the whole contract:
+{outline}
+
+Section to revise:
+{section.strip()}
+
+Refinement Instructions:
+{instructions}
+"""
+    if context:
+        prompt += f"""
+Where they fit, adapt the following clauses from existing contracts:
+{context}
+"""
+    return (
+        prompt
+        + """
+Reply with only the revised section, starting with its heading and keeping its numbering. If the instructions don't apply to this section, reply with it unchanged.
+"""
+    )
+
+
+def _new_section_prompt(
+    outline: str, number: Optional[str], instructions: str, context: Optional[str]
+) -> str:
+    heading = f"numbered {number}" if number else "with a heading"
+    prompt = f"""You are a legal expert adding a section to a contract.
+
+Outline of the whole contract:
+{outline}
+
+Instructions:
+{instructions}
+"""
+    if context:
+        prompt += f"""
+Where they fit, adapt the following clauses from existing contracts:
+{context}
+"""
+    return (
+        prompt
+        + f"""
+Reply with only the new section, {heading}, written to match the rest of the contract.
+"""
+    )
+
+
+def _clean(completion: str) -> str:
+    """Strip whitespace and any code fence the model wrapped its reply in"""
+    text = completion.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    return text.strip()
+
+
+def _trailing_whitespace(text: str) -> str:
+    return text[len(text.rstrip()) :]
+
+
+def _insertion_point(sections: List[str]) -> Tuple[int, Optional[str]]:
+    """Where a new section goes, and its number: after the last numbered one"""
+    numbered = [(i, section_number(s)) for i, s in enumerate(sections)]
+    numbered = [(i, number) for i, number in numbered if number]
+    if not numbered:
+        return len(sections), None
+    top_level = max(int(number.split(".")[0]) for _, number in numbered)
+    return numbered[-1][0] + 1, str(top_level + 1)
+
+
+async def refine_sections(
+    content: str,
+    instructions: str,
+    use_cache: bool = True,
+    context: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Refine a contract by regenerating only the sections the change affects
+
+    The contract is split into its numbered sections; the ones relevant to
+    the instructions are rewritten concurrently and spliced back in, and
+    everything else is kept byte for byte. Instructions to add something
+    that matches no section produce a new section after the last one.
+
+    Returns:
+        The refined contract, or None if the change can't be confined to a
+        few sections and the whole contract should be regenerated instead
+    """
+    sections = split_clauses(content)
+    if len(sections) < 2:
+        return None
+    outline = _outline(sections)
+    selected = select_sections(sections, instructions)
+
+    if not selected:
+        if not ADD_INTENT.match(instructions):
+            return None
+        position, number = _insertion_point(sections)
+        completion = await llm.complete(
+            _new_section_prompt(outline, number, instructions, context), use_cache
+        )
+        # Keep the blank line that separates sections on both sides
+        before = sections[:position]
+        if before and not before[-1].endswith("\n\n"):
+            before[-1] = before[-1].rstrip() + "\n\n"
+        new_section = _clean(completion) + "\n\n"
+        return "".join(before + [new_section] + sections[position:]).rstrip() + (
+            _trailing_whitespace(content)
+        )
+
+    if len(selected) > REFINE_MAX_SECTIONS:
+        return None
+
+    completions = await asyncio.gather(
+        *(
+            llm.complete(
+                _section_prompt(outline, sections[i], instructions, context),
+                use_cache,
+            )
+            for i in selected
+        )
+    )
+    for i, completion in zip(selected, completions):
+        sections[i] = _clean(completion) + _trailing_whitespace(sections[i])
+    return "".join(sections)
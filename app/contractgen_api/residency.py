@@ -0,0 +1,209 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import llm
+from .db import get_redis
+
+# Model residency configuration from environment variables
+MODEL_RESIDENCY_ENABLED = (
+    os.environ.get("MODEL_RESIDENCY_ENABLED", "true").lower() == "true"
+)
+# How often the manager decides whether the model should be loaded (seconds)
+MODEL_RESIDENCY_INTERVAL = float(os.environ.get("MODEL_RESIDENCY_INTERVAL", 60))
+# Unload the model once no replica has generated anything for this long
+# (seconds); 0 to keep it loaded for as long as the API runs
+MODEL_IDLE_UNLOAD = int(os.environ.get("MODEL_IDLE_UNLOAD", 15 * 60))
+# Hours of the day (API local time) to keep the model loaded with or without
+# traffic, e.g. "8-18" or "8-12,13-18"; empty for none
+MODEL_WARM_HOURS = os.environ.get("MODEL_WARM_HOURS", "")
+# Load the model ahead of an hour in which at least this many generations
+# ran the day or the week before; 0 to disable
+MODEL_PREDICT_MIN_GENERATIONS = int(os.environ.get("MODEL_PREDICT_MIN_GENERATIONS", 5))
+# How long before a predicted busy hour to load the model (seconds)
+MODEL_PREDICT_LEAD = int(os.environ.get("MODEL_PREDICT_LEAD", 10 * 60))
+
+# Redis keys
+# When any replica last generated something (epoch seconds), as the score
+# of a single member so ZADD GT keeps the latest report
+LAST_USED_KEY = "residency:last_used"
+# Generations per hour, by "%Y%m%d%H" (local time), kept for 8 days
+TRAFFIC_KEY_PREFIX = "residency:traffic:"
+TRAFFIC_TTL = 8 * 24 * 60 * 60
+
+
+def parse_hours(spec: str) -> List[Tuple[int, int]]:
+    """Parse "8-18,20-22" into [(8, 18), (20, 22)]; each end is exclusive"""
+    windows = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        start, _, end = part.partition("-")
+        windows.append((int(start), int(end or int(start) + 1)))
+    return windows
+
+
+def _in_windows(hour: int, windows: List[Tuple[int, int]]) -> bool:
+    # A window like 22-6 runs past midnight
+    return any(
+        start <= hour < end if start <= end else hour >= start or hour < end
+        for start, end in windows
+    )
+
+
+def _traffic_key(when: datetime) -> str:
+    return f"{TRAFFIC_KEY_PREFIX}{when.strftime('%Y%m%d%H')}"
+
+
+class ResidencyManager:
+    """
+    Keeps the model loaded in Ollama while it's likely to be needed
+
+    Ollama unloads a model after keep_alive without requests, and the next
+    generation then waits several seconds for it to load again. Every
+    interval, the manager decides whether the model is wanted:
+
+    - during MODEL_WARM_HOURS,
+    - while any replica has generated within MODEL_IDLE_UNLOAD, or
+    - within MODEL_PREDICT_LEAD of an hour that was busy a day or a week ago.
+
+    A wanted model is loaded on every reachable backend, or has its
+    keep_alive renewed; otherwise it's unloaded. Replicas share their usage
+    through Redis, so they all reach the same decision.
+    """
+
+    def __init__(self, provider: llm.OllamaProvider):
+        self.provider = provider
+        self.windows = parse_hours(MODEL_WARM_HOURS)
+        # Why the model was last wanted, or None if it wasn't
+        self.reason: Optional[str] = None
+        self._published = 0
+        self._started = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, interval: float = MODEL_RESIDENCY_INTERVAL):
+        """Load the model now, then manage it in the background"""
+        if self._task is None:
+            self._started = time.time()
+            self._task = asyncio.create_task(self._loop(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self, interval: float):
+        # The model is wanted at startup: the first requests are on their way
+        await self.apply("startup")
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.apply(await self.wanted())
+            except Exception as e:
+                print(f"Error managing model residency: {e}")
+
+    async def wanted(self, now: Optional[datetime] = None) -> Optional[str]:
+        """Why the model should be loaded now, or None if it shouldn't"""
+        now = now or datetime.now()
+        last_used, traffic = await self._usage(now)
+        # Give the first requests after startup a full idle window
+        last_used = max(last_used, self._started)
+
+        if _in_windows(now.hour, self.windows):
+            return "schedule"
+        if not MODEL_IDLE_UNLOAD or time.time() - last_used < MODEL_IDLE_UNLOAD:
+            return "traffic"
+        if MODEL_PREDICT_MIN_GENERATIONS and any(
+            count >= MODEL_PREDICT_MIN_GENERATIONS for count in traffic
+        ):
+            return "predicted"
+        return None
+
+    async def _usage(self, now: datetime) -> Tuple[float, List[int]]:
+        """
+        Publish this replica's generations and read everyone's
+
+        Returns when any replica last generated something, and the counts
+        for the hour ahead a day and a week ago.
+        """
+        last_used = self.provider.last_used
+        new = self.provider.generations - self._published
+        ahead = now + timedelta(seconds=MODEL_PREDICT_LEAD)
+        try:
+            redis = await get_redis()
+            pipe = redis.pipeline(transaction=False)
+            if new:
+                key = _traffic_key(now)
+                pipe.incrby(key, new)
+                pipe.expire(key, TRAFFIC_TTL)
+                # Keep the latest time any replica reports
+                pipe.zadd(LAST_USED_KEY, {"last": last_used}, gt=True)
+            pipe.zscore(LAST_USED_KEY, "last")
+            pipe.mget([_traffic_key(ahead - timedelta(days=days)) for days in (1, 7)])
+            results = await pipe.execute()
+        except Exception as e:
+            # Decide on this replica's usage alone until Redis is back
+            print(f"Error sharing model usage: {e}")
+            return last_used, []
+
+        self._published += new
+        shared_last_used, counts = results[-2:]
+        return (
+            max(last_used, shared_last_used or 0.0),
+            [int(count) for count in counts if count is not None],
+        )
+
+    async def apply(self, reason: Optional[str]):
+        """Load (or keep loaded) the model on every backend, or unload it"""
+        if reason is not None and self.reason is None:
+            print(f"Loading model {self.provider.model} ({reason})")
+        elif reason is None and self.reason is not None:
+            print(f"Unloading idle model {self.provider.model}")
+        self.reason = reason
+
+        async def manage(backend: llm.OllamaBackend):
+            if not backend.reachable:
+                return
+            if reason is not None:
+                await backend.load()
+                await backend.check_loaded()
+            elif await backend.check_loaded():
+                await backend.unload()
+
+        results = await asyncio.gather(
+            *(manage(backend) for backend in self.provider.backends),
+            return_exceptions=True,
+        )
+        for backend, result in zip(self.provider.backends, results):
+            if isinstance(result, Exception):
+                print(f"Error managing model on {backend.host}: {result}")
+
+    def status(self) -> Dict[str, Any]:
+        """The model's load state on each backend, for the health endpoint"""
+        return {
+            "name": self.provider.model,
+            "wanted": self.reason,
+            "backends": [
+                {
+                    "host": backend.host,
+                    "reachable": backend.reachable,
+                    "loaded": backend.loaded is not None,
+                    "expires_at": (backend.loaded or {}).get("expires_at"),
+                }
+                for backend in self.provider.backends
+            ],
+        }
+
+
+# Manager instance
+_manager = None
+
+
+def get_manager() -> ResidencyManager:
+    """Get or create the residency manager for the shared provider"""
+    global _manager
+    if _manager is None:
+        _manager = ResidencyManager(llm.get_provider())
+    return _manager
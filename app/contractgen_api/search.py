@@ -0,0 +1,164 @@
+import re
+import math
+import uuid
+import asyncio
+import argparse
+from collections import Counter
+from typing import Any, Dict, List
+
+from .db import get_redis
+from . import db
+
+# Redis keys
+# Sorted set per term: contract ID -> BM25 term weight in that contract
+TERM_KEY_PREFIX = "search:term:"
+# Hash of contract ID -> number of indexed terms, for length normalisation
+DOC_LENGTHS_KEY = "search:doclen"
+# Hash with the number of indexed contracts and their total length
+STATS_KEY = "search:stats"
+SEARCH_KEY_PREFIX = "search:"
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Terms in more than this share of contracts barely affect ranking; they're
+# dropped from a query when it has rarer terms, which keeps unions small
+COMMON_TERM_RATIO = 0.5
+
+# Records a contract's length and returns {docs, total_length}. Indexing a
+# contract again only corrects its length, so it's never counted twice.
+_RECORD_LENGTH_SCRIPT = """
+local old = redis.call('HGET', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+if not old then
+    redis.call('HINCRBY', KEYS[2], 'docs', 1)
+    old = 0
+end
+redis.call('HINCRBY', KEYS[2], 'total_length', tonumber(ARGV[2]) - tonumber(old))
+return redis.call('HMGET', KEYS[2], 'docs', 'total_length')
+"""
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    """a an and are as at be by for from has have in is it its of on or shall
+    that the this to was were will with""".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase index terms"""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if len(token) < 2 or token in STOPWORDS:
+            continue
+        # Fold simple plurals so "clauses" finds "clause"
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        terms.append(token)
+    return terms
+
+
+async def index_contract(contract_id: int, title: str, content: str):
+    """Add a contract to the search index, or update it if it's already there"""
+    redis = await get_redis()
+    terms = Counter(tokenize(f"{title}\n{content}"))
+    length = sum(terms.values())
+
+    docs, total_length = await redis.eval(
+        _RECORD_LENGTH_SCRIPT, 2, DOC_LENGTHS_KEY, STATS_KEY, contract_id, length
+    )
+    average_length = int(total_length) / int(docs)
+
+    # Term weights are normalised against the average length at index time;
+    # rebuilding the index re-normalises everything
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+    pipe = redis.pipeline(transaction=False)
+    for term, count in terms.items():
+        weight = count * (BM25_K1 + 1) / (count + norm)
+        pipe.zadd(f"{TERM_KEY_PREFIX}{term}", {contract_id: weight})
+    await pipe.execute()
+
+
+async def search(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Find the contracts that best match a query, best first
+
+    Returns:
+        [{"id": ..., "title": ..., "score": ...}]
+    """
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return []
+    redis = await get_redis()
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.hget(STATS_KEY, "docs")
+    for term in terms:
+        pipe.zcard(f"{TERM_KEY_PREFIX}{term}")
+    docs, *frequencies = await pipe.execute()
+    docs = int(docs or 0)
+
+    frequencies = {term: df for term, df in zip(terms, frequencies) if df}
+    if not frequencies:
+        return []
+    rare = {
+        term: df for term, df in frequencies.items() if df <= docs * COMMON_TERM_RATIO
+    }
+    weights = {
+        f"{TERM_KEY_PREFIX}{term}": math.log(1 + (docs - df + 0.5) / (df + 0.5))
+        for term, df in (rare or frequencies).items()
+    }
+
+    # Score and rank on the server, then drop the scratch key
+    scratch = f"{SEARCH_KEY_PREFIX}query:{uuid.uuid4().hex}"
+    pipe = redis.pipeline()
+    pipe.zunionstore(scratch, weights)
+    pipe.zrevrange(scratch, 0, limit - 1, withscores=True)
+    pipe.delete(scratch)
+    hits = (await pipe.execute())[1]
+
+    ids = [int(contract_id) for contract_id, _ in hits]
+    metadata = await db.get_contracts_metadata(ids)
+    return [
+        {"id": meta["id"], "title": meta["title"], "score": score}
+        for meta, (_, score) in zip(metadata, hits)
+        if meta
+    ]
+
+
+async def rebuild() -> int:
+    """
+    Rebuild the search index from every stored contract
+
+    Contracts saved mid-rebuild may be indexed twice, which indexing
+    tolerates.
+    """
+    redis = await get_redis()
+    async for key in redis.scan_iter(match=f"{SEARCH_KEY_PREFIX}*", count=1000):
+        await redis.delete(key)
+
+    indexed = 0
+    cursor = 0
+    while True:
+        page, cursor = await db.get_contracts_page(cursor, db.MAX_PAGE_SIZE)
+        for contract in page:
+            await index_contract(contract["id"], contract["title"], contract["content"])
+        indexed += len(page)
+        if cursor is None:
+            return indexed
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Contract search index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="Rebuild the index from stored contracts")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        print("Rebuilding search index...")
+        count = await rebuild()
+        print(f"Indexed {count} contracts.")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
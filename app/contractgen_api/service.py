@@ -0,0 +1,316 @@
+import os
+import asyncio
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from . import db
+from . import contract_cache
+from . import llm
+from . import refinement
+from . import search
+from . import sessions
+from . import vectors
+
+# Most generations a single batch request runs at the same time
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 4))
+# Most contracts accepted in a single batch request
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 100))
+
+
+class ContractNotFound(Exception):
+    """Raised when a contract ID doesn't exist"""
+
+
+class GenerationFailed(Exception):
+    """Raised when the model couldn't produce a contract"""
+
+
+def refinement_prompt(existing_contract: Dict[str, Any], instructions: str) -> str:
+    """Build the LLM prompt for refining an existing contract"""
+    return f"""Original Contract:
+{existing_contract["content"]}
+
+Refinement Instructions:
+{instructions}
+
+Please provide a complete, refined version of this contract that incorporates the refinement instructions.
+"""
+
+
+def follow_up_prompt(instructions: str) -> str:
+    """Build the prompt for refining a contract the model has just written"""
+    return f"""Refinement Instructions:
+{instructions}
+
+Please provide a complete, refined version of the contract from your last reply that incorporates the refinement instructions.
+"""
+
+
+async def save_contract(
+    title: str, content: str, parent_id: Optional[int] = None
+) -> int:
+    """Save a contract and add it to the search index"""
+    contract_id = await db.save_contract(title, content, parent_id=parent_id)
+    await index_contract(contract_id, title, content)
+    return contract_id
+
+
+async def index_contract(contract_id: int, title: str, content: str):
+    """Index a saved contract; a failure here never fails the save"""
+    try:
+        await search.index_contract(contract_id, title, content)
+    except Exception as e:
+        print(f"Error indexing contract {contract_id}: {e}")
+    try:
+        await vectors.index_contract(contract_id, content)
+    except Exception as e:
+        print(f"Error adding contract {contract_id} to the vector index: {e}")
+
+
+async def retrieve_context(
+    query: str, count: int, exclude: Iterable[int] = ()
+) -> Optional[str]:
+    """
+    Find the stored clauses most relevant to a request, for the LLM prompt
+
+    Returns None when no clauses were asked for or none were found; retrieval
+    failing never fails the generation.
+    """
+    if count <= 0:
+        return None
+    try:
+        clauses = await vectors.search(query, count, exclude)
+    except Exception as e:
+        print(f"Error retrieving clauses: {e}")
+        return None
+    if not clauses:
+        return None
+    return "\n\n".join(
+        f'From "{clause["title"]}":\n{clause["clause"]}' for clause in clauses
+    )
+
+
+async def generate_contract(
+    description: str, use_cache: bool = True, context: Optional[str] = None
+) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Generate a new contract, in a session its refinements can continue
+
+    Returns:
+        The contract, and the session to keep with it, if any
+    """
+    if sessions.REFINE_SESSIONS_ENABLED:
+        try:
+            return await llm.generate_contract_in_session(
+                description, use_cache=use_cache, context=context
+            )
+        except Exception as e:
+            print(f"Error generating contract in a session: {e}")
+    return await llm.generate_contract(description, use_cache, context), None
+
+
+async def create_contract(
+    title: str, description: str, use_cache: bool = True, context_clauses: int = 0
+) -> Dict[str, Any]:
+    """
+    Generate a contract from a description and save it
+
+    With context_clauses, that many of the most relevant stored clauses are
+    added to the prompt.
+    """
+    context = await retrieve_context(description, context_clauses)
+
+    # Use LLM to generate contract content
+    content, session = await generate_contract(description, use_cache, context)
+
+    # Save to database
+    contract_id = await save_contract(title, content)
+    if session is not None:
+        await sessions.save(contract_id, session)
+
+    # Read back, so the response matches GET /contracts/{id}
+    return await db.get_contract(contract_id)
+
+
+async def refine_contract(
+    contract_id: int,
+    refinement_instructions: str,
+    use_cache: bool = True,
+    context_clauses: int = 0,
+) -> Dict[str, Any]:
+    """
+    Refine an existing contract and save the result as a new contract
+
+    Only the sections the instructions affect are regenerated when they
+    can be found (see refinement.refine_sections); otherwise the whole
+    contract is. Whole contracts are regenerated in a session kept with
+    each revision, so refining a revision again only sends the model the
+    new instructions. A revision made by section carries its parent's
+    session forward with the instructions the model hasn't seen, which are
+    sent along with the next whole-contract refinement. Accepts
+    context_clauses like create_contract; clauses from the contract's own
+    revision chain are never retrieved.
+    """
+    # Get the existing contract
+    existing_contract = await contract_cache.get_contract(contract_id)
+    if not existing_contract:
+        raise ContractNotFound(contract_id)
+
+    context = await refinement_context(
+        existing_contract, refinement_instructions, context_clauses
+    )
+
+    # Instructions applied by section since the session's last reply
+    parent_session = await sessions.get(existing_contract["id"])
+    unseen = parent_session.get("unseen", []) if parent_session else []
+
+    # Generate refined content
+    refined_content = None
+    session = None
+    if refinement.REFINE_BY_SECTION:
+        try:
+            refined_content = await refinement.refine_sections(
+                existing_contract["content"],
+                refinement_instructions,
+                use_cache,
+                context,
+            )
+        except Exception as e:
+            raise GenerationFailed(f"Refinement failed: {e}") from e
+        if refined_content is not None and parent_session is not None:
+            session = {
+                **parent_session,
+                "unseen": unseen + [refinement_instructions],
+            }
+    if refined_content is None and sessions.REFINE_SESSIONS_ENABLED:
+        try:
+            refined_content, session = await llm.generate_contract_in_session(
+                refinement_prompt(existing_contract, refinement_instructions),
+                parent_session,
+                follow_up_prompt("\n\n".join(unseen + [refinement_instructions])),
+                use_cache,
+                context,
+            )
+        except Exception as e:
+            print(f"Error refining contract {contract_id} in a session: {e}")
+    if refined_content is None:
+        # Sent as-is: a refinement must never be saved as fallback text
+        try:
+            refined_content = await llm.complete(
+                llm.build_prompt(
+                    refinement_prompt(existing_contract, refinement_instructions),
+                    context,
+                ),
+                use_cache,
+            )
+        except Exception as e:
+            raise GenerationFailed(f"Refinement failed: {e}") from e
+
+    # Save refined contract as the next version of the one it refines
+    refined_title = f"{existing_contract['title']} (Refined)"
+    refined_id = await save_contract(
+        refined_title, refined_content, parent_id=existing_contract["id"]
+    )
+    if session is not None:
+        await sessions.save(refined_id, session)
+
+    return await db.get_contract(refined_id)
+
+
+async def refinement_context(
+    existing_contract: Dict[str, Any], instructions: str, count: int
+) -> Optional[str]:
+    """Retrieve clauses for refining a contract from other contracts"""
+    if count <= 0:
+        return None
+    versions = await db.get_versions(existing_contract["id"]) or []
+    return await retrieve_context(
+        instructions, count, exclude=[version["id"] for version in versions]
+    )
+
+
+async def import_contracts(
+    contracts: List[Dict[str, Any]], index: bool = True
+) -> List[int]:
+    """
+    Import exported contracts (see db.import_contracts), returning their IDs
+
+    With index, imported contracts are added to the search indexes too;
+    otherwise rebuild the indexes once the import is done.
+    """
+    ids = await db.import_contracts(contracts)
+    if index:
+        imported = set(ids)
+        for contract in contracts:
+            if contract["id"] in imported:
+                await index_contract(
+                    contract["id"], contract["title"], contract["content"]
+                )
+    return ids
+
+
+async def create_contracts(
+    requests: List[Tuple[str, str, bool, int]],
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Generate and save a batch of contracts, yielding each result as it lands
+
+    Args:
+        requests: (title, description, use_cache, context_clauses) for each
+            contract
+
+    Yields:
+        {"index": ..., "id": ..., "title": ..., "content": ...} per saved
+        contract, or {"index": ..., "error": ...} if its generation failed.
+        Results arrive in completion order; "index" is the request position.
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def generate(
+        index: int,
+        title: str,
+        description: str,
+        use_cache: bool,
+        context_clauses: int,
+    ):
+        context = await retrieve_context(description, context_clauses)
+        async with semaphore:
+            content, session = await generate_contract(description, use_cache, context)
+        return index, title, content, session
+
+    tasks = [
+        asyncio.create_task(generate(index, *request))
+        for index, request in enumerate(requests)
+    ]
+    task_index = {task: index for index, task in enumerate(tasks)}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            finished = []
+            for task in done:
+                if task.exception() is not None:
+                    yield {"index": task_index[task], "error": str(task.exception())}
+                else:
+                    finished.append(task.result())
+
+            # Everything that finished together is written in one pipeline
+            ids = await db.save_contracts(
+                [(title, content) for _, title, content, _ in finished]
+            )
+            for contract_id, (index, title, content, session) in zip(ids, finished):
+                await index_contract(contract_id, title, content)
+                if session is not None:
+                    await sessions.save(contract_id, session)
+                yield {
+                    "index": index,
+                    "id": contract_id,
+                    "title": title,
+                    "content": content,
+                }
+    finally:
+        # Stop generating if the caller goes away part way through
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,51 @@
+import os
+from typing import Any, Dict, Optional
+
+from . import codec
+from .db import get_redis
+
+# Refinement session configuration from environment variables
+REFINE_SESSIONS_ENABLED = (
+    os.environ.get("REFINE_SESSIONS_ENABLED", "true").lower() == "true"
+)
+# How long a revision's session is kept (seconds). Ollama only skips the
+# earlier prompt while it still has it in memory, so this is best kept near
+# the time the model stays loaded.
+REFINE_SESSION_TTL = int(os.environ.get("REFINE_SESSION_TTL", 30 * 60))
+
+# Redis keys
+SESSION_KEY_PREFIX = "session:contract:"
+
+
+async def get(contract_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Return the session a contract revision was generated in, if it's kept
+
+    A session is what llm.generate_contract_in_session returned: the Ollama
+    backend and context to continue from when refining the revision again.
+    Revisions refined by section keep their parent's session, with the
+    "unseen" instructions applied since the model's last reply.
+    """
+    if not REFINE_SESSIONS_ENABLED:
+        return None
+    try:
+        redis = await get_redis()
+        value = await redis.get(f"{SESSION_KEY_PREFIX}{contract_id}")
+        return codec.decode(value) if value is not None else None
+    except Exception as e:
+        # Sessions only save prompt evaluation; refine without one instead
+        print(f"Error reading refinement session: {e}")
+        return None
+
+
+async def save(contract_id: int, session: Dict[str, Any]):
+    """Keep the session a contract revision was generated in"""
+    try:
+        redis = await get_redis()
+        await redis.set(
+            f"{SESSION_KEY_PREFIX}{contract_id}",
+            codec.encode(session),
+            ex=REFINE_SESSION_TTL,
+        )
+    except Exception as e:
+        print(f"Error saving refinement session: {e}")
@@ -0,0 +1,143 @@
+import os
+import time
+import uuid
+import asyncio
+from typing import Awaitable, Callable, Dict
+
+from .db import get_redis
+
+# Single-flight configuration from environment variables
+SINGLEFLIGHT_ENABLED = os.environ.get("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+# Longest a replica may hold a key before others stop waiting for it (seconds);
+# this should exceed the Ollama generation timeout
+SINGLEFLIGHT_LOCK_TTL = int(os.environ.get("SINGLEFLIGHT_LOCK_TTL", 330))
+# How long a finished result stays available to waiting replicas (seconds)
+SINGLEFLIGHT_RESULT_TTL = 60
+
+# Redis keys
+LOCK_KEY_PREFIX = "singleflight:lock:"
+RESULT_KEY_PREFIX = "singleflight:result:"
+CHANNEL_PREFIX = "singleflight:done:"
+
+# Deletes the lock only if this caller still owns it
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Generations in flight in this process, by key
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+class _OwnerCancelled(Exception):
+    """Set on a shared future when the caller running fn was cancelled"""
+
+
+async def do(key: str, fn: Callable[[], Awaitable[str]]) -> str:
+    """
+    Run fn once for all concurrent callers with the same key
+
+    Callers in this process share one future. Across replicas, the first to
+    take the key's Redis lock runs fn and publishes the result; the others
+    wait for it instead of sending the same prompt to the model. If the
+    owner fails or times out, waiters fall back to running fn themselves,
+    and if the owner in this process is cancelled, one of its waiters takes
+    over.
+    """
+    if not SINGLEFLIGHT_ENABLED:
+        return await fn()
+
+    future = _inflight.get(key)
+    while future is not None:
+        try:
+            # Shield so one waiter giving up doesn't cancel it for everyone else
+            return await asyncio.shield(future)
+        except _OwnerCancelled:
+            # The first waiter back finds no future and runs fn itself; the
+            # rest wait for it
+            future = _inflight.get(key)
+
+    future = asyncio.get_running_loop().create_future()
+    # Don't warn about unretrieved exceptions when nobody else was waiting
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _inflight[key] = future
+    try:
+        result = await _do_shared(key, fn)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        # Waiters didn't ask to be cancelled; have them retry instead
+        future.set_exception(_OwnerCancelled())
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        del _inflight[key]
+
+
+async def _do_shared(key: str, fn: Callable[[], Awaitable[str]]) -> str:
+    """Run fn, or wait for the replica that holds the key's lock to run it"""
+    try:
+        redis = await get_redis()
+        token = uuid.uuid4().hex
+        acquired = await redis.set(
+            f"{LOCK_KEY_PREFIX}{key}", token, nx=True, ex=SINGLEFLIGHT_LOCK_TTL
+        )
+    except Exception as e:
+        # Coordination is an optimisation; never fail a generation because of it
+        print(f"Error taking single-flight lock: {e}")
+        return await fn()
+
+    if not acquired:
+        result = await _wait_for_result(key)
+        if result is not None:
+            return result
+        return await fn()
+
+    try:
+        result = await fn()
+        pipe = redis.pipeline()
+        pipe.set(f"{RESULT_KEY_PREFIX}{key}", result, ex=SINGLEFLIGHT_RESULT_TTL)
+        pipe.publish(f"{CHANNEL_PREFIX}{key}", "done")
+        await pipe.execute()
+        return result
+    except Exception:
+        await redis.publish(f"{CHANNEL_PREFIX}{key}", "failed")
+        raise
+    finally:
+        await redis.eval(_RELEASE_SCRIPT, 1, f"{LOCK_KEY_PREFIX}{key}", token)
+
+
+async def _wait_for_result(key: str):
+    """Wait for another replica's result; None if it failed or went away"""
+    redis = await get_redis()
+    pubsub = redis.pubsub()
+    try:
+        await pubsub.subscribe(f"{CHANNEL_PREFIX}{key}")
+        deadline = time.monotonic() + SINGLEFLIGHT_LOCK_TTL
+        while time.monotonic() < deadline:
+            # Checked every pass: the result may have landed before we
+            # subscribed, or the owner may have died without publishing
+            pipe = redis.pipeline(transaction=False)
+            pipe.get(f"{RESULT_KEY_PREFIX}{key}")
+            pipe.exists(f"{LOCK_KEY_PREFIX}{key}")
+            result, locked = await pipe.execute()
+            if result is not None:
+                return result.decode()
+            if not locked:
+                return None
+
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=1.0
+            )
+            if message and message["data"] == b"failed":
+                return None
+        return None
+    except Exception as e:
+        print(f"Error waiting for single-flight result: {e}")
+        return None
+    finally:
+        await pubsub.aclose()
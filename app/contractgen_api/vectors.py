@@ -0,0 +1,486 @@
+import os
+import re
+import json
+import uuid
+import fcntl
+import asyncio
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from . import db
+from . import contract_cache
+from .clauses import split_clauses
+from .search import tokenize
+
+# Vector index configuration from environment variables
+# Directory holding the clause embedding matrix
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", "vector_index")
+# Which registered embedder turns clauses into vectors
+EMBEDDER = os.environ.get("EMBEDDER", "hashing")
+# Dimensions of the hashing embedder's vectors
+HASHING_DIM = int(os.environ.get("HASHING_DIM", 512))
+# Rows scored per matrix multiply, which bounds search memory use
+VECTOR_SEARCH_CHUNK = 65536
+# Clauses shorter than this (after stripping) are headings or blank lines
+MIN_CLAUSE_LENGTH = 20
+
+# Index files: float32 vectors, one row per clause; the (contract ID, clause
+# position) of each row; and which embedder wrote them, which generation of
+# the other two files is current and how many of their rows are committed.
+# Each generation's files are named with its suffix.
+VECTORS_FILE = "vectors{}.f32"
+ROWS_FILE = "rows{}.i64"
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+# Any generation's vectors or rows file
+GENERATION_FILE = re.compile(r"^(vectors|rows)(\.\w+)?\.(f32|i64)$")
+
+
+class HashingEmbedder:
+    """
+    Embed text by hashing its terms into a fixed number of dimensions
+
+    Unigrams and bigrams are hashed with a random sign, weighted by
+    sublinear term frequency and L2-normalised, so a dot product between
+    two vectors is their cosine similarity. It needs no model or network.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = HASHING_DIM):
+        self.dim = dim
+
+    def _features(self, text: str) -> Counter:
+        terms = tokenize(text)
+        return Counter(terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])])
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                sign = 1.0 if value >> 63 else -1.0
+                vectors[row, value % self.dim] += sign * (1.0 + np.log(count))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+# Embedder factories by name; register others with register_embedder
+EMBEDDERS: Dict[str, Callable[[], Any]] = {"hashing": HashingEmbedder}
+
+
+def register_embedder(name: str, factory: Callable[[], Any]):
+    """
+    Make an embedder available through the EMBEDDER setting
+
+    The factory returns an object with `name`, `dim` and
+    `embed(texts) -> float32 array of L2-normalised rows`.
+    """
+    EMBEDDERS[name] = factory
+
+
+class VectorIndex:
+    """
+    Append-only clause embedding matrix backed by memory-mapped files
+
+    New clauses are appended to the end of the files under an exclusive
+    lock, so saving a contract never rewrites existing rows. An append is
+    committed by recording the new row count in the meta file once both
+    files are written; rows past that count, left by an append that never
+    finished, are cut off before the next one. Searches map the committed
+    rows read-only and remap only when more have been committed.
+
+    Files that may be mapped are never shortened below their committed
+    rows. Clearing or rebuilding the index writes a new generation of
+    files instead, which the meta file switches to; searches still mapping
+    the old generation keep reading it until they remap.
+    """
+
+    def __init__(self, directory: str, embedder):
+        self.directory = directory
+        self.embedder = embedder
+        self._vectors: Optional[np.ndarray] = None
+        self._rows: Optional[np.ndarray] = None
+        self._mapped: Optional[Tuple[str, int]] = None
+        # Guards the cached maps across the threads searches run in
+        self._map_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._check_meta()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _files(self, generation: str) -> Tuple[str, str]:
+        """Paths of a generation's vectors and rows files"""
+        suffix = f".{generation}" if generation else ""
+        return (
+            self._path(VECTORS_FILE.format(suffix)),
+            self._path(ROWS_FILE.format(suffix)),
+        )
+
+    def _check_meta(self):
+        """Start a fresh index if the stored one used another embedder"""
+        meta = {"embedder": self.embedder.name, "dim": self.embedder.dim}
+        with self._locked():
+            stored = self._read_meta()
+            if stored is not None and all(stored.get(k) == v for k, v in meta.items()):
+                # Indexes written before generations and row counts were
+                # kept have one set of files, and count every row in them
+                generation = stored.get("generation", "")
+                rows = stored.get("rows", self._file_rows(generation))
+                self._truncate(generation, rows)
+                self._write_meta({**meta, "generation": generation, "rows": rows})
+                self._remove_stale(generation)
+                return
+            if stored is not None:
+                print(
+                    f"Vector index was built with {stored}, not {meta}; starting "
+                    "a new one. Run `python -m contractgen_api.vectors rebuild`."
+                )
+            self._start_generation()
+
+    def _locked(self, shared: bool = False):
+        return _FileLock(self._path(LOCK_FILE), shared)
+
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(META_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, meta: Dict[str, Any]):
+        # Replaced whole, so readers see either the old state or the new one
+        tmp_path = self._path(f"{META_FILE}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path(META_FILE))
+
+    def _row_sizes(self) -> Tuple[int, int]:
+        return 4 * self.embedder.dim, 16
+
+    def _file_rows(self, generation: str) -> int:
+        """Rows present in both of a generation's files, committed or not"""
+        counts = []
+        for path, row_size in zip(self._files(generation), self._row_sizes()):
+            try:
+                counts.append(os.path.getsize(path) // row_size)
+            except FileNotFoundError:
+                counts.append(0)
+        return min(counts)
+
+    def _truncate(self, generation: str, rows: int):
+        """Cut a generation's files down to their first `rows` rows"""
+        for path, row_size in zip(self._files(generation), self._row_sizes()):
+            with open(path, "ab") as f:
+                if f.tell() > rows * row_size:
+                    f.truncate(rows * row_size)
+
+    def _remove_stale(self, generation: str):
+        """Delete the files of every generation but this one"""
+        current = {os.path.basename(path) for path in self._files(generation)}
+        for name in os.listdir(self.directory):
+            if GENERATION_FILE.match(name) and name not in current:
+                os.remove(self._path(name))
+
+    def _start_generation(self, generation: Optional[str] = None, rows: int = 0):
+        """
+        Switch the index to another generation of files; needs the lock held
+
+        A new, empty generation is started unless one is given with the
+        number of rows its files hold.
+        """
+        if generation is None:
+            generation = _new_generation()
+            self._truncate(generation, 0)
+        self._write_meta(
+            {
+                "embedder": self.embedder.name,
+                "dim": self.embedder.dim,
+                "generation": generation,
+                "rows": rows,
+            }
+        )
+        self._remove_stale(generation)
+
+    def clear(self):
+        """Remove every row from the index"""
+        with self._locked():
+            self._start_generation()
+
+    def staging(self) -> "VectorIndex":
+        """
+        An empty index to build a replacement for this one in
+
+        It's kept in a directory inside this one, so replace() can move its
+        files into place without copying them.
+        """
+        return VectorIndex(
+            tempfile.mkdtemp(prefix="rebuild-", dir=self.directory), self.embedder
+        )
+
+    def replace(self, staged: "VectorIndex"):
+        """Swap every row of the index for those built in a staging() index"""
+        with self._locked(), staged._locked():
+            meta = staged._read_meta()
+            generation = _new_generation()
+            for source, target in zip(
+                staged._files(meta["generation"]), self._files(generation)
+            ):
+                os.replace(source, target)
+            self._start_generation(generation, meta["rows"])
+
+    def append(self, contract_id: int, clauses: List[str]) -> int:
+        """Embed a contract's clauses and add them to the index"""
+        kept = [
+            (position, clause)
+            for position, clause in enumerate(clauses)
+            if len(clause.strip()) >= MIN_CLAUSE_LENGTH
+        ]
+        if not kept:
+            return 0
+        vectors = self.embedder.embed([clause for _, clause in kept])
+        rows = np.array(
+            [(contract_id, position) for position, _ in kept], dtype=np.int64
+        )
+
+        with self._locked():
+            meta = self._read_meta()
+            self._truncate(meta["generation"], meta["rows"])
+            for path, data in zip(
+                self._files(meta["generation"]), (vectors.astype(np.float32), rows)
+            ):
+                with open(path, "ab") as f:
+                    f.write(data.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._write_meta({**meta, "rows": meta["rows"] + len(kept)})
+        return len(kept)
+
+    def _map(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Map the committed rows, remapping only if they've changed"""
+        with self._map_lock, self._locked(shared=True):
+            # The lock keeps the files from being replaced while they're mapped
+            meta = self._read_meta()
+            mapped = (meta["generation"], meta["rows"])
+            if mapped != self._mapped:
+                count = meta["rows"]
+                vectors_path, rows_path = self._files(meta["generation"])
+                if count == 0:
+                    self._vectors = np.zeros((0, self.embedder.dim), np.float32)
+                    self._rows = np.zeros((0, 2), np.int64)
+                else:
+                    self._vectors = np.memmap(
+                        vectors_path,
+                        dtype=np.float32,
+                        mode="r",
+                        shape=(count, self.embedder.dim),
+                    )
+                    self._rows = np.memmap(
+                        rows_path,
+                        dtype=np.int64,
+                        mode="r",
+                        shape=(count, 2),
+                    )
+                self._mapped = mapped
+            return self._vectors, self._rows
+
+    def __len__(self) -> int:
+        return len(self._map()[0])
+
+    def search(
+        self, queries: List[str], limit: int
+    ) -> List[List[Tuple[int, int, float]]]:
+        """
+        Find the clauses most similar to each query, best first
+
+        Every query is scored in the same pass over the matrix, one chunk of
+        rows at a time, keeping only the running top `limit` per query.
+
+        Returns:
+            For each query, [(contract_id, clause_position, score)]
+        """
+        vectors, rows = self._map()
+        query_vectors = self.embedder.embed(queries).T
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+
+        for start in range(0, len(vectors), VECTOR_SEARCH_CHUNK):
+            chunk = vectors[start : start + VECTOR_SEARCH_CHUNK]
+            scores = np.concatenate([best_scores, (chunk @ query_vectors).T], axis=1)
+            indices = np.concatenate(
+                [best_rows, np.tile(start + np.arange(len(chunk)), (len(queries), 1))],
+                axis=1,
+            )
+            if scores.shape[1] > limit:
+                top = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+                scores = np.take_along_axis(scores, top, axis=1)
+                indices = np.take_along_axis(indices, top, axis=1)
+            best_scores, best_rows = scores, indices
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [
+            [
+                (int(rows[i, 0]), int(rows[i, 1]), float(score))
+                for i, score in zip(query_rows, query_scores)
+                if score > 0
+            ]
+            for query_rows, query_scores in zip(best_rows, best_scores)
+        ]
+
+
+class _FileLock:
+    """Lock on a file, shared by every process using the index"""
+
+    def __init__(self, path: str, shared: bool = False):
+        self.path = path
+        self.shared = shared
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        fcntl.flock(self._file, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+def _new_generation() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+_index: Optional[VectorIndex] = None
+
+
+def get_index() -> VectorIndex:
+    """Get or open the clause vector index"""
+    global _index
+    if _index is None:
+        if EMBEDDER not in EMBEDDERS:
+            raise ValueError(f"Unsupported embedder: {EMBEDDER}")
+        _index = VectorIndex(VECTOR_INDEX_DIR, EMBEDDERS[EMBEDDER]())
+    return _index
+
+
+async def index_contract(contract_id: int, content: str) -> int:
+    """Split a contract into clauses and add them to the vector index"""
+    return await asyncio.to_thread(
+        get_index().append, contract_id, split_clauses(content)
+    )
+
+
+async def search(
+    query: str, limit: int = 10, exclude: Iterable[int] = ()
+) -> List[Dict[str, Any]]:
+    """
+    Find the stored clauses most similar to a query, best first
+
+    Revisions repeat most of their contract's clauses, so identical clause
+    text is only returned once.
+
+    Args:
+        exclude: Contract IDs whose clauses are left out
+
+    Returns:
+        [{"contract_id": ..., "title": ..., "clause": ..., "score": ...}]
+    """
+    excluded: Set[int] = set(exclude)
+    # Over-fetch so duplicates and excluded contracts don't leave us short
+    hits = (
+        await asyncio.to_thread(get_index().search, [query], limit * 4 + len(excluded))
+    )[0]
+    hits = [hit for hit in hits if hit[0] not in excluded]
+
+    contract_ids = list(dict.fromkeys(contract_id for contract_id, _, _ in hits))
+    found = await contract_cache.get_contracts_json(contract_ids)
+    clauses = {
+        contract["id"]: (contract["title"], split_clauses(contract["content"]))
+        for contract, _ in filter(None, found)
+    }
+
+    results = []
+    seen = set()
+    for contract_id, position, score in hits:
+        if contract_id not in clauses:
+            continue
+        title, contract_clauses = clauses[contract_id]
+        if position >= len(contract_clauses):
+            continue
+        clause = contract_clauses[position].strip()
+        if clause in seen:
+            continue
+        seen.add(clause)
+        results.append(
+            {
+                "contract_id": contract_id,
+                "title": title,
+                "clause": clause,
+                "score": score,
+            }
+        )
+        if len(results) == limit:
+            break
+    return results
+
+
+async def rebuild() -> int:
+    """
+    Rebuild the vector index from every stored contract
+
+    The new index is built beside the current one, which keeps serving
+    searches until it's swapped in. Contracts saved meanwhile are added to
+    it afterwards; any indexed twice only repeat clauses, which searches
+    return once anyway.
+    """
+    index = get_index()
+    staged = await asyncio.to_thread(index.staging)
+    try:
+        indexed, cursor = await _index_contracts(staged, 0)
+        await asyncio.to_thread(index.replace, staged)
+    finally:
+        await asyncio.to_thread(shutil.rmtree, staged.directory, True)
+    caught_up, _ = await _index_contracts(index, cursor)
+    return indexed + caught_up
+
+
+async def _index_contracts(index: VectorIndex, cursor: int) -> Tuple[int, int]:
+    """Add every contract after the cursor to an index, returning how many
+    were added and the last ID seen"""
+    indexed = 0
+    while True:
+        page, next_cursor = await db.get_contracts_page(cursor, db.MAX_PAGE_SIZE)
+        for contract in page:
+            await asyncio.to_thread(
+                index.append, contract["id"], split_clauses(contract["content"])
+            )
+            cursor = contract["id"]
+        indexed += len(page)
+        if next_cursor is None:
+            return indexed, cursor
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Contract clause vector index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="Rebuild the index from stored contracts")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        print("Rebuilding vector index...")
+        count = await rebuild()
+        print(f"Indexed {count} contracts ({len(get_index())} clauses).")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
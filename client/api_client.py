@@ -2,8 +2,10 @@
 
 import argparse
 import asyncio
+import itertools
 import json
-from typing import Dict, Any, List
+import os
+from typing import Dict, Any, List, AsyncIterator, Optional, Tuple
 
 import httpx
 
@@ -11,9 +13,13 @@ import httpx
 class ContractGenClient:
     """Client for interacting with the Contract Generation API"""
 
-    def __init__(self, base_url: str = "http://localhost:8000"):
+    def __init__(self, base_url: str = "http://localhost:8000", cache_size: int = 1000):
         self.base_url = base_url
         self.client = httpx.AsyncClient(timeout=60.0)
+        # Recent GET responses by URL: their ETag, body and X-Next-Cursor.
+        # They're revalidated on every call, so unchanged ones cost a 304.
+        self.cache_size = cache_size
+        self._cache: Dict[str, Tuple[str, Any, Optional[str]]] = {}
 
     async def close(self):
         await self.client.aclose()
@@ -31,17 +37,167 @@ class ContractGenClient:
         response.raise_for_status()
         return response.json()
 
-    async def get_contract(self, contract_id: int) -> Dict[str, Any]:
-        """Get a specific contract by ID"""
-        response = await self.client.get(f"{self.base_url}/contracts/{contract_id}")
-        response.raise_for_status()
-        return response.json()
+    async def create_many(
+        self, contracts: List[Dict[str, Any]]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Create several contracts in one batch request
+
+        Each item needs a "title" and "description". Results are yielded as
+        the API finishes them, each with the "index" of its request item.
+        """
+        async for result in self._stream("/contracts/batch", contracts):
+            yield result
+
+    async def create_contract_stream(
+        self, title: str, description: str
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Create a contract, yielding the API's NDJSON events as they arrive"""
+        data = {"title": title, "description": description}
+        async for event in self._stream("/contracts/stream", data):
+            yield event
 
-    async def list_contracts(self) -> List[Dict[str, Any]]:
-        """List all contracts"""
-        response = await self.client.get(f"{self.base_url}/contracts/")
+    async def refine_contract_stream(
+        self, contract_id: int, refinement_prompt: str
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Refine a contract on the server, yielding NDJSON events as they arrive"""
+        data = {
+            "contract_id": contract_id,
+            "refinement_instructions": refinement_prompt,
+        }
+        async for event in self._stream("/contracts/refine/stream", data):
+            yield event
+
+    async def _stream(self, path: str, data: Any) -> AsyncIterator[Dict[str, Any]]:
+        """POST to a streaming endpoint and decode each NDJSON line"""
+        # Generation can pause between tokens, but never for the whole request
+        async with self.client.stream(
+            "POST", f"{self.base_url}{path}", json=data, timeout=300.0
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+    async def _get_json(
+        self, path: str, params: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Any, Optional[str]]:
+        """
+        GET a JSON resource, reusing the cached copy if the API says it's current
+
+        Returns the body and the X-Next-Cursor header that came with it.
+        """
+        url = str(httpx.URL(f"{self.base_url}{path}", params=params))
+        cached = self._cache.pop(url, None)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        response = await self.client.get(url, headers=headers)
+        if response.status_code == 304 and cached:
+            self._cache[url] = cached
+            return cached[1], cached[2]
         response.raise_for_status()
-        return response.json()
+
+        body = response.json()
+        next_cursor = response.headers.get("X-Next-Cursor")
+        etag = response.headers.get("ETag")
+        if etag and self.cache_size:
+            self._cache[url] = (etag, body, next_cursor)
+            if len(self._cache) > self.cache_size:
+                # Drop the least recently used response
+                del self._cache[next(iter(self._cache))]
+        return body, next_cursor
+
+    async def get_contract(self, contract_id: int) -> Dict[str, Any]:
+        """Get a specific contract by ID"""
+        contract, _ = await self._get_json(f"/contracts/{contract_id}")
+        return contract
+
+    async def list_contracts(
+        self, fields: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        List all contracts, following the API's pagination cursor
+
+        Pass `fields` (e.g. ["id", "title"]) to fetch only those fields.
+        """
+        contracts = []
+        params = {"fields": ",".join(fields)} if fields else {}
+        while True:
+            page, next_cursor = await self._get_json("/contracts/", dict(params))
+            contracts.extend(page)
+            if not next_cursor:
+                return contracts
+            params["cursor"] = next_cursor
+
+    async def export_to_file(self, path: str, resume: bool = True) -> int:
+        """
+        Export every contract to an NDJSON file, returning how many were written
+
+        With resume, an existing file is continued after its last complete
+        line instead of being started over.
+        """
+        after = 0
+        mode = "wb"
+        if resume and os.path.exists(path):
+            after = _resume_export(path)
+            mode = "ab"
+
+        count = 0
+        with open(path, mode) as f:
+            async with self.client.stream(
+                "GET",
+                f"{self.base_url}/contracts/export",
+                params={"after": after},
+                timeout=None,
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line:
+                        f.write(line.encode() + b"\n")
+                        count += 1
+        return count
+
+    async def import_from_file(
+        self, path: str, resume: bool = True, batch_lines: int = 1000
+    ) -> Dict[str, int]:
+        """
+        Import an NDJSON export file, sending it batch_lines lines at a time
+
+        Progress is kept next to the file (in path + ".progress"), so with
+        resume an interrupted import carries on after the last batch the API
+        accepted. The API skips contracts it already has, so a batch sent
+        twice does no harm.
+        """
+        progress_path = path + ".progress"
+        offset = 0
+        if resume and os.path.exists(progress_path):
+            with open(progress_path) as f:
+                offset = int(f.read().strip() or 0)
+
+        totals = {"imported": 0, "skipped": 0}
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                body = b"".join(itertools.islice(f, batch_lines))
+                if not body:
+                    break
+                response = await self.client.post(
+                    f"{self.base_url}/contracts/import",
+                    content=body,
+                    headers={"Content-Type": "application/x-ndjson"},
+                    timeout=300.0,
+                )
+                response.raise_for_status()
+                result = response.json()
+                totals["imported"] += result["imported"]
+                totals["skipped"] += result["skipped"]
+
+                offset += len(body)
+                with open(progress_path, "w") as progress:
+                    progress.write(str(offset))
+
+        if os.path.exists(progress_path):
+            os.remove(progress_path)
+        return totals
 
     async def refine_contract(
         self, contract_id: int, refinement_prompt: str
@@ -63,6 +219,38 @@ Refinement Instructions:
         return await self.create_contract(refined_title, refinement_description)
 
 
+def _resume_export(path: str) -> int:
+    """
+    Drop a partly written last line from an export file
+
+    Returns the ID on the last complete line, or 0 if there is none.
+    """
+    with open(path, "r+b") as f:
+        end = f.seek(0, os.SEEK_END)
+        tail = b""
+        # Read backwards until the whole last complete line is in `tail`
+        while end > 0 and tail.count(b"\n") < 2:
+            start = max(0, end - 65536)
+            f.seek(start)
+            tail = f.read(end - start) + tail
+            end = start
+        complete = tail[: tail.rfind(b"\n") + 1]
+        f.truncate(end + len(complete))
+    lines = complete.splitlines()
+    return json.loads(lines[-1])["id"] if lines else 0
+
+
+async def print_stream(events: AsyncIterator[Dict[str, Any]]):
+    """Print streamed contract tokens, then the saved contract's ID"""
+    async for event in events:
+        if "token" in event:
+            print(event["token"], end="", flush=True)
+        elif "error" in event:
+            raise RuntimeError(event["error"])
+        elif event.get("done"):
+            print(f"\n\nContract saved with ID: {event['id']}")
+
+
 async def main():
     parser = argparse.ArgumentParser(description="Contract Generation Client")
     parser.add_argument("--api-url", default="http://localhost:8000", help="API URL")
@@ -78,6 +266,19 @@ async def main():
     create_parser.add_argument(
         "--description", required=True, help="Contract description"
     )
+    create_parser.add_argument(
+        "--stream", action="store_true", help="Print the contract as it is generated"
+    )
+
+    # Create many contracts command
+    create_many_parser = subparsers.add_parser(
+        "create-many", help="Create several contracts in one batch"
+    )
+    create_many_parser.add_argument(
+        "--file",
+        required=True,
+        help='JSON file with a list of {"title": ..., "description": ...} objects',
+    )
 
     # Get contract command
     get_parser = subparsers.add_parser("get", help="Get a specific contract")
@@ -86,6 +287,22 @@ async def main():
     # List contracts command
     subparsers.add_parser("list", help="List all contracts")
 
+    # Export and import commands
+    export_parser = subparsers.add_parser(
+        "export", help="Export every contract to an NDJSON file"
+    )
+    export_parser.add_argument("--file", required=True, help="File to write")
+    export_parser.add_argument(
+        "--restart", action="store_true", help="Start over instead of resuming"
+    )
+    import_parser = subparsers.add_parser(
+        "import", help="Import contracts from an NDJSON export file"
+    )
+    import_parser.add_argument("--file", required=True, help="File to read")
+    import_parser.add_argument(
+        "--restart", action="store_true", help="Start over instead of resuming"
+    )
+
     # Refine contract command
     refine_parser = subparsers.add_parser("refine", help="Refine an existing contract")
     refine_parser.add_argument(
@@ -94,6 +311,9 @@ async def main():
     refine_parser.add_argument(
         "--prompt", required=True, help="Refinement instructions"
     )
+    refine_parser.add_argument(
+        "--stream", action="store_true", help="Print the contract as it is generated"
+    )
 
     args = parser.parse_args()
 
@@ -104,6 +324,11 @@ async def main():
             result = await client.health_check()
             print(json.dumps(result, indent=2))
 
+        elif args.command == "create" and args.stream:
+            await print_stream(
+                client.create_contract_stream(args.title, args.description)
+            )
+
         elif args.command == "create":
             result = await client.create_contract(args.title, args.description)
             print("\nContract created successfully:")
@@ -112,6 +337,20 @@ async def main():
             print("\nContent:")
             print(result["content"])
 
+        elif args.command == "create-many":
+            with open(args.file) as f:
+                contracts = json.load(f)
+            async for result in client.create_many(contracts):
+                if "index" not in result:
+                    raise RuntimeError(result["error"])
+                title = contracts[result["index"]]["title"]
+                if "error" in result:
+                    print(f"[{result['index']}] {title}: failed: {result['error']}")
+                else:
+                    print(
+                        f"[{result['index']}] {title}: created with ID {result['id']}"
+                    )
+
         elif args.command == "get":
             result = await client.get_contract(args.id)
             print("\nContract details:")
@@ -121,11 +360,25 @@ async def main():
             print(result["content"])
 
         elif args.command == "list":
-            results = await client.list_contracts()
+            results = await client.list_contracts(fields=["id", "title"])
             print("\nAvailable contracts:")
             for contract in results:
                 print(f"ID: {contract['id']}, Title: {contract['title']}")
 
+        elif args.command == "export":
+            count = await client.export_to_file(args.file, resume=not args.restart)
+            print(f"Exported {count} contracts to {args.file}")
+
+        elif args.command == "import":
+            result = await client.import_from_file(args.file, resume=not args.restart)
+            print(
+                f"Imported {result['imported']} contracts from {args.file} "
+                f"({result['skipped']} already present)"
+            )
+
+        elif args.command == "refine" and args.stream:
+            await print_stream(client.refine_contract_stream(args.id, args.prompt))
+
         elif args.command == "refine":
             result = await client.refine_contract(args.id, args.prompt)
             print("\nContract refined successfully:")
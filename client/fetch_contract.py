@@ -4,6 +4,8 @@ import requests
 import json
 import time
 
+import http_cache
+
 
 def fetch_contract(
     contract_id,
@@ -27,11 +29,10 @@ def fetch_contract(
     for attempt in range(max_retries):
         try:
             print(f"Attempt {attempt + 1}/{max_retries}")
-            response = requests.get(
+            # Only downloaded again if it changed since the last fetch
+            contract, _ = http_cache.get_json(
                 f"{base_url}/contracts/{contract_id}", timeout=60
             )  # 1 minute timeout
-            response.raise_for_status()
-            contract = response.json()
 
             if output_format == "json":
                 print(json.dumps(contract, indent=2))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+
+import requests
+
+# Where the scripts keep the responses they fetched, to revalidate them
+# with their ETags next time; set to an empty string to always refetch
+CACHE_DIR = os.environ.get(
+    "CONTRACTGEN_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "contractgen"),
+)
+# Response headers kept with a cached body
+KEPT_HEADERS = ("X-Next-Cursor",)
+
+
+def _path(url):
+    return os.path.join(CACHE_DIR, hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _store(path, entry):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write a whole new file, so a concurrent run never reads half of one
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Warning: could not cache response: {e}")
+
+
+def get_json(url, params=None, timeout=60):
+    """
+    GET a JSON resource, reusing the cached copy if the API says it's current
+
+    Raises requests.exceptions.HTTPError for error responses, like
+    raise_for_status().
+
+    Returns:
+        The decoded body and the KEPT_HEADERS that came with it
+    """
+    full_url = requests.Request("GET", url, params=params).prepare().url
+    path = _path(full_url) if CACHE_DIR else None
+    cached = _load(path) if path else None
+
+    headers = {"If-None-Match": cached["etag"]} if cached else {}
+    response = requests.get(full_url, headers=headers, timeout=timeout)
+    if response.status_code == 304 and cached:
+        return cached["body"], cached["headers"]
+    response.raise_for_status()
+
+    body = response.json()
+    kept = {
+        name: response.headers[name]
+        for name in KEPT_HEADERS
+        if name in response.headers
+    }
+    etag = response.headers.get("ETag")
+    if path and etag:
+        _store(path, {"etag": etag, "headers": kept, "body": body})
+    return body, kept
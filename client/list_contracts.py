@@ -4,6 +4,8 @@ import requests
 import sys
 import time
 
+import http_cache
+
 
 def list_contracts(base_url="http://api:8000", max_retries=5, retry_delay=2):
     """
@@ -19,11 +21,21 @@ def list_contracts(base_url="http://api:8000", max_retries=5, retry_delay=2):
     for attempt in range(max_retries):
         try:
             print(f"Attempt {attempt + 1}/{max_retries}")
-            response = requests.get(
-                f"{base_url}/contracts/", timeout=60
-            )  # 1 minute timeout
-            response.raise_for_status()
-            contracts = response.json()
+            contracts = []
+            # Only IDs and titles are printed, so don't download the bodies
+            params = {"fields": "id,title"}
+            while True:
+                # Pages that haven't changed since the last run aren't
+                # downloaded again
+                page, headers = http_cache.get_json(
+                    f"{base_url}/contracts/", params=params, timeout=60
+                )  # 1 minute timeout
+                contracts.extend(page)
+                # The API pages its results; follow the cursor to the end
+                next_cursor = headers.get("X-Next-Cursor")
+                if not next_cursor:
+                    break
+                params["cursor"] = next_cursor
 
             print("\nAvailable contracts:")
             if not contracts: